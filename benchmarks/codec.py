@@ -0,0 +1,57 @@
+"""
+Benchmark dos codecs de mensagem (JSON x binário).
+
+Uso: python -m benchmarks.codec
+"""
+import timeit
+
+from network import codec
+from utils.crypto import encrypt_message
+
+
+def sample_messages():
+    """Mensagens típicas de uma sala de chat"""
+    return {
+        'typing_status': {
+            "type": "typing_status",
+            "data": {"username": "alice", "status": "typing"}
+        },
+        'user_join': {
+            "type": "user_join",
+            "data": {"username": "alice"}
+        },
+        'user_list': {
+            "type": "user_list",
+            "data": {"users": {"alice": "online", "bob": "typing"}}
+        },
+        'chat': {
+            "type": "chat",
+            "username": "alice",
+            "content": encrypt_message("Olá, tudo bem? Chegou o arquivo?"),
+            "encrypted": True
+        },
+    }
+
+
+def measure(codec_name, message, number):
+    impl = codec.get_codec(codec_name)
+    payload = impl.encode(message)
+    encode_time = timeit.timeit(lambda: impl.encode(message), number=number)
+    decode_time = timeit.timeit(lambda: impl.decode(payload), number=number)
+    return len(payload), number / encode_time, number / decode_time
+
+
+def main(number=20000):
+    print(f"{'mensagem':<15} {'codec':<7} {'bytes':>6} {'enc/s':>12} {'dec/s':>12}")
+    for name, message in sample_messages().items():
+        results = {}
+        for codec_name in ('json', 'binary'):
+            results[codec_name] = measure(codec_name, message, number)
+            size, enc, dec = results[codec_name]
+            print(f"{name:<15} {codec_name:<7} {size:>6} {enc:>12,.0f} {dec:>12,.0f}")
+        saved = 1 - results['binary'][0] / results['json'][0]
+        print(f"{'':<15} {'':<7} {saved:>6.0%} menor")
+
+
+if __name__ == '__main__':
+    main()
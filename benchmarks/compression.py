@@ -0,0 +1,83 @@
+"""
+Benchmark da compressão de frames: razão e custo de CPU por tamanho.
+
+Uso: python -m benchmarks.compression
+"""
+import os
+import json
+import timeit
+
+from network import compression
+
+SIZES = (16, 64, 256, 1024, 4096, 16384, 65536)
+
+# (método, nível)
+VARIANTS = (
+    (compression.ZDICT, 6),
+    ('zlib', 1),
+    ('zlib', 6),
+    ('zlib', 9),
+    ('lzma', 1),
+    ('lzma', 6),
+)
+
+
+def sample_frame(size):
+    """Payload de mensagens de chat e de sistema com o tamanho pedido"""
+    out = bytearray()
+    i = 0
+    while len(out) < size:
+        name = f"usuario{i % 7}"
+        messages = (
+            {"type": "typing_status", "data": {"username": name, "status": "typing"}},
+            {"type": "chat", "username": name, "content": f"Mensagem número {i}, tudo certo?"},
+            {"type": "user_list", "data": {"users": {name: "online", "alice": "away"}}},
+        )
+        out += json.dumps(messages[i % 3], separators=(',', ':')).encode('utf-8')
+        i += 1
+    return bytes(out[:size])
+
+
+def random_frame(size):
+    """Payload sem redundância (como um token cifrado em bytes crus)"""
+    return os.urandom(size)
+
+
+def measure(data, name, level, number):
+    packed = compression.compress(data, name, level)
+    compress_time = timeit.timeit(
+        lambda: compression.compress(data, name, level), number=number
+    ) / number
+    if packed is None:
+        return None, compress_time, 0.0
+    decompress_time = timeit.timeit(
+        lambda: compression.decompress(packed), number=number
+    ) / number
+    return len(packed), compress_time, decompress_time
+
+
+def report(title, build, number):
+    print(title)
+    print(f"{'bytes':>6} {'método':<16} {'saída':>7} {'razão':>6} {'comp µs':>9} {'desc µs':>9} {'MB/s':>8}")
+    for size in SIZES:
+        data = build(size)
+        runs = max(20, number * 64 // size)
+        for name, level in VARIANTS:
+            packed, comp, decomp = measure(data, name, level, runs)
+            label = f"{name.split('-')[0]}-{level}"
+            rate = size / comp / 1e6
+            if packed is None:
+                print(f"{size:>6} {label:<16} {'pula':>7} {'':>6} {comp * 1e6:>9.1f} {'':>9} {rate:>8.1f}")
+            else:
+                print(f"{size:>6} {label:<16} {packed:>7} {packed / size:>6.2f} "
+                      f"{comp * 1e6:>9.1f} {decomp * 1e6:>9.1f} {rate:>8.1f}")
+    print()
+
+
+def main(number=2000):
+    report("Mensagens de chat e sistema (JSON)", sample_frame, number)
+    report("Payload cifrado (sem redundância)", random_frame, number)
+
+
+if __name__ == '__main__':
+    main()
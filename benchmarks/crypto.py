@@ -0,0 +1,154 @@
+"""
+Benchmark da criptografia das mensagens: a chave fixa (Fernet, texto
+base64 dentro do JSON) contra as cifras de sessão AEAD (bytes crus com
+OVERHEAD bytes a mais por frame). Mede também a vazão de encrypt_file e
+decrypt_file (em fluxo, blocos de FILE_CHUNK) e como ela cresce com o
+número de threads, de 1 até FILE_WORKERS, e o custo de uma prévia com
+EncryptedFile (leitura aleatória) contra decifrar o arquivo todo.
+
+Uso: python -m benchmarks.crypto
+"""
+import os
+import time
+import random
+import timeit
+import tempfile
+
+from utils.crypto import (
+    CIPHERS, OVERHEAD, FILE_WORKERS, KeyExchange, EncryptedFile, encrypt_message,
+    decrypt_message, encrypt_file, decrypt_file
+)
+
+SIZES = (16, 64, 256, 1024, 4096, 16384, 65536)
+
+# Tamanhos (MB) dos arquivos cifrados em fluxo
+FILE_SIZES = (16, 64, 256)
+
+# Arquivo (MB) da curva de escala por número de threads
+SCALING_SIZE = 256
+
+# Prévias: leituras de PREVIEW_READ bytes em posições aleatórias
+PREVIEW_READ = 4096
+PREVIEW_COUNT = 1000
+
+
+def session_pair(name):
+    """Cifras dos dois lados de uma conexão com a cifra pedida"""
+    initiator, responder = KeyExchange(), KeyExchange()
+    sender = initiator.derive(responder.public_b64(), name, initiator=True)
+    receiver = responder.derive(initiator.public_b64(), name, initiator=False)
+    return sender, receiver
+
+
+def measure_fernet(data, number):
+    token = encrypt_message(data)
+    seal = timeit.timeit(lambda: encrypt_message(data), number=number) / number
+    opened = timeit.timeit(lambda: decrypt_message(token, raw=True), number=number) / number
+    return len(token.encode('utf-8')), seal, opened
+
+
+def measure_session(data, name, number):
+    sender, receiver = session_pair(name)
+    sealed = sender.seal(data, b'aad')
+    # Cada open precisa de um contador novo (proteção contra replay)
+    tokens = [sender.seal(data, b'aad') for _ in range(number)]
+    seal = timeit.timeit(lambda: sender.seal(data, b'aad'), number=number) / number
+    it = iter(tokens)
+    opened = timeit.timeit(lambda: receiver.open(next(it), b'aad'), number=number) / number
+    assert len(sealed) == len(data) + OVERHEAD
+    return len(sealed), seal, opened
+
+
+def write_random(directory, megabytes):
+    path = os.path.join(directory, 'plain')
+    with open(path, 'wb') as f:
+        for _ in range(megabytes):
+            f.write(os.urandom(1024 * 1024))
+    return path
+
+
+def measure_file(path, megabytes, cipher, workers=None):
+    """(MB/s cifrando, MB/s decifrando) de um arquivo"""
+    start = time.perf_counter()
+    encrypted = encrypt_file(path, cipher=cipher, workers=workers)
+    middle = time.perf_counter()
+    decrypt_file(encrypted, path + '.out', workers=workers)
+    end = time.perf_counter()
+    return megabytes / (middle - start), megabytes / (end - middle)
+
+
+def files():
+    print(f"{'MB':>6} {'cifra':<18} {'cifra MB/s':>11} {'decif MB/s':>11}")
+    with tempfile.TemporaryDirectory() as directory:
+        for megabytes in FILE_SIZES:
+            path = write_random(directory, megabytes)
+            for name in CIPHERS:
+                seal, opened = measure_file(path, megabytes, name)
+                print(f"{megabytes:>6} {name:<18} {seal:>11.0f} {opened:>11.0f}")
+    print()
+
+
+def scaling(megabytes=SCALING_SIZE):
+    """Vazão por número de threads (potências de 2 até FILE_WORKERS)"""
+    counts = sorted({1 << i for i in range(FILE_WORKERS.bit_length())} | {FILE_WORKERS})
+    print(f"Escala com threads ({megabytes} MB, {FILE_WORKERS} núcleos)")
+    print(f"{'threads':>7} {'cifra':<18} {'cifra MB/s':>11} {'decif MB/s':>11} {'ganho':>6}")
+    with tempfile.TemporaryDirectory() as directory:
+        path = write_random(directory, megabytes)
+        for name in CIPHERS:
+            base = None
+            for workers in counts:
+                seal, opened = measure_file(path, megabytes, name, workers)
+                base = base or seal
+                print(f"{workers:>7} {name:<18} {seal:>11.0f} {opened:>11.0f} {seal / base:>6.2f}")
+    print()
+
+
+def preview(megabytes=SCALING_SIZE):
+    """Leituras aleatórias com EncryptedFile contra decrypt_file inteiro"""
+    print(f"Prévia de {PREVIEW_READ} bytes num arquivo de {megabytes} MB")
+    with tempfile.TemporaryDirectory() as directory:
+        path = write_random(directory, megabytes)
+        encrypted = encrypt_file(path)
+        start = time.perf_counter()
+        decrypt_file(encrypted, path + '.out')
+        whole = time.perf_counter() - start
+        size = megabytes * 1024 * 1024
+        offsets = [random.randrange(size - PREVIEW_READ) for _ in range(PREVIEW_COUNT)]
+        start = time.perf_counter()
+        with EncryptedFile(encrypted) as f:
+            opened = time.perf_counter() - start
+            start = time.perf_counter()
+            for offset in offsets:
+                f.read(offset, PREVIEW_READ)
+            cold = (time.perf_counter() - start) / PREVIEW_COUNT
+            start = time.perf_counter()
+            for _ in range(PREVIEW_COUNT):
+                f.read(offsets[-1], PREVIEW_READ)
+            cached = (time.perf_counter() - start) / PREVIEW_COUNT
+    print(f"decrypt_file inteiro {whole * 1e3:>10.1f} ms")
+    print(f"abrir EncryptedFile  {opened * 1e3:>10.3f} ms")
+    print(f"leitura aleatória    {cold * 1e6:>10.1f} µs")
+    print(f"leitura no cache     {cached * 1e6:>10.1f} µs")
+    print()
+
+
+def main(number=2000):
+    print(f"{'bytes':>6} {'cifra':<18} {'saída':>7} {'extra':>6} {'cifra µs':>9} "
+          f"{'decif µs':>9} {'MB/s':>8}")
+    for size in SIZES:
+        data = os.urandom(size)
+        runs = max(20, number * 64 // size)
+        rows = [('fernet', measure_fernet(data, runs))]
+        rows += [(name, measure_session(data, name, runs)) for name in CIPHERS]
+        for label, (out, seal, opened) in rows:
+            print(f"{size:>6} {label:<18} {out:>7} {out - size:>6} {seal * 1e6:>9.1f} "
+                  f"{opened * 1e6:>9.1f} {size / seal / 1e6:>8.1f}")
+    print()
+    files()
+    scaling()
+    preview()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmark do handshake: custo da senha da sala (scrypt, frio e em
+cache), tempo do hello até a entrada na sala com e sem senha, e o
+limite de senhas erradas por endereço.
+
+Uso: python -m benchmarks.handshake
+"""
+import time
+import logging
+import threading
+import statistics
+
+from network.engine import Engine
+from utils import pake
+
+ROOM = 'benchmark'
+PASSWORD = 'senha da sala'
+CONNECTIONS = 50
+
+
+def kdf():
+    pake.clear_room_keys()
+    start = time.perf_counter()
+    pake.room_key(ROOM, PASSWORD)
+    cold = time.perf_counter() - start
+    start = time.perf_counter()
+    pake.room_key(ROOM, PASSWORD)
+    cached = time.perf_counter() - start
+    print(f"scrypt (N={pake.SCRYPT_N}) frio {cold * 1e3:>8.1f} ms  em cache {cached * 1e6:>6.1f} µs")
+    print()
+
+
+def start_engine(**kwargs):
+    engine = Engine(**kwargs)
+    threading.Thread(target=engine.run, daemon=True).start()
+    return engine
+
+
+def connect(client, port, password, timeout=5.0):
+    """Conecta e espera a entrada (ou a queda); retorna o peer"""
+    done = threading.Event()
+    client.on_join = client.on_disconnect = lambda peer: done.set()
+    peer = client.connect('127.0.0.1', port, room=ROOM, password=password)
+    done.wait(timeout)
+    return peer
+
+
+def close(client, peer):
+    """Encerra o peer e espera, para a queda não contar na próxima conexão"""
+    client.call_soon(client._finalize, peer)
+    while not peer.closed:
+        time.sleep(0.001)
+
+
+def handshakes():
+    print(f"{'handshake':<12} {'mediana ms':>11} {'p95 ms':>8}")
+    for label, ciphers, password in (
+        ('sem cifra', [], None),
+        ('x25519', None, None),
+        ('senha', None, PASSWORD),
+    ):
+        server = start_engine(ciphers=ciphers)
+        port = server.listen('127.0.0.1', 0)[1]
+        server.open_room(ROOM, password=password)
+        client = start_engine(ciphers=ciphers)
+        times = []
+        for _ in range(CONNECTIONS):
+            peer = connect(client, port, password)
+            if peer.handshake_time is not None and peer.joined:
+                times.append(peer.handshake_time)
+            close(client, peer)
+        client.stop()
+        server.stop()
+        times.sort()
+        p95 = times[int(len(times) * 0.95) - 1]
+        print(f"{label:<12} {statistics.median(times) * 1e3:>11.2f} {p95 * 1e3:>8.2f}")
+    print()
+
+
+def throttling(attempts=20):
+    """Senhas erradas seguidas de um mesmo endereço"""
+    server = start_engine()
+    port = server.listen('127.0.0.1', 0)[1]
+    server.open_room(ROOM, password=PASSWORD)
+    client = start_engine()
+    start = time.perf_counter()
+    for i in range(attempts):
+        connect(client, port, f'errada {i}')
+    elapsed = time.perf_counter() - start
+    time.sleep(0.1)
+    stats = server.stats
+    print(f"{attempts} senhas erradas em {elapsed:.2f} s: {stats['auth_failures']} testadas, "
+          f"{stats['auth_throttled']} recusadas pelo limite")
+    client.stop()
+    server.stop()
+    print()
+
+
+def main():
+    # Os avisos de senha errada são esperados aqui
+    logging.getLogger('winp2p').setLevel(logging.ERROR)
+    kdf()
+    handshakes()
+    throttling()
+
+
+if __name__ == '__main__':
+    main()
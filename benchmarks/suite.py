@@ -0,0 +1,281 @@
+"""
+Suíte de benchmarks do caminho de uma mensagem de chat, com referência
+(baseline) para achar regressões entre versões.
+
+Cada pipeline passa uma mensagem de chat por todas as etapas, como faz a
+conexão: codificar, cifrar, montar os frames (fragmentos de
+FRAGMENT_SIZE), remontar com FrameReader, decifrar e decodificar. Cada
+etapa é cronometrada separadamente em cada iteração, para tamanhos de
+10 B a 10 MB, e o resultado são os percentis de latência (p50, p95, p99)
+e a vazão.
+
+Pipelines:
+  fernet-json, fernet-binary  chave fixa: o conteúdo vira um token Fernet
+                              dentro da mensagem (peers antigos)
+  <cifra>-json, <cifra>-binary  cifra de sessão: a mensagem vai em claro
+                              no codec e cada fragmento é selado (AEAD)
+
+Uso:
+  python -m benchmarks.suite                  só mede
+  python -m benchmarks.suite --save           mede e grava a referência
+  python -m benchmarks.suite --check          compara com a referência e
+                                              sai com 1 se algo piorou
+
+A referência só vale para a máquina em que foi gravada.
+"""
+import sys
+import json
+import time
+import platform
+import argparse
+
+from network import codec
+from network.engine import AAD, seal_frame
+from network.framing import KIND_DATA, FLAG_ENCRYPTED, Frame, FrameReader, fragment
+from utils.crypto import CIPHERS, KeyExchange, encrypt_message, decrypt_message
+
+SIZES = (10, 100, 1000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+STAGES = ('encode', 'encrypt', 'frame', 'unframe', 'decrypt', 'decode')
+
+BASELINE = 'benchmarks/baseline.json'
+
+# Piora aceita na mediana antes de --check falhar
+THRESHOLD = 0.25
+
+# Etapas mais rápidas que isto variam demais para serem comparadas
+MIN_COMPARE_NS = 2000
+
+# Bytes processados por tamanho (define o número de iterações)
+BUDGET = 64 * 1024 * 1024
+MIN_RUNS = 5
+MAX_RUNS = 2000
+
+
+def chat_message(size):
+    """Mensagem de chat com size caracteres de conteúdo"""
+    return {"type": "chat", "username": "alice", "content": 'x' * size}
+
+
+def session_pair(name):
+    """Cifras dos dois lados de uma conexão com a cifra pedida"""
+    initiator, responder = KeyExchange(), KeyExchange()
+    sender = initiator.derive(responder.public_b64(), name, initiator=True)
+    receiver = responder.derive(initiator.public_b64(), name, initiator=False)
+    return sender, receiver
+
+
+def to_wire(frames):
+    return b''.join(frame.to_bytes() for frame in frames)
+
+
+def from_wire(data):
+    """Frames recebidos, em pedaços do tamanho do buffer do FrameReader"""
+    reader = FrameReader()
+    view = memoryview(data)
+    frames = []
+    while view:
+        buffer = reader.get_buffer()
+        size = min(len(buffer), len(view))
+        buffer[:size] = view[:size]
+        view = view[size:]
+        frames += reader.buffer_updated(size)
+    return frames
+
+
+def fernet_pipeline(codec_name):
+    """Etapas do caminho com a chave fixa: (etapa, função) em ordem"""
+    def encrypt(message):
+        return dict(message, content=encrypt_message(message["content"]), encrypted=True)
+
+    def encode(message):
+        return codec.encode(message, codec_name)
+
+    def frame(payload):
+        return to_wire(fragment(Frame(payload)))
+
+    def unframe(data):
+        return b''.join(frame.payload for frame in from_wire(data))
+
+    def decrypt(message):
+        return dict(message, content=decrypt_message(message["content"]))
+
+    return [
+        ('encrypt', encrypt), ('encode', encode), ('frame', frame),
+        ('unframe', unframe), ('decode', codec.decode), ('decrypt', decrypt),
+    ]
+
+
+def session_pipeline(codec_name, cipher):
+    """Etapas do caminho com a cifra de sessão, como em Engine._write/_on_data"""
+    sender, receiver = session_pair(cipher)
+
+    def encode(message):
+        return codec.encode(message, codec_name)
+
+    def encrypt(payload):
+        return [seal_frame(sender, frame) for frame in fragment(Frame(payload))]
+
+    def unframe(data):
+        return from_wire(data)
+
+    def decrypt(frames):
+        return b''.join(
+            receiver.open(frame.payload, AAD.pack(KIND_DATA, frame.flags, frame.stream))
+            for frame in frames if frame.flags & FLAG_ENCRYPTED
+        )
+
+    return [
+        ('encode', encode), ('encrypt', encrypt), ('frame', to_wire),
+        ('unframe', unframe), ('decrypt', decrypt), ('decode', codec.decode),
+    ]
+
+
+def pipelines():
+    result = {}
+    for codec_name in ('json', 'binary'):
+        result[f'fernet-{codec_name}'] = lambda c=codec_name: fernet_pipeline(c)
+        for cipher in CIPHERS:
+            result[f'{cipher}-{codec_name}'] = lambda c=codec_name, n=cipher: session_pipeline(c, n)
+    return result
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summarize(samples, size):
+    ordered = sorted(samples)
+    p50 = percentile(ordered, 0.50)
+    return {
+        'runs': len(ordered),
+        'p50_ns': p50,
+        'p95_ns': percentile(ordered, 0.95),
+        'p99_ns': percentile(ordered, 0.99),
+        'mb_s': size / p50 * 1e3 if p50 else 0.0,
+    }
+
+
+def measure(stages, size, runs):
+    """Percentis por etapa (e do total) de runs mensagens de size bytes"""
+    message = chat_message(size)
+    timings = {name: [] for name, _ in stages}
+    timings['total'] = []
+    clock = time.perf_counter_ns
+    for i in range(runs + 1):
+        value = message
+        total = 0
+        for name, job in stages:
+            start = clock()
+            value = job(value)
+            elapsed = clock() - start
+            total += elapsed
+            if i:
+                timings[name].append(elapsed)
+        if i:
+            timings['total'].append(total)
+        else:
+            # A primeira volta só aquece caches e confere o resultado
+            assert value["content"] == message["content"], 'mensagem corrompida'
+    return {name: summarize(samples, size) for name, samples in timings.items()}
+
+
+def runs_for(size, quick=False):
+    runs = max(MIN_RUNS, min(MAX_RUNS, BUDGET // size))
+    return max(MIN_RUNS, runs // 10) if quick else runs
+
+
+def run(sizes=SIZES, names=None, quick=False):
+    """Mede os pipelines; retorna {'pipeline/tamanho/etapa': resultado}"""
+    results = {}
+    available = pipelines()
+    for name in names or available:
+        for size in sizes:
+            measured = measure(available[name](), size, runs_for(size, quick))
+            for stage, result in measured.items():
+                results[f'{name}/{size}/{stage}'] = result
+            report(name, size, measured)
+    return results
+
+
+def report(name, size, measured):
+    for stage in STAGES + ('total',):
+        r = measured[stage]
+        print(f"{name:<26} {size:>9} {stage:<8} {r['p50_ns'] / 1e3:>11.1f} "
+              f"{r['p95_ns'] / 1e3:>11.1f} {r['p99_ns'] / 1e3:>11.1f} {r['mb_s']:>9.1f}")
+
+
+def header():
+    print(f"{'pipeline':<26} {'bytes':>9} {'etapa':<8} {'p50 µs':>11} "
+          f"{'p95 µs':>11} {'p99 µs':>11} {'MB/s':>9}")
+
+
+def machine():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+
+def save(results, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'machine': machine(), 'results': results}, f, indent=1, sort_keys=True)
+    print(f"Referência gravada em {path} ({len(results)} medidas)")
+
+
+def check(results, path, threshold=THRESHOLD):
+    """Lista as medidas cuja mediana piorou mais que threshold; retorna o número delas"""
+    with open(path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    reference = baseline['results']
+    if baseline.get('machine', {}).get('platform') != platform.platform():
+        print(f"Aviso: referência gravada em outra máquina ({baseline['machine'].get('platform')})")
+
+    regressions = []
+    for key, result in results.items():
+        old = reference.get(key)
+        if old is None or max(old['p50_ns'], result['p50_ns']) < MIN_COMPARE_NS:
+            continue
+        change = result['p50_ns'] / old['p50_ns'] - 1
+        if change > threshold:
+            regressions.append((key, old['p50_ns'], result['p50_ns'], change))
+
+    print()
+    if not regressions:
+        print(f"Nenhuma regressão acima de {threshold:.0%} em relação a {path}")
+        return 0
+    print(f"{len(regressions)} regressões acima de {threshold:.0%} em relação a {path}:")
+    for key, old, new, change in sorted(regressions, key=lambda r: -r[3]):
+        print(f"  {key:<45} {old / 1e3:>11.1f} µs -> {new / 1e3:>11.1f} µs  (+{change:.0%})")
+    return len(regressions)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.suite', description=__doc__.split('\n\n')[0])
+    parser.add_argument('--save', action='store_true', help='grava a referência')
+    parser.add_argument('--check', action='store_true', help='compara com a referência')
+    parser.add_argument('--baseline', default=BASELINE, help=f'arquivo da referência ({BASELINE})')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help=f'piora aceita na mediana ({THRESHOLD})')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='tamanhos (bytes)')
+    parser.add_argument('--pipelines', nargs='+', choices=sorted(pipelines()), help='pipelines')
+    parser.add_argument('--quick', action='store_true', help='um décimo das iterações')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    header()
+    results = run(args.sizes, args.pipelines, args.quick)
+    if args.save:
+        save(results, args.baseline)
+    if args.check and check(results, args.baseline, args.threshold):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -33,6 +33,10 @@ def load_config():
             "sound_effects": True,
             "encryption": True,
             "timeout": 30,
+            "cache_size": 1024,
+            "compression": True,
+            "mesh": False,
+            "discovery": False,
             "avatar_color": "#1E88E5",
             "room_password": "",
             "check_updates_at_startup": True
@@ -0,0 +1,215 @@
+import logging
+from network import codec, compression
+from network.outbox import POLICY_KEEP, POLICY_COALESCE
+from network.streams import STREAM_CHAT, STREAM_PRESENCE
+from network.presence import Presence, PRESENCE_WINDOW
+from utils.crypto import encrypt_message, decrypt_message
+
+# Configuração de logging
+logger = logging.getLogger('winp2p.chat')
+
+# Eventos produzidos por ChatSession.handle para a interface
+EVENT_CHAT = 'chat'
+EVENT_SYSTEM = 'system'
+EVENT_USERS = 'users'
+EVENT_TYPING = 'typing'
+EVENT_ROOM_FULL = 'room_full'
+EVENT_ROOM_NOT_FOUND = 'room_not_found'
+EVENT_AUTH_FAILED = 'auth_failed'
+
+
+class ChatSession:
+    """
+    Regras de uma sala de chat, sem dependência de Qt.
+
+    Recebe payloads da rede, mantém a lista de usuários e devolve eventos
+    (tuplas cujo primeiro item é um EVENT_*) para quem estiver exibindo a
+    sala. Respostas ao protocolo são entregues pela função send(message,
+    policy, key, stream): o chat vai no STREAM_CHAT e as mensagens de
+    sistema no STREAM_PRESENCE, para que o chat passe na frente.
+
+    Com compression (método aceito por todos os peers, ver
+    network.compression) o texto é comprimido antes de ser cifrado;
+    depois de cifrado ele já não tem o que comprimir.
+
+    A presença é versionada e vai por deltas (ver network.presence). Com
+    schedule(delay, callback) as mudanças de status locais dentro de
+    PRESENCE_WINDOW saem num frame só, e digitar e parar dentro da janela
+    não envia nada. Cada entrada na sala é respondida com um snapshot por
+    um único membro, o de menor nome, e não por todos.
+    """
+
+    def __init__(self, username, send, max_users=2, encrypted=True, compression=None,
+                 schedule=None):
+        self.username = username
+        self.send = send
+        self.max_users = max_users
+        self.encrypted = encrypted
+        self.compression = compression
+        self.schedule = schedule
+        self.presence = Presence(username)
+        self.users = self.presence.users
+        self._flush_pending = False
+
+    def send_system_message(self, msg_type, data=None, policy=POLICY_KEEP, key=None):
+        """Envia mensagem de sistema"""
+        self.send({"type": msg_type, "data": data or {}}, policy, key, STREAM_PRESENCE)
+
+    def send_join(self):
+        self.send_system_message("user_join", {"username": self.username})
+
+    def send_typing(self, is_typing):
+        self.set_status("typing" if is_typing else "online")
+
+    def set_status(self, status):
+        """Muda o status local; o envio é juntado na janela de presença"""
+        self.users[self.username] = status
+        if self.schedule is None:
+            self.flush_presence()
+        elif not self._flush_pending:
+            self._flush_pending = True
+            self.schedule(PRESENCE_WINDOW, self.flush_presence)
+
+    def flush_presence(self):
+        """Envia o delta do status local (frames antigos pendentes são substituídos)"""
+        self._flush_pending = False
+        delta = self.presence.local_delta()
+        if delta:
+            self.send_system_message(
+                "presence", {"users": delta},
+                policy=POLICY_COALESCE, key=("presence", self.username)
+            )
+
+    def remove_user(self, username):
+        self.presence.remove(username)
+
+    def send_chat(self, text):
+        """Envia mensagem de chat (criptografada uma única vez)"""
+        message = {
+            "type": "chat",
+            "username": self.username,
+            "content": text
+        }
+        if self.encrypted:
+            packed = None
+            if self.compression:
+                packed = compression.compress(text.encode('utf-8'), self.compression)
+            if packed is not None:
+                message["content"] = encrypt_message(packed)
+                message["compressed"] = True
+            else:
+                message["content"] = encrypt_message(text)
+            message["encrypted"] = True
+        self.send(message, POLICY_KEEP, None, STREAM_CHAT)
+
+    def remove_peers(self):
+        """Remove todos os usuários remotos (ex.: após desconexão)"""
+        for username in list(self.users.keys()):
+            if username != self.username:
+                self.presence.remove(username)
+
+    def handle_payload(self, data):
+        """Decodifica um payload recebido e retorna a lista de eventos"""
+        try:
+            message = codec.decode(data)
+        except codec.CodecError:
+            # Texto puro de peers antigos: "usuario: mensagem"
+            text = bytes(data).decode('utf-8', errors='replace')
+            parts = text.split(": ", 1)
+            if len(parts) == 2:
+                return [(EVENT_CHAT, parts[0], parts[1])]
+            return [(EVENT_CHAT, "Anônimo", text)]
+        return self.handle(message)
+
+    def handle(self, message):
+        """Aplica uma mensagem decodificada e retorna a lista de eventos"""
+        if not isinstance(message, dict):
+            logger.warning(f"Mensagem descartada: {type(message).__name__} em vez de objeto")
+            return []
+        msg_type = message.get("type")
+        data = message.get("data", {})
+        if not isinstance(data, dict):
+            logger.warning(f"Mensagem {msg_type!r} descartada: data inválido")
+            return []
+
+        if msg_type == "chat":
+            content = message.get("content", "")
+            username = message.get("username", "Anônimo")
+            if not isinstance(content, str) or not isinstance(username, str):
+                logger.warning("Mensagem de chat descartada: campos inválidos")
+                return []
+            if "encrypted" in message:
+                try:
+                    if message.get("compressed"):
+                        packed = decrypt_message(content, raw=True)
+                        content = compression.decompress(packed).decode('utf-8')
+                    else:
+                        content = decrypt_message(content)
+                except Exception as e:
+                    logger.error(f"Erro ao descriptografar: {e}")
+            return [(EVENT_CHAT, username, content)]
+
+        if msg_type == "user_join":
+            username = data.get("username", "Anônimo")
+            if not isinstance(username, str):
+                logger.warning("user_join descartado: username inválido")
+                return []
+            if username == self.username:
+                return []
+            responder = min(name for name in self.users if name != username) == self.username
+            if username not in self.users and len(self.users) < self.max_users:
+                self.presence.add(username)
+                if responder:
+                    self.send_system_message("presence_snapshot",
+                                             {"users": self.presence.snapshot()})
+                return [(EVENT_USERS,), (EVENT_SYSTEM, f"{username} entrou na sala")]
+            if len(self.users) >= self.max_users and responder:
+                self.send_system_message("room_full", {})
+            return []
+
+        if msg_type in ("presence", "presence_snapshot"):
+            changes = self.presence.apply(data.get("users", {}),
+                                          add=msg_type == "presence_snapshot",
+                                          limit=self.max_users)
+            if not changes:
+                return []
+            events = [(EVENT_USERS,)]
+            for username, status in changes:
+                events.append((EVENT_TYPING, username, status == "typing"))
+            return events
+
+        if msg_type == "user_list":
+            # Peers antigos: lista completa, sem versões
+            users = data.get("users", {})
+            if not isinstance(users, dict):
+                logger.warning("user_list descartado: users inválido")
+                return []
+            for username, status in users.items():
+                if not isinstance(username, str) or not isinstance(status, str):
+                    continue
+                if username != self.username:
+                    self.users[username] = status
+            return [(EVENT_USERS,)]
+
+        if msg_type == "room_full":
+            return [(EVENT_ROOM_FULL,)]
+
+        if msg_type == "room_not_found":
+            return [(EVENT_ROOM_NOT_FOUND,)]
+
+        if msg_type == "auth_failed":
+            return [(EVENT_AUTH_FAILED,)]
+
+        if msg_type == "typing_status":
+            username = data.get("username", "")
+            status = data.get("status", "online")
+            if not isinstance(username, str) or not isinstance(status, str):
+                logger.warning("typing_status descartado: campos inválidos")
+                return []
+            if username not in self.users:
+                return []
+            self.users[username] = status
+            typing = status == "typing" and username != self.username
+            return [(EVENT_USERS,), (EVENT_TYPING, username, typing)]
+
+        return []
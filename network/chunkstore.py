@@ -0,0 +1,165 @@
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+# Configuração de logging
+logger = logging.getLogger('winp2p.chunkstore')
+
+CACHE_DIR = 'cache'
+
+# Orçamento padrão de disco do cache de chunks
+CACHE_BUDGET = 1024 * 1024 * 1024
+
+# Tamanhos dos chunks definidos pelo conteúdo (média de ~64 KiB)
+MIN_CHUNK = 16 * 1024
+MAX_CHUNK = 256 * 1024
+
+# Janela (bytes) do hash de corte: 2 bits por byte, 16 bits no total
+WINDOW = 8
+
+# Bloco lido do arquivo ao cortar chunks
+READ_BLOCK = 4 * 1024 * 1024
+
+
+def _symbols(seed, count):
+    """count valores de 2 bits derivados do seed"""
+    digest = hashlib.sha512(seed).digest()
+    return bytes((digest[i // 4] >> (2 * (i % 4))) & 3 for i in range(count))
+
+
+# Hash de engrenagem com 2 bits por byte: os últimos 16 bits do hash
+# (h = h << 2 | GEAR[b]) são os valores GEAR dos últimos WINDOW bytes.
+# Cortar onde eles formam MARK equivale a procurar MARK em
+# data.translate(GEAR), o que translate e find fazem em C. As tabelas são
+# fixas: os dois lados precisam cortar nos mesmos pontos.
+_GEAR = _symbols(b'winp2p-cdc-gear', 256)
+_MARK = _symbols(b'winp2p-cdc-mark', WINDOW)
+
+
+def iter_chunks(file, min_size=MIN_CHUNK, max_size=MAX_CHUNK):
+    """Divide o conteúdo do arquivo em chunks definidos pelo conteúdo"""
+    buf = b''
+    eof = False
+    while not eof:
+        data = file.read(READ_BLOCK)
+        eof = not data
+        buf = buf + data if buf else data
+        marks = buf.translate(_GEAR)
+        start = 0
+        while start < len(buf):
+            if not eof and len(buf) - start < max_size:
+                # O corte pode depender dos próximos bytes
+                break
+            cut = marks.find(_MARK, start + min_size - WINDOW, start + max_size)
+            end = cut + WINDOW if cut >= 0 else min(start + max_size, len(buf))
+            yield buf[start:end]
+            start = end
+        buf = buf[start:]
+
+
+class ChunkStore:
+    """
+    Chunks endereçados pelo sha256, guardados em cache/chunks.
+
+    Cada chunk é um arquivo com o hash como nome; a ordem de uso (LRU)
+    fica no mtime, então sobrevive a reinícios. Acima do orçamento os
+    menos usados são apagados. Seguro para usar de mais de uma thread.
+    """
+
+    def __init__(self, directory=CACHE_DIR, budget=CACHE_BUDGET):
+        self.directory = os.path.join(directory, 'chunks')
+        self.budget = budget
+        self.size = 0
+        self._index = OrderedDict()  # hash -> tamanho, do menos ao mais usado
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self._scan()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name[:2], name)
+
+    def _scan(self):
+        found = []
+        for sub in os.scandir(self.directory):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if entry.name.endswith('.tmp'):
+                    os.remove(entry.path)
+                    continue
+                st = entry.stat()
+                found.append((st.st_mtime, entry.name, st.st_size))
+        found.sort()
+        for _, name, size in found:
+            self._index[name] = size
+            self.size += size
+        with self._lock:
+            self._evict()
+        logger.info(f"Cache de chunks: {len(self._index)} chunks, {self.size} bytes")
+
+    def __contains__(self, digest):
+        return digest.hex() in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def get(self, digest):
+        """Conteúdo do chunk, ou None se não estiver (ou estiver corrompido)"""
+        name = digest.hex()
+        with self._lock:
+            if name not in self._index:
+                return None
+            self._index.move_to_end(name)
+        path = self._path(name)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            data = None
+        if data is None or hashlib.sha256(data).digest() != digest:
+            self.discard(digest)
+            return None
+        return data
+
+    def put(self, digest, data):
+        """Guarda um chunk já conferido (o hash é do chamador)"""
+        name = digest.hex()
+        with self._lock:
+            if name in self._index:
+                self._index.move_to_end(name)
+                return
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            if name not in self._index:
+                self._index[name] = len(data)
+                self.size += len(data)
+            self._evict()
+
+    def discard(self, digest):
+        name = digest.hex()
+        with self._lock:
+            size = self._index.pop(name, None)
+            if size is None:
+                return
+            self.size -= size
+        try:
+            os.remove(self._path(name))
+        except OSError:
+            pass
+
+    def _evict(self):
+        while self.size > self.budget and self._index:
+            name, size = self._index.popitem(last=False)
+            self.size -= size
+            try:
+                os.remove(self._path(name))
+            except OSError:
+                pass
@@ -1,102 +1,168 @@
-import socket
-import threading
 import json
 from PyQt5.QtCore import QThread, pyqtSignal
+from network.engine import Engine
+from network.outbox import POLICY_KEEP
+from network.rooms import DEFAULT_ROOM, JOIN_AUTH_FAILED
+from network.streams import STREAM_CONTROL, STREAM_BULK
+from network.transfer import FileTransfers
+from network.heartbeat import DEAD_TIMEOUT
+from network.rendezvous import connect_direct
 
 class Client(QThread):
-    message_received = pyqtSignal(str)
+    """Adaptador Qt de uma conexão de saída do Engine"""
+    message_received = pyqtSignal(bytes)
     connected = pyqtSignal()
     disconnected = pyqtSignal()
+    auth_failed = pyqtSignal()
+    reconnecting = pyqtSignal()
+    resumed = pyqtSignal()
+    rtt_updated = pyqtSignal(float)
+    transfer_progress = pyqtSignal(str, int, int, bool)
+    transfer_finished = pyqtSignal(str, bool)
+    transfer_failed = pyqtSignal(str, str)
+    transfer_offered = pyqtSignal(int, str, int)
     
-    def __init__(self, host, port):
+    def __init__(self, host, port, codecs=None, room=DEFAULT_ROOM, timeout=DEAD_TIMEOUT,
+                 store=None, compression_methods=None, rendezvous=None, ciphers=None,
+                 password=None):
         super().__init__()
         self.host = host
         self.port = int(port)
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.settimeout(10)
+        self.room = room
+        self.rendezvous = rendezvous
+        self.password = password or None
+        self.engine = Engine(
+            codecs=codecs,
+            compression_methods=compression_methods,
+            ciphers=ciphers,
+            heartbeat_interval=timeout / 3,
+            dead_timeout=timeout,
+            on_message=self._on_message,
+            on_join=self._on_join,
+            on_disconnect=self._on_disconnect,
+            on_detach=self._on_detach,
+            on_resume=self._on_resume,
+            on_rtt=self._on_rtt,
+            on_channel_open=self._on_channel_open,
+            on_channel_close=self._on_channel_close
+        )
+        self.transfers = FileTransfers(
+            self.engine,
+            store=store,
+            on_progress=self._on_transfer_progress,
+            on_complete=self._on_transfer_complete,
+            on_failed=self._on_transfer_failed,
+            on_offer=self._on_transfer_offered
+        )
+        self.peer = None
         self.running = True
         self._connected = False
     
     def run(self):
-        try:
-            self.sock.connect((self.host, self.port))
-            self._connected = True
-            self.connected.emit()
-            
-            self.receive_thread = threading.Thread(
-                target=self.receive_loop, 
-                daemon=True
-            )
-            self.receive_thread.start()
-            
-        except Exception as e:
-            print(f"Connection error: {e}")
-            self.disconnected.emit()
-    
-    def receive_loop(self):
-        """Loop de recebimento de mensagens"""
-        buffer = b""
-        
-        self.sock.settimeout(1) 
-        
-        while self.running:
-            try:
-                
-                chunk = self.sock.recv(4096)
-                if not chunk:
-                    break
-                
-                buffer += chunk
-                
-                while b"\n" in buffer:
-                    message, buffer = buffer.split(b"\n", 1)
-                    if message:
-                        self.message_received.emit(message.decode())
-                
-                if buffer:
-                    self.message_received.emit(buffer.decode())
-                    buffer = b""
-                    
-            except socket.timeout:
-                continue
-            except ConnectionResetError:
-                break
-            except Exception as e:
-                print(f"Receive error: {e}")
-                if not self.running:
-                    break
-                continue
-        
+        direct = connect_direct(self.rendezvous, self.room) if self.rendezvous else None
+        if direct is not None:
+            # Caminho direto por UDP; sem ele, a conexão TCP de sempre
+            stream, address = direct
+            self.peer = self.engine.attach(stream.start(), address, outbound=True,
+                                           room=self.room, password=self.password)
+        else:
+            self.peer = self.engine.connect(self.host, self.port, self.room, self.password)
+        self.engine.run()
+        self.transfers.shutdown()
+    
+    def _on_message(self, peer, data, stream):
+        if stream >= STREAM_BULK:
+            self.transfers.handle(peer, data, stream)
+        else:
+            self.message_received.emit(bytes(data))
+    
+    def _on_join(self, peer):
+        self._connected = True
+        self.transfers.peer_joined(peer)
+        self.connected.emit()
+    
+    def _on_detach(self, peer):
+        """Conexão caiu; o engine tenta retomar a sessão"""
+        self.reconnecting.emit()
+    
+    def _on_resume(self, peer):
+        self.resumed.emit()
+    
+    def _on_rtt(self, peer):
+        """RTT suavizado com o servidor, em milissegundos"""
+        self.rtt_updated.emit(peer.rtt.srtt * 1000)
+    
+    def _on_channel_open(self, peer, channel):
+        self.transfers.channel_opened(peer, channel)
+    
+    def _on_channel_close(self, peer, channel):
+        self.transfers.channel_closed(peer, channel)
+    
+    def _on_transfer_progress(self, transfer, outgoing):
+        self.transfer_progress.emit(transfer.name, transfer.done, transfer.size, outgoing)
+    
+    def _on_transfer_complete(self, transfer, outgoing):
+        self.transfer_finished.emit(transfer.path or transfer.name, outgoing)
+    
+    def _on_transfer_failed(self, transfer, error):
+        self.transfer_failed.emit(transfer.name, error)
+    
+    def _on_transfer_offered(self, transfer):
+        self.transfer_offered.emit(transfer.offer_id, transfer.name, transfer.size)
+    
+    def answer_transfer(self, offer_id, accept):
+        """Resposta do usuário a transfer_offered"""
+        self.engine.call_soon(self.transfers.answer_offer, offer_id, accept)
+    
+    def _on_disconnect(self, peer):
         self._connected = False
+        if peer.error == JOIN_AUTH_FAILED:
+            # O servidor não confirmou a senha da sala
+            self.auth_failed.emit()
+        elif peer.error:
+            # Sala cheia ou inexistente: a sessão de chat mostra o aviso
+            self.message_received.emit(json.dumps({'type': peer.error}).encode('utf-8'))
+        self.transfers.peer_lost(peer)
         self.disconnected.emit()
-        
-        try:
-            self.sock.close()
-        except:
-            pass
-    
-    def send(self, message):
-        """Envia mensagem para o servidor"""
+        self.engine.stop()
+    
+    @property
+    def codec(self):
+        """Codec negociado com o servidor"""
+        return self.peer.codec if self.peer else 'json'
+    
+    @property
+    def compression(self):
+        """Compressão negociada com o servidor (None se nenhuma)"""
+        return self.peer.compression if self.peer else None
+    
+    @property
+    def secure(self):
+        """Se a conexão com o servidor tem cifra de sessão negociada"""
+        return self.peer is not None and self.peer.cipher is not None
+    
+    def send_message(self, message, policy=POLICY_KEEP, key=None, stream=STREAM_CONTROL):
+        """Codifica e envia uma mensagem (dict) com o codec negociado"""
         if not self._connected:
             return False
-            
-        try:
-            if isinstance(message, str):
-                # Adicionar terminador de linha para todas as mensagens
-                if not message.endswith('\n'):
-                    message = message + '\n'
-                message = message.encode()
-            elif isinstance(message, bytes) and not message.endswith(b'\n'):
-                message = message + b'\n'
-                
-            self.sock.send(message)
-            return True
-            
-        except Exception as e:
-            print(f"Send error: {e}")
-            self._connected = False
-            self.disconnected.emit()
+        self.engine.send_message(self.peer, message, policy, key, stream)
+        return True
+    
+    def send(self, message, policy=POLICY_KEEP, key=None, stream=STREAM_CONTROL):
+        """Envia mensagem para o servidor sem bloquear"""
+        if not self._connected:
             return False
+        if isinstance(message, str):
+            message = message.encode()
+        self.engine.send(self.peer, message, policy, key, stream)
+        return True
+    
+    def send_file(self, path):
+        """Oferece um arquivo ao servidor (a transferência roda no loop)"""
+        if not self._connected:
+            return False
+        self.engine.call_soon(self.transfers.send_file, self.peer, path)
+        return True
     
     def is_connected(self):
         """Verifica se está conectado"""
@@ -105,10 +171,5 @@ class Client(QThread):
     def disconnect(self):
         """Desconecta do servidor"""
         self.running = False
-        
-        try:
-            self.sock.close()
-        except:
-            pass
-        
-        self._connected = False
\ No newline at end of file
+        self._connected = False
+        self.engine.stop()
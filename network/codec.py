@@ -0,0 +1,291 @@
+import json
+import base64
+import binascii
+
+# Ordem de preferência usada na negociação
+DEFAULT_CODECS = ['binary', 'json']
+
+TAG_CHAT = 0x01
+TAG_USER_JOIN = 0x02
+TAG_USER_LIST = 0x03
+TAG_ROOM_FULL = 0x04
+TAG_TYPING = 0x05
+TAG_PRESENCE = 0x06
+TAG_PRESENCE_SNAPSHOT = 0x07
+TAG_GENERIC = 0x7F
+
+FLAG_ENCRYPTED = 0x01
+FLAG_RAW_TOKEN = 0x02
+FLAG_COMPRESSED = 0x04
+
+# Tipos de mensagem de presença (ver network.presence) e suas tags
+PRESENCE_TAGS = {'presence': TAG_PRESENCE, 'presence_snapshot': TAG_PRESENCE_SNAPSHOT}
+
+STATUSES = ['online', 'typing', 'away', 'offline']
+STATUS_CUSTOM = 0xFF
+
+
+class CodecError(Exception):
+    """Payload que não pode ser decodificado"""
+
+
+def write_varint(out, value):
+    """Escreve um inteiro sem sinal em formato LEB128"""
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data, pos):
+    """Lê um inteiro LEB128 e retorna (valor, nova posição)"""
+    result = 0
+    shift = 0
+    while True:
+        if pos >= len(data):
+            raise CodecError('Varint truncado')
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def write_bytes(out, value):
+    write_varint(out, len(value))
+    out += value
+
+
+def read_bytes(data, pos):
+    length, pos = read_varint(data, pos)
+    end = pos + length
+    if end > len(data):
+        raise CodecError('Campo truncado')
+    return bytes(data[pos:end]), end
+
+
+def write_str(out, value):
+    write_bytes(out, value.encode('utf-8'))
+
+
+def read_str(data, pos):
+    value, pos = read_bytes(data, pos)
+    return value.decode('utf-8'), pos
+
+
+class JsonCodec:
+    """Codec texto, mantido como fallback para peers antigos"""
+    name = 'json'
+
+    def encode(self, message):
+        return json.dumps(message, separators=(',', ':')).encode('utf-8')
+
+    def decode(self, payload):
+        try:
+            return json.loads(bytes(payload).decode('utf-8'))
+        except (UnicodeDecodeError, ValueError) as e:
+            raise CodecError(str(e))
+
+
+class BinaryCodec:
+    """
+    Codec binário compacto: tag de tipo + campos com prefixo varint.
+
+    Tokens Fernet (base64) viajam como bytes crus. Tipos sem codificação
+    dedicada usam TAG_GENERIC com o corpo em JSON.
+    """
+    name = 'binary'
+
+    def encode(self, message):
+        msg_type = message.get('type')
+        data = message.get('data') or {}
+        out = bytearray()
+
+        if msg_type == 'chat' and set(message) <= {
+                'type', 'username', 'content', 'encrypted', 'compressed'}:
+            out.append(TAG_CHAT)
+            content = message.get('content', '')
+            flags = FLAG_ENCRYPTED if message.get('encrypted') else 0
+            raw = None
+            if flags and isinstance(content, str):
+                raw = self._token_to_raw(content)
+            if raw is not None:
+                flags |= FLAG_RAW_TOKEN
+            if message.get('compressed'):
+                flags |= FLAG_COMPRESSED
+            out.append(flags)
+            write_str(out, message.get('username', ''))
+            if raw is not None:
+                write_bytes(out, raw)
+            else:
+                write_str(out, content)
+
+        elif msg_type == 'user_join' and set(data) == {'username'}:
+            out.append(TAG_USER_JOIN)
+            write_str(out, data['username'])
+
+        elif msg_type == 'user_list' and set(data) == {'users'}:
+            out.append(TAG_USER_LIST)
+            users = data['users']
+            write_varint(out, len(users))
+            for username, status in users.items():
+                write_str(out, username)
+                self._write_status(out, status)
+
+        elif msg_type == 'room_full' and not data:
+            out.append(TAG_ROOM_FULL)
+
+        elif msg_type == 'typing_status' and set(data) == {'username', 'status'}:
+            out.append(TAG_TYPING)
+            write_str(out, data['username'])
+            self._write_status(out, data['status'])
+
+        elif msg_type in PRESENCE_TAGS and set(data) == {'users'} \
+                and self._is_presence(data['users']):
+            out.append(PRESENCE_TAGS[msg_type])
+            users = data['users']
+            write_varint(out, len(users))
+            for username, (version, status) in users.items():
+                write_str(out, username)
+                write_varint(out, version)
+                self._write_status(out, status)
+
+        else:
+            out.append(TAG_GENERIC)
+            out += json.dumps(message, separators=(',', ':')).encode('utf-8')
+
+        return bytes(out)
+
+    def decode(self, payload):
+        if not payload:
+            raise CodecError('Payload vazio')
+        try:
+            return self._decode(payload)
+        except (IndexError, UnicodeDecodeError, ValueError) as e:
+            raise CodecError(str(e))
+
+    def _decode(self, payload):
+        tag = payload[0]
+        pos = 1
+
+        if tag == TAG_CHAT:
+            flags = payload[pos]
+            username, pos = read_str(payload, pos + 1)
+            if flags & FLAG_RAW_TOKEN:
+                raw, pos = read_bytes(payload, pos)
+                content = base64.urlsafe_b64encode(raw).decode('ascii')
+            else:
+                content, pos = read_str(payload, pos)
+            message = {'type': 'chat', 'username': username, 'content': content}
+            if flags & FLAG_ENCRYPTED:
+                message['encrypted'] = True
+            if flags & FLAG_COMPRESSED:
+                message['compressed'] = True
+            return message
+
+        if tag == TAG_USER_JOIN:
+            username, pos = read_str(payload, pos)
+            return {'type': 'user_join', 'data': {'username': username}}
+
+        if tag == TAG_USER_LIST:
+            count, pos = read_varint(payload, pos)
+            users = {}
+            for _ in range(count):
+                username, pos = read_str(payload, pos)
+                users[username], pos = self._read_status(payload, pos)
+            return {'type': 'user_list', 'data': {'users': users}}
+
+        if tag == TAG_ROOM_FULL:
+            return {'type': 'room_full', 'data': {}}
+
+        if tag == TAG_TYPING:
+            username, pos = read_str(payload, pos)
+            status, pos = self._read_status(payload, pos)
+            return {'type': 'typing_status', 'data': {'username': username, 'status': status}}
+
+        if tag in (TAG_PRESENCE, TAG_PRESENCE_SNAPSHOT):
+            count, pos = read_varint(payload, pos)
+            users = {}
+            for _ in range(count):
+                username, pos = read_str(payload, pos)
+                version, pos = read_varint(payload, pos)
+                status, pos = self._read_status(payload, pos)
+                users[username] = [version, status]
+            msg_type = 'presence' if tag == TAG_PRESENCE else 'presence_snapshot'
+            return {'type': msg_type, 'data': {'users': users}}
+
+        if tag == TAG_GENERIC:
+            return json.loads(bytes(payload[1:]).decode('utf-8'))
+
+        raise CodecError(f'Tag desconhecida: {tag}')
+
+    def _token_to_raw(self, token):
+        """Converte um token base64 em bytes, se a conversão for reversível"""
+        try:
+            raw = base64.urlsafe_b64decode(token.encode('ascii'))
+        except (binascii.Error, UnicodeEncodeError):
+            return None
+        if base64.urlsafe_b64encode(raw).decode('ascii') != token:
+            return None
+        return raw
+
+    @staticmethod
+    def _is_presence(users):
+        """Entradas username -> [versão, status] que o formato binário representa"""
+        return all(
+            isinstance(entry, (list, tuple)) and len(entry) == 2
+            and isinstance(entry[0], int) and entry[0] >= 0 and isinstance(entry[1], str)
+            for entry in users.values()
+        )
+
+    def _write_status(self, out, status):
+        if status in STATUSES:
+            out.append(STATUSES.index(status))
+        else:
+            out.append(STATUS_CUSTOM)
+            write_str(out, status)
+
+    def _read_status(self, data, pos):
+        code = data[pos]
+        pos += 1
+        if code == STATUS_CUSTOM:
+            return read_str(data, pos)
+        return STATUSES[code], pos
+
+
+CODECS = {
+    'json': JsonCodec(),
+    'binary': BinaryCodec(),
+}
+
+
+def get_codec(name):
+    """Retorna o codec pelo nome (JSON se desconhecido)"""
+    return CODECS.get(name, CODECS['json'])
+
+
+def negotiate(offered, supported=None):
+    """Escolhe o primeiro codec suportado pelos dois lados"""
+    supported = supported or DEFAULT_CODECS
+    for name in supported:
+        if name in offered and name in CODECS:
+            return name
+    return 'json'
+
+
+def encode(message, codec='json'):
+    """Codifica uma mensagem com o codec indicado"""
+    return get_codec(codec).encode(message)
+
+
+def decode(payload):
+    """
+    Decodifica um payload de qualquer codec.
+
+    Payloads JSON sempre começam com '{'; o codec binário nunca usa essa
+    tag, então o formato é identificado pelo primeiro byte.
+    """
+    if payload[:1] == b'{':
+        return CODECS['json'].decode(payload)
+    return CODECS['binary'].decode(payload)
@@ -0,0 +1,200 @@
+import lzma
+import zlib
+from collections import Counter
+from network import codec
+from network.framing import MAX_MESSAGE_SIZE
+
+# Primeiro byte de um payload comprimido: o método usado
+METHOD_ZLIB = 1
+METHOD_ZDICT = 2
+METHOD_LZMA = 3
+
+# Níveis padrão; frames interativos precisam de compressão rápida
+LEVELS = {METHOD_ZLIB: 6, METHOD_ZDICT: 6, METHOD_LZMA: 1}
+
+# Abaixo destes tamanhos a compressão não compensa. Com o dicionário até
+# frames pequenos encolhem; o lzma só vale para frames grandes.
+MIN_SIZES = {METHOD_ZLIB: 128, METHOD_ZDICT: 24, METHOD_LZMA: 4096}
+
+# Economia mínima (bytes) para enviar comprimido
+MIN_SAVING = 8
+
+# Payloads maiores que PROBE_SIZE são testados por uma amostra antes: dados
+# já comprimidos ou cifrados não gastam CPU com a compressão inteira
+PROBE_SIZE = 2 * 1024
+PROBE_SAMPLE = 1024
+
+# Memória do deflate: o padrão (8) gasta mais zerando tabelas do que
+# comprimindo um frame pequeno, e quase não muda a razão
+MEM_LEVEL = 5
+
+# Tamanho do dicionário e dos trechos usados no treino
+DICT_SIZE = 4 * 1024
+SEGMENT = 8
+
+
+class CompressionError(Exception):
+    """Payload comprimido inválido ou maior que o limite"""
+
+
+def _sample_messages():
+    """Mensagens típicas de chat e de sistema, base do dicionário"""
+    names = ['alice', 'bob', 'carlos', 'diana', 'eduardo', 'fernanda']
+    messages = []
+    for name in names:
+        messages.append({"type": "user_join", "data": {"username": name}})
+        for status in ('typing', 'online', 'away'):
+            messages.append({
+                "type": "typing_status",
+                "data": {"username": name, "status": status}
+            })
+    for count in range(2, len(names) + 1):
+        users = {name: 'online' for name in names[:count]}
+        messages.append({"type": "user_list", "data": {"users": users}})
+    messages.append({"type": "room_full", "data": {}})
+    messages.append({"type": "room_not_found", "data": {}})
+
+    texts = [
+        "Olá, tudo bem?", "Oi! Tudo bem, e você?", "Tudo certo por aqui.",
+        "Chegou o arquivo?", "Ainda não chegou, vou verificar.",
+        "Você pode me enviar o arquivo de novo?", "Obrigado!", "De nada.",
+        "Estou digitando uma mensagem mais longa para você, espera um pouco.",
+        "A conexão está lenta hoje, não sei por quê.",
+        "Vou sair agora, até mais tarde!", "Até amanhã.", "Beleza, combinado.",
+        "Acabei de enviar o arquivo, confirma quando receber por favor.",
+        "Recebi sim, obrigado. Está tudo certo com o arquivo.",
+    ]
+    for name in names:
+        for text in texts:
+            messages.append({"type": "chat", "username": name, "content": text})
+
+    samples = []
+    for message in messages:
+        for name in codec.CODECS:
+            samples.append(codec.encode(message, name))
+    samples.extend(text.encode('utf-8') for text in texts)
+    return samples
+
+
+def train_dictionary(samples, size=DICT_SIZE, segment=SEGMENT):
+    """
+    Dicionário com os trechos que mais se repetem entre as amostras.
+
+    Conta em quantas amostras aparece cada trecho de `segment` bytes e
+    junta os mais frequentes, emendando trechos sobrepostos. Os mais
+    frequentes ficam no fim, onde o deflate os alcança com distâncias
+    menores.
+    """
+    counts = Counter()
+    for sample in samples:
+        counts.update({sample[i:i + segment] for i in range(len(sample) - segment + 1)})
+
+    pieces = []
+    covered = set()  # trechos já presentes em algum pedaço
+    ends = {}        # últimos segment-1 bytes -> pedaço
+    starts = {}      # primeiros segment-1 bytes -> pedaço
+    total = 0
+    for piece, count in counts.most_common():
+        if count < 2 or total >= size:
+            break
+        if piece in covered:
+            continue
+        covered.add(piece)
+        head, tail = piece[:-1], piece[1:]
+        if head in ends:
+            current = ends.pop(head)
+            current.append(piece[-1])
+            ends[tail] = current
+            total += 1
+        elif tail in starts:
+            current = starts.pop(tail)
+            current.insert(0, piece[0])
+            starts[head] = current
+            total += 1
+        else:
+            current = bytearray(piece)
+            pieces.append(current)
+            ends[tail] = starts[head] = current
+            total += len(piece)
+    return b''.join(reversed(pieces))[-size:]
+
+
+# O dicionário é derivado só do código: os dois lados chegam ao mesmo. O
+# nome negociado carrega o CRC dele, então versões com dicionários
+# diferentes não o usam entre si.
+DICTIONARY = train_dictionary(_sample_messages())
+ZDICT = f'zdict-{zlib.crc32(DICTIONARY):08x}'
+
+METHODS = {ZDICT: METHOD_ZDICT, 'zlib': METHOD_ZLIB, 'lzma': METHOD_LZMA}
+
+# Ordem de preferência usada na negociação
+DEFAULT_METHODS = [ZDICT, 'zlib']
+
+
+def negotiate(offered, supported=None):
+    """Escolhe o primeiro método suportado pelos dois lados (ou None)"""
+    supported = DEFAULT_METHODS if supported is None else supported
+    for name in supported:
+        if name in offered and name in METHODS:
+            return name
+    return None
+
+
+def _compress(data, method, level):
+    if method == METHOD_LZMA:
+        return lzma.compress(data, format=lzma.FORMAT_XZ, check=lzma.CHECK_NONE, preset=level)
+    # Deflate cru: sem os 6 bytes de cabeçalho e checksum do zlib
+    if method == METHOD_ZDICT:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, MEM_LEVEL, zdict=DICTIONARY)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, MEM_LEVEL)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress(data, name, level=None):
+    """
+    Comprime um payload com o método negociado.
+
+    Retorna o payload com o método no primeiro byte, ou None quando a
+    compressão não compensa (payload pequeno ou sem redundância).
+    """
+    method = METHODS.get(name)
+    if method is None or len(data) < MIN_SIZES[method]:
+        return None
+    if level is None:
+        level = LEVELS[method]
+    if len(data) > PROBE_SIZE:
+        sample = bytes(data[:PROBE_SAMPLE])
+        if len(_compress(sample, METHOD_ZLIB, 1)) + MIN_SAVING > len(sample):
+            return None
+    packed = _compress(data, method, level)
+    if len(packed) + 1 + MIN_SAVING > len(data):
+        return None
+    return bytes((method,)) + packed
+
+
+def decompress(payload, max_size=MAX_MESSAGE_SIZE):
+    """Descomprime um payload de compress, sem passar de max_size bytes"""
+    if not payload:
+        raise CompressionError('Payload vazio')
+    method = payload[0]
+    body = bytes(payload[1:])
+    try:
+        if method == METHOD_LZMA:
+            decompressor = lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+            data = decompressor.decompress(body, max_size)
+            complete = decompressor.eof
+        elif method in (METHOD_ZLIB, METHOD_ZDICT):
+            if method == METHOD_ZDICT:
+                decompressor = zlib.decompressobj(-15, zdict=DICTIONARY)
+            else:
+                decompressor = zlib.decompressobj(-15)
+            data = decompressor.decompress(body, max_size)
+            complete = decompressor.eof and not decompressor.unconsumed_tail
+        else:
+            raise CompressionError(f'Método desconhecido: {method}')
+    except (zlib.error, lzma.LZMAError) as e:
+        raise CompressionError(str(e))
+    if not complete:
+        raise CompressionError('Payload truncado ou maior que o limite')
+    return data
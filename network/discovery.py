@@ -0,0 +1,330 @@
+import os
+import json
+import time
+import struct
+import socket
+import logging
+import threading
+
+# Configuração de logging
+logger = logging.getLogger('winp2p.discovery')
+
+# Grupo multicast (escopo administrativo, não sai da rede local) e porta
+DISCOVERY_GROUP = '239.255.77.77'
+DISCOVERY_PORT = 48777
+
+# Intervalo (s) entre anúncios de uma sala hospedada
+ANNOUNCE_INTERVAL = 2.0
+
+# Sem anúncio por este tempo (s) a sala deixa de ser considerada ativa
+ROOM_TTL = 3 * ANNOUNCE_INTERVAL
+
+# Salas vistas há até este tempo (s) continuam no diretório, como cache
+CACHE_TTL = 3600
+
+DIRECTORY_PATH = os.path.join('cache', 'rooms.json')
+
+# Intervalo mínimo (s) entre gravações do diretório
+SAVE_INTERVAL = 1.0
+
+MAX_DATAGRAM = 2048
+
+# Salas guardadas no diretório; acima disso sai a vista há mais tempo
+MAX_ROOMS = 256
+
+
+def local_address():
+    """
+    Endereço IP desta máquina na rede local.
+
+    Um socket UDP "conectado" a um endereço externo revela a interface da
+    rota padrão sem enviar nada nem depender de DNS, ao contrário de
+    gethostbyname(gethostname()), que pode demorar ou devolver 127.0.1.1.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.connect(('10.254.254.254', 1))
+        return sock.getsockname()[0]
+    except OSError:
+        return '127.0.0.1'
+    finally:
+        sock.close()
+
+
+class RoomEntry:
+    """Sala anunciada na rede local"""
+
+    __slots__ = ('room', 'host', 'port', 'name', 'members', 'max_members', 'mesh', 'seen')
+
+    def __init__(self, room, host, port, name='', members=0, max_members=None, mesh=False,
+                 seen=0.0):
+        self.room = room
+        self.host = host
+        self.port = port
+        self.name = name
+        self.members = members
+        self.max_members = max_members
+        self.mesh = mesh
+        self.seen = seen
+
+    @property
+    def key(self):
+        return (self.host, self.port, self.room)
+
+    def is_live(self, now=None):
+        return (now or time.time()) - self.seen < ROOM_TTL
+
+    def to_dict(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Entrada de um anúncio ou do cache em disco, com os tipos conferidos;
+        levanta KeyError, TypeError, ValueError, OverflowError ou
+        AttributeError se inválida
+        """
+        max_members = data.get('max_members')
+        return cls(
+            str(data['room']), str(data['host']), int(data['port']),
+            name=str(data.get('name', '')),
+            members=int(data.get('members') or 0),
+            max_members=None if max_members is None else int(max_members),
+            mesh=bool(data.get('mesh')),
+            seen=float(data.get('seen', 0.0))
+        )
+
+
+class RoomDirectory:
+    """
+    Salas vistas na rede, em memória e em disco.
+
+    As ativas (anunciadas há menos de ROOM_TTL) vêm primeiro; as vistas há
+    até CACHE_TTL continuam listadas, então a lista aparece na hora ao
+    abrir o programa, antes do primeiro anúncio chegar. Seguro para usar
+    de mais de uma thread.
+    """
+
+    def __init__(self, path=DIRECTORY_PATH):
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+        self._saved = 0.0
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        entries = []
+        for item in data if isinstance(data, list) else []:
+            # Cache corrompido ou de outra versão: a entrada é ignorada
+            try:
+                entry = RoomEntry.from_dict(item)
+                if now - entry.seen < CACHE_TTL:
+                    entries.append(entry)
+            except (KeyError, TypeError, ValueError, OverflowError, AttributeError):
+                continue
+        entries.sort(key=lambda e: e.seen)
+        for entry in entries[-MAX_ROOMS:]:
+            self.entries[entry.key] = entry
+
+    def save(self, force=False):
+        """Grava o diretório se mudou (no máximo a cada SAVE_INTERVAL)"""
+        now = time.monotonic()
+        with self._lock:
+            if not self.dirty or (not force and now - self._saved < SAVE_INTERVAL):
+                return
+            data = [entry.to_dict() for entry in self.entries.values()]
+            self.dirty = False
+            self._saved = now
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning(f"Falha ao gravar o diretório de salas: {e}")
+
+    def update(self, entry):
+        with self._lock:
+            if entry.key not in self.entries and len(self.entries) >= MAX_ROOMS:
+                oldest = min(self.entries.values(), key=lambda e: e.seen)
+                del self.entries[oldest.key]
+            self.entries[entry.key] = entry
+            self.dirty = True
+
+    def remove(self, key):
+        with self._lock:
+            if self.entries.pop(key, None) is not None:
+                self.dirty = True
+
+    def rooms(self):
+        """Salas conhecidas: ativas primeiro, depois as mais recentes"""
+        now = time.time()
+        with self._lock:
+            for key in [k for k, e in self.entries.items() if now - e.seen >= CACHE_TTL]:
+                del self.entries[key]
+                self.dirty = True
+            entries = list(self.entries.values())
+        entries.sort(key=lambda e: (not e.is_live(now), -e.seen))
+        return entries
+
+
+class Discovery:
+    """
+    Descoberta de salas na LAN por UDP multicast e broadcast.
+
+    Uma thread própria anuncia as salas hospedadas a cada
+    ANNOUNCE_INTERVAL e registra no diretório as anunciadas pelos outros.
+    Ao iniciar envia uma consulta, que faz os hosts anunciarem na hora;
+    ao parar, avisa que as salas hospedadas fecharam. Não depende de Qt.
+    """
+
+    def __init__(self, directory=None, port=DISCOVERY_PORT, group=DISCOVERY_GROUP,
+                 interval=ANNOUNCE_INTERVAL):
+        self.directory = directory if directory is not None else RoomDirectory()
+        self.port = port
+        self.group = group
+        self.interval = interval
+        self.instance = os.urandom(8).hex()
+        self.hosted = {}
+        self.sock = None
+        self.running = False
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Abre o socket e inicia a thread (retorna False se não for possível)"""
+        try:
+            self.sock = self._open_socket()
+        except OSError as e:
+            logger.warning(f"Descoberta na LAN indisponível: {e}")
+            return False
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name='discovery', daemon=True)
+        self._thread.start()
+        self._send({'op': 'query'})
+        return True
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        with self._lock:
+            rooms = list(self.hosted.values())
+            self.hosted.clear()
+        for room in rooms:
+            self._send({'op': 'bye', 'room': room['room'], 'port': room['port']})
+        self._thread.join(timeout=1.0)
+        self.sock.close()
+        self.directory.save(force=True)
+
+    def host(self, room, port, name='', max_members=None, mesh=False):
+        """Passa a anunciar uma sala hospedada"""
+        with self._lock:
+            self.hosted[room] = {
+                'room': room, 'port': port, 'name': name, 'members': 1,
+                'max_members': max_members, 'mesh': mesh
+            }
+        self._announce()
+
+    def set_members(self, room, members):
+        with self._lock:
+            if room in self.hosted:
+                self.hosted[room]['members'] = members
+
+    def unhost(self, room):
+        with self._lock:
+            info = self.hosted.pop(room, None)
+        if info is not None:
+            self._send({'op': 'bye', 'room': room, 'port': info['port']})
+
+    def rooms(self):
+        return self.directory.rooms()
+
+    def _open_socket(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            # Várias instâncias na mesma máquina recebem os anúncios
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            except OSError:
+                pass
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.bind(('', self.port))
+        try:
+            membership = struct.pack('4s4s', socket.inet_aton(self.group),
+                                     socket.inet_aton('0.0.0.0'))
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        except OSError as e:
+            # Sem rota multicast: fica só o broadcast
+            logger.info(f"Multicast indisponível, usando broadcast: {e}")
+        sock.settimeout(min(self.interval, 0.5))
+        return sock
+
+    def _send(self, message):
+        message['winp2p'] = 1
+        message['instance'] = self.instance
+        data = json.dumps(message).encode('utf-8')
+        for target in (self.group, '255.255.255.255'):
+            try:
+                self.sock.sendto(data, (target, self.port))
+            except OSError:
+                pass
+
+    def _announce(self):
+        with self._lock:
+            rooms = [dict(room) for room in self.hosted.values()]
+        for room in rooms:
+            room['op'] = 'announce'
+            self._send(room)
+
+    def _run(self):
+        next_announce = time.monotonic() + self.interval
+        while self.running:
+            try:
+                data, address = self.sock.recvfrom(MAX_DATAGRAM)
+            except socket.timeout:
+                data = None
+            except OSError:
+                break
+            if data:
+                self._on_datagram(data, address)
+            now = time.monotonic()
+            if now >= next_announce:
+                self._announce()
+                next_announce = now + self.interval
+            self.directory.save()
+
+    def _on_datagram(self, data, address):
+        try:
+            message = json.loads(data.decode('utf-8'))
+        except (UnicodeDecodeError, ValueError):
+            return
+        if not isinstance(message, dict) or message.get('winp2p') != 1:
+            return
+        if message.get('instance') == self.instance:
+            return
+        op = message.get('op')
+        if op == 'query':
+            self._announce()
+        elif op == 'announce':
+            try:
+                entry = RoomEntry.from_dict(dict(message, host=address[0], seen=time.time()))
+            except (KeyError, TypeError, ValueError, OverflowError, AttributeError):
+                return
+            self.directory.update(entry)
+        elif op == 'bye':
+            try:
+                self.directory.remove((address[0], int(message['port']), str(message['room'])))
+            except (KeyError, TypeError, ValueError):
+                return
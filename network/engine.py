@@ -0,0 +1,1513 @@
+import socket
+import struct
+import selectors
+import errno
+import heapq
+import json
+import time
+import logging
+from collections import deque
+from concurrent.futures import Future
+from functools import partial
+from network import codec, compression
+from network.framing import (
+    Frame, FrameReader, FrameError, FLAG_COMPRESSED, FLAG_ENCRYPTED, KIND_DATA, KIND_HELLO,
+    KIND_ACK, KIND_BYE, KIND_PING, KIND_PONG, KIND_WINDOW, SMALL_FRAME, BUFFER_SIZE,
+    HELLO_FRAME_SIZE, FileFrame, FileRegion, fragment
+)
+from network.rooms import (
+    RoomTable, DEFAULT_ROOM, JOIN_OK, JOIN_AUTH_FAILED, valid_room_id
+)
+from network.outbox import (
+    Outbox, OutboxFull, POLICY_KEEP, POLICY_COALESCE, HIGH_WATERMARK, LOW_WATERMARK,
+    QUEUE_LIMIT
+)
+from network.session import (
+    SessionState, ACK, RESUME_TIMEOUT, RESUME_BUFFER, MAX_PROOFS, new_token, proof_data,
+    parse_ack
+)
+from network.heartbeat import (
+    RttEstimator, HEARTBEAT, HEARTBEAT_INTERVAL, DEAD_TIMEOUT, ping_payload, pong_payload,
+    parse_heartbeat
+)
+from network.streams import (
+    StreamReceiver, STREAM_CONTROL, WINDOW_UPDATE, is_flow_controlled, window_payload,
+    parse_window
+)
+from network.ratelimit import TokenBucket, AUTH_FAILURE_RATE, AUTH_FAILURE_BURST
+from utils.crypto import KeyExchange, CryptoError, DEFAULT_CIPHERS, negotiate_cipher
+from utils.pake import PasswordExchange, room_key
+
+# Configuração de logging
+logger = logging.getLogger('winp2p.engine')
+
+# sendmsg (I/O vetorizado) não existe no Windows
+HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')
+
+CONNECT_PENDING = {
+    0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY,
+    getattr(errno, 'WSAEWOULDBLOCK', errno.EWOULDBLOCK)
+}
+
+# Intervalos (s) entre tentativas de reconexão de uma sessão de saída
+RECONNECT_DELAYS = (0.2, 0.5, 1.0, 2.0, 5.0)
+
+# Dados adicionais autenticados de um frame cifrado: tipo, flags e stream
+AAD = struct.Struct('!BBH')
+
+
+def seal_frame(cipher, frame):
+    """Cifra um frame de dados; um FileFrame é lido do disco (sem sendfile)"""
+    if frame.kind != KIND_DATA:
+        return frame
+    data = frame.prefix + frame.region.read() if isinstance(frame, FileFrame) else frame.payload
+    flags = frame.flags | FLAG_ENCRYPTED
+    payload = cipher.seal(data, AAD.pack(frame.kind, flags, frame.stream))
+    return Frame(payload, frame.kind, flags, frame.stream)
+
+
+def _is_str(value):
+    return isinstance(value, str)
+
+
+def _is_str_list(value):
+    return isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+
+def _is_count(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+# Campos do hello de quem conecta e da resposta, com o tipo esperado de cada
+# um; os demais são ignorados
+HELLO_FIELDS = {
+    'codecs': _is_str_list, 'compression': _is_str_list, 'ciphers': _is_str_list,
+    'key': _is_str, 'pake': _is_str, 'confirm': _is_str, 'resume': _is_str,
+    'channel': _is_str, 'recv': _is_count, 'nonce': _is_str, 'proof': _is_str
+}
+REPLY_FIELDS = {
+    'codec': _is_str, 'compression': _is_str, 'room': _is_str, 'cipher': _is_str,
+    'key': _is_str, 'pake': _is_str, 'confirm': _is_str, 'type': _is_str,
+    'session': lambda value: isinstance(value, (bool, str)),
+    'resumed': lambda value: isinstance(value, bool),
+    'channel': lambda value: isinstance(value, bool), 'recv': _is_count
+}
+
+
+def parse_hello(payload, fields):
+    """
+    Decodifica um hello (JSON); retorna None se não for um objeto ou se
+    algum campo conhecido tiver o tipo errado. null vale como ausente.
+    """
+    try:
+        hello = json.loads(bytes(payload).decode('utf-8'))
+    except (UnicodeDecodeError, ValueError):
+        return None
+    if not isinstance(hello, dict):
+        return None
+    hello = {name: value for name, value in hello.items() if value is not None}
+    for name, check in fields.items():
+        if name in hello and not check(hello[name]):
+            return None
+    return hello
+
+
+class Timer:
+    """Chamada agendada com Engine.call_later"""
+
+    __slots__ = ('when', 'callback', 'args', 'cancelled')
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return self.when < other.when
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Peer:
+    """Estado de uma conexão multiplexada pelo Engine"""
+
+    def __init__(self, sock, address, outbox, reader, outbound=False):
+        self.sock = sock
+        self.address = address
+        self.reader = reader
+        self.outbox = outbox
+        self.outbound = outbound
+        self.connecting = outbound
+        self.joined = False
+        self.codec = 'json'
+        self.compression = None
+        self.cipher = None
+        self.kex = None
+        self.room_key = None
+        self.auth = None
+        self.error = None
+        self.handshake_start = None
+        self.handshake_time = None
+        self.room = None
+        self.bytes_sent = 0
+        self.closing = False
+        self.closed = False
+        self.last_seen = time.monotonic()
+        self.rtt = RttEstimator()
+        self.receiver = StreamReceiver()
+        self.producers = []
+        self.producing = False
+
+        # Conexões auxiliares da mesma sessão (ver Engine.open_channel)
+        self.primary = None
+        self.channels = []
+
+        # Retomada de sessão (ver network.session)
+        self.session = None
+        self.detached = False
+        self.pending = None
+        self.timer = None
+        self.attempts = 0
+        self.deadline = None
+        self.proofs = set()   # nonces já usados para retomar ou abrir canais
+
+        # Conexões adotadas com Engine.attach não são TCP: sem reconexão
+        self.resumable = True
+
+        # Limites de recepção (só conexões de entrada, ver Engine)
+        self.frame_bucket = None
+        self.byte_bucket = None
+        self.paused = False
+        self.held = None
+        self.throttle_timer = None
+        self.throttled = 0
+        self.dropped = 0
+
+    def fileno(self):
+        return self.sock.fileno()
+
+
+class Engine:
+    """
+    Loop de rede baseado em selectors.
+
+    Uma única thread atende o socket de escuta e todas as conexões, sem
+    uma thread por cliente. Cada peer tem uma fila de saída limitada
+    (ver network.outbox), então um receptor lento não atrasa os demais.
+    Os peers são roteados para salas (ver network.rooms) pelo hello; em
+    salas com relay as mensagens de um membro são repassadas aos outros.
+    Conexões de saída (connect) enviam o hello e entram quando o outro
+    lado responde.
+
+    Cada conexão carrega vários streams lógicos (ver network.streams):
+    payloads grandes são fragmentados, a fila de saída escreve os streams
+    por prioridade e os streams em volume respeitam a janela liberada pelo
+    receptor com frames KIND_WINDOW. on_message recebe (peer, payload,
+    stream) com a mensagem já remontada.
+
+    Com resume_timeout > 0 cada conexão ganha uma sessão: se o TCP cair,
+    o peer fica desanexado (on_detach), as mensagens continuam na fila e
+    o lado de saída reconecta sozinho. Na retomada (on_resume) só os
+    frames perdidos são reenviados; on_disconnect só é chamado quando a
+    sessão expira ou é encerrada. Numa conexão cifrada o token da sessão
+    vem da chave (não vai no hello em claro), e a retomada e os canais
+    provam a posse dela (ver network.session.proof_data).
+
+    A cada heartbeat_interval os peers recebem um PING; o PONG alimenta
+    peer.rtt (RTT suavizado e jitter, ver network.heartbeat) e on_rtt.
+    Um peer do qual nada chega há dead_timeout segundos é tratado como
+    conexão perdida, o que detecta conexões TCP meio abertas.
+
+    O lado de saída pode abrir conexões auxiliares para uma sessão
+    (open_channel), usadas para dividir transferências grandes entre
+    vários TCPs. O que chega por elas é entregue em nome do peer
+    principal, sem relay; on_channel_open e on_channel_close recebem
+    (peer principal, conexão auxiliar).
+
+    O hello também troca chaves X25519 efêmeras e negocia uma cifra AEAD
+    (ver utils.crypto): cada conexão tem suas chaves e os frames de dados
+    saem cifrados, com um contador como nonce. Os dados da conexão de
+    saída esperam a resposta ao hello para não saírem em claro. Numa sala
+    com senha a troca é o CPace (ver utils.pake): a resposta traz a
+    confirmação de quem aceitou, e quem conectou só entra na sala depois
+    de mandar a sua. Senhas erradas de um mesmo endereço são limitadas
+    por um balde de fichas.
+
+    O hello também negocia a compressão (ver network.compression): os
+    frames dos streams interativos saem comprimidos com FLAG_COMPRESSED
+    quando isso compensa e são descomprimidos antes de on_message.
+
+    frame_rate e byte_rate limitam cada conexão de entrada (ver
+    network.ratelimit): acima do limite o engine para de ler o socket até
+    o balde encher, e o TCP segura o remetente; nada que já foi lido é
+    descartado. frame_rate só conta os streams interativos; os em volume
+    já são limitados pela janela que o receptor libera. accept_rate faz o
+    mesmo com o socket de escuta. Os frames atrasados e os descartados
+    (pendentes quando a conexão cai) são contados em stats e em cada peer.
+
+    Os callbacks on_message, on_connect, on_join, on_detach, on_resume,
+    on_disconnect, on_backpressure, on_rtt, on_channel_open e
+    on_channel_close são chamados a partir da thread do loop. Este
+    módulo não depende de Qt.
+    """
+
+    def __init__(self, backlog=128, max_clients=None, codecs=None, compression_methods=None,
+                 ciphers=None,
+                 high_watermark=HIGH_WATERMARK, low_watermark=LOW_WATERMARK,
+                 queue_limit=QUEUE_LIMIT, rooms=None, default_room=DEFAULT_ROOM,
+                 recv_buffer_size=BUFFER_SIZE,
+                 resume_timeout=RESUME_TIMEOUT, resume_buffer=RESUME_BUFFER,
+                 heartbeat_interval=HEARTBEAT_INTERVAL, dead_timeout=DEAD_TIMEOUT,
+                 on_message=None, on_connect=None, on_disconnect=None,
+                 on_backpressure=None, on_join=None, on_detach=None,
+                 on_resume=None, on_rtt=None, on_channel_open=None,
+                 on_channel_close=None, frame_rate=None, byte_rate=None, accept_rate=None):
+        self.backlog = backlog
+        self.max_clients = max_clients
+        self.recv_buffer_size = recv_buffer_size
+        self.codecs = codecs or codec.DEFAULT_CODECS
+        if compression_methods is None:
+            compression_methods = compression.DEFAULT_METHODS
+        self.compression_methods = compression_methods
+        # Lista vazia: conexões sem cifra de sessão
+        self.ciphers = DEFAULT_CIPHERS if ciphers is None else ciphers
+        self.rooms = rooms if rooms is not None else RoomTable()
+        self.default_room = default_room
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.queue_limit = queue_limit
+        self.resume_timeout = resume_timeout
+        self.resume_buffer = resume_buffer
+        self.heartbeat_interval = heartbeat_interval
+        self.dead_timeout = dead_timeout
+        self.on_message = on_message
+        self.on_connect = on_connect
+        self.on_disconnect = on_disconnect
+        self.on_backpressure = on_backpressure
+        self.on_join = on_join
+        self.on_detach = on_detach
+        self.on_resume = on_resume
+        self.on_rtt = on_rtt
+        self.on_channel_open = on_channel_open
+        self.on_channel_close = on_channel_close
+        self.frame_rate = frame_rate
+        self.byte_rate = byte_rate
+        self.accept_bucket = TokenBucket(accept_rate) if accept_rate else None
+        self.stats = {
+            'throttled_frames': 0, 'dropped_frames': 0, 'throttled_accepts': 0,
+            'auth_failures': 0, 'auth_throttled': 0
+        }
+        self.auth_buckets = {}  # host -> balde de senhas erradas
+
+        self.selector = selectors.DefaultSelector()
+        self.listeners = []
+        self.peers = {}
+        self.sessions = {}
+        self.detached = set()
+        self.inbound = 0
+        self.running = False
+
+        self._calls = deque()
+        self._timers = []
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self.selector.register(self._wake_r, selectors.EVENT_READ, self._on_wake)
+
+    def listen(self, host, port):
+        """Abre um socket de escuta não bloqueante"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        sock.listen(self.backlog)
+        sock.setblocking(False)
+        self.listeners.append(sock)
+        self.selector.register(sock, selectors.EVENT_READ, self._on_accept)
+        return sock.getsockname()
+
+    def connect(self, host, port, room=DEFAULT_ROOM, password=None):
+        """
+        Abre uma conexão de saída não bloqueante (seguro para qualquer thread).
+
+        O peer retornado entra (on_join) quando o hello é respondido. Sem
+        password, vale a senha da sala se ela também é hospedada aqui
+        (malha).
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        peer = Peer(sock, (host, int(port)), self._new_outbox(), self._new_reader(),
+                    outbound=True)
+        peer.room = room
+        peer.room_key = room_key(room, password) if password else self._room_key(room)
+        self.call_soon(self._start_connect, peer)
+        return peer
+
+    def attach(self, sock, address, outbound=False, room=DEFAULT_ROOM, password=None):
+        """
+        Adota um socket de fluxo já conectado (seguro para qualquer thread).
+
+        Serve para caminhos que não são uma conexão TCP direta, como o
+        stream sobre UDP de network.udpstream. O peer é tratado como os
+        outros, mas sem retomada de sessão: quem o criou não sabe refazê-lo.
+        """
+        sock.setblocking(False)
+        peer = Peer(sock, address, self._new_outbox(), self._new_reader(), outbound=outbound)
+        peer.resumable = False
+        if outbound:
+            peer.room = room
+            peer.room_key = room_key(room, password) if password else self._room_key(room)
+        self.call_soon(self._attach, peer)
+        return peer
+
+    def _attach(self, peer):
+        peer.last_seen = time.monotonic()
+        if not peer.outbound:
+            if self.max_clients is not None and self.inbound >= self.max_clients:
+                self._reject(peer)
+                return
+            self.inbound += 1
+            self._limit(peer)
+        self.peers[peer.sock.fileno()] = peer
+        if peer.outbound:
+            # Já conectado: o primeiro evento de escrita envia o hello
+            self.selector.register(peer.sock, selectors.EVENT_WRITE, self._on_peer_event)
+        else:
+            self.selector.register(peer.sock, selectors.EVENT_READ, self._on_peer_event)
+            self._notify(self.on_connect, peer)
+
+    def run(self):
+        """Executa o loop até stop() ser chamado"""
+        self.running = True
+        if self.heartbeat_interval:
+            self.call_later(self.heartbeat_interval, self._heartbeat)
+        try:
+            while self.running:
+                for key, mask in self.selector.select(self._next_timeout()):
+                    try:
+                        key.data(key.fileobj, mask)
+                    except Exception as e:
+                        # Um peer com dados inesperados não derruba o loop
+                        self._on_event_error(key.fileobj, e)
+                self._run_timers()
+                self._run_calls()
+        finally:
+            self._shutdown()
+
+    def stop(self):
+        """Pede a parada do loop (seguro para qualquer thread)"""
+        self.call_soon(self._stop)
+
+    def call_soon(self, callback, *args):
+        """Agenda uma chamada na thread do loop (seguro para qualquer thread)"""
+        self._calls.append((callback, args))
+        try:
+            self._wake_w.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass
+
+    def call_later(self, delay, callback, *args):
+        """Agenda uma chamada após delay segundos (apenas na thread do loop)"""
+        timer = Timer(time.monotonic() + delay, callback, args)
+        heapq.heappush(self._timers, timer)
+        return timer
+
+    def broadcast(self, data, policy=POLICY_KEEP, key=None, room=None,
+                  stream=STREAM_CONTROL):
+        """Envia dados para todos os peers (seguro para qualquer thread)"""
+        return self.broadcast_frame(Frame(data, stream=stream), policy, key, room)
+
+    def broadcast_frame(self, frame, policy=POLICY_KEEP, key=None, room=None):
+        """
+        Entrega um Frame já montado a todos os peers da sala (ou a todos
+        os peers, se room for None).
+
+        O mesmo frame (cabeçalho e payload) é compartilhado por todas as
+        filas de saída. Retorna um Future com o número de bytes enfileirados
+        para cada endereço (0 quando o frame foi descartado).
+        """
+        future = Future()
+        self.call_soon(self._broadcast_frame, frame, policy, key, room, future)
+        return future
+
+    def broadcast_message(self, message, policy=POLICY_KEEP, key=None, room=None,
+                          stream=STREAM_CONTROL):
+        """Codifica e envia uma mensagem com o codec de cada peer"""
+        future = Future()
+        self.call_soon(self._broadcast_message, message, policy, key, room, stream, future)
+        return future
+
+    def open_room(self, room_id, max_members=None, relay=True, password=None):
+        """
+        Passa a hospedar uma sala (chamar antes de run()). Com password,
+        só entra quem conectar com a mesma senha; a derivação (scrypt)
+        roda aqui, fora do loop.
+        """
+        key = room_key(room_id, password) if password else None
+        return self.rooms.open(room_id, max_members, relay, key)
+
+    def _room_key(self, room_id):
+        if not valid_room_id(room_id):
+            return None
+        room = self.rooms.get(room_id)
+        return room.key if room is not None else None
+
+    def send(self, peer, data, policy=POLICY_KEEP, key=None, stream=STREAM_CONTROL):
+        """Envia dados para um peer (seguro para qualquer thread)"""
+        self.call_soon(self._send, peer, data, KIND_DATA, policy, key, stream)
+
+    def send_message(self, peer, message, policy=POLICY_KEEP, key=None,
+                     stream=STREAM_CONTROL):
+        """Codifica uma mensagem com o codec do peer e a envia"""
+        self.call_soon(self._send_message, peer, message, policy, key, stream)
+
+    def open_channel(self, peer):
+        """
+        Abre uma conexão auxiliar para a sessão de um peer de saída
+        (apenas na thread do loop); retorna None se não houver sessão.
+
+        A conexão entra em peer.channels e fica utilizável quando
+        on_channel_open for chamado.
+        """
+        if not peer.outbound or peer.closed or peer.session is None or not peer.session.token:
+            return None
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        channel = Peer(sock, peer.address, self._new_outbox(), self._new_reader(),
+                       outbound=True)
+        channel.primary = peer
+        channel.room = peer.room
+        channel.room_key = peer.room_key
+        peer.channels.append(channel)
+        self._start_connect(channel)
+        return channel
+
+    def add_producer(self, peer, producer):
+        """
+        Registra um produtor de dados para o peer (apenas na thread do loop).
+
+        producer.produce(peer) é chamado sempre que a fila de saída do peer
+        estiver abaixo da marca baixa; deve enfileirar poucos frames com
+        queue_frames e retornar False quando não tiver mais nada a enviar.
+        """
+        peer.producers.append(producer)
+        self._flush(peer)
+
+    def remove_producer(self, peer, producer):
+        if producer in peer.producers:
+            peer.producers.remove(producer)
+
+    def queue_frames(self, peer, frames):
+        """Enfileira frames sem escrever (para produtores)"""
+        outbox = peer.pending if peer.pending is not None else peer.outbox
+        for frame in frames:
+            outbox.push(frame)
+
+    def close_peer(self, peer):
+        """Fecha um peer após esvaziar sua fila de saída"""
+        self.call_soon(self._close_when_flushed, peer)
+
+    def _stop(self):
+        self.running = False
+
+    def _on_event_error(self, sock, error):
+        """Fecha o peer cujo evento levantou error"""
+        peer = self.peers.get(sock.fileno())
+        if peer is None:
+            logger.error(f"Erro em evento do engine: {error}")
+            return
+        logger.error(f"Erro tratando {peer.address}: {error}")
+        if not peer.closed:
+            self._close(peer)
+
+    def _on_wake(self, sock, mask):
+        try:
+            while sock.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def _run_calls(self):
+        for _ in range(len(self._calls)):
+            callback, args = self._calls.popleft()
+            try:
+                callback(*args)
+            except Exception as e:
+                logger.error(f"Erro em callback do engine: {e}")
+
+    def _next_timeout(self):
+        while self._timers and self._timers[0].cancelled:
+            heapq.heappop(self._timers)
+        if not self._timers:
+            return None
+        return max(0.0, self._timers[0].when - time.monotonic())
+
+    def _run_timers(self):
+        now = time.monotonic()
+        while self._timers and self._timers[0].when <= now:
+            timer = heapq.heappop(self._timers)
+            if timer.cancelled:
+                continue
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                logger.error(f"Erro em timer do engine: {e}")
+
+    def _heartbeat(self):
+        """Envia PINGs e desconecta peers sem tráfego há dead_timeout"""
+        now = time.monotonic()
+        for peer in list(self.peers.values()):
+            if peer.closed or peer.detached:
+                continue
+            if self.dead_timeout and now - peer.last_seen > self.dead_timeout:
+                logger.info(f"Sem resposta de {peer.address} há {self.dead_timeout:g}s")
+                self._close(peer)
+            elif peer.joined and not peer.connecting:
+                recv_seq = peer.session.take_ack() if peer.session is not None else 0
+                # Um PING ainda na fila é substituído pelo novo
+                self._send(peer, ping_payload(recv_seq), KIND_PING, POLICY_COALESCE, KIND_PING)
+        self.call_later(self.heartbeat_interval, self._heartbeat)
+
+    def _on_heartbeat(self, peer, frame):
+        """Responde PINGs, mede o RTT com PONGs e aplica o ACK de carona"""
+        if len(frame.payload) < HEARTBEAT.size:
+            logger.warning(f"Heartbeat curto demais de {peer.address}")
+            self._close(peer)
+            return
+        if frame.kind == KIND_PING:
+            _, remote_recv = parse_heartbeat(frame.payload)
+            recv_seq = peer.session.take_ack() if peer.session is not None else 0
+            self._send(peer, pong_payload(frame.payload, recv_seq), KIND_PONG)
+        else:
+            remote_recv = peer.rtt.sample_pong(frame.payload)
+            if peer.primary is None:
+                self._notify(self.on_rtt, peer)
+        if peer.session is not None:
+            peer.session.acknowledge(remote_recv)
+
+    def _on_accept(self, listener, mask):
+        while True:
+            if self.accept_bucket is not None and self.accept_bucket.available() < 1:
+                # Acima da taxa: as conexões esperam na fila do sistema
+                self.stats['throttled_accepts'] += 1
+                self.selector.unregister(listener)
+                self.call_later(self.accept_bucket.delay(), self._resume_accept, listener)
+                return
+            try:
+                conn, addr = listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                logger.error(f"Erro ao aceitar conexão: {e}")
+                return
+
+            if self.accept_bucket is not None:
+                self.accept_bucket.consume()
+            conn.setblocking(False)
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            peer = Peer(conn, addr, self._new_outbox(), self._new_reader())
+
+            if self.max_clients is not None and self.inbound >= self.max_clients:
+                self._reject(peer)
+                continue
+
+            self.inbound += 1
+            self._limit(peer)
+            self.peers[conn.fileno()] = peer
+            self.selector.register(conn, selectors.EVENT_READ, self._on_peer_event)
+            self._notify(self.on_connect, peer)
+
+    def _resume_accept(self, listener):
+        if self.running and listener in self.listeners:
+            self.selector.register(listener, selectors.EVENT_READ, self._on_accept)
+
+    def _limit(self, peer):
+        """Baldes de recepção de uma conexão de entrada"""
+        if self.frame_rate:
+            peer.frame_bucket = TokenBucket(self.frame_rate)
+        if self.byte_rate:
+            peer.byte_bucket = TokenBucket(self.byte_rate)
+
+    def _new_outbox(self):
+        return Outbox(self.high_watermark, self.low_watermark, self.queue_limit)
+
+    def _new_reader(self):
+        # Frames grandes só depois do hello (ver framing.HELLO_FRAME_SIZE)
+        return FrameReader(buffer_size=self.recv_buffer_size, hello_frame_size=HELLO_FRAME_SIZE)
+
+    def _start_connect(self, peer):
+        try:
+            err = peer.sock.connect_ex(peer.address)
+        except OSError as e:
+            err = e.errno
+        peer.last_seen = time.monotonic()
+        self.peers[peer.sock.fileno()] = peer
+        self.selector.register(peer.sock, selectors.EVENT_WRITE, self._on_peer_event)
+        if err not in CONNECT_PENDING:
+            logger.warning(f"Falha ao conectar em {peer.address}: {errno.errorcode.get(err, err)}")
+            self._close(peer)
+
+    def _finish_connect(self, peer):
+        err = peer.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err:
+            logger.warning(f"Falha ao conectar em {peer.address}: {errno.errorcode.get(err, err)}")
+            self._close(peer)
+            return
+        peer.connecting = False
+        if peer.sock.family in (socket.AF_INET, socket.AF_INET6):
+            peer.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        hello = {
+            'codecs': self.codecs, 'compression': self.compression_methods,
+            'room': peer.room
+        }
+        peer.handshake_start = time.monotonic()
+        if peer.room_key is not None:
+            # Sala com senha: CPace no lugar do X25519 anônimo
+            peer.kex = PasswordExchange(peer.room_key)
+            hello['ciphers'] = self.ciphers or DEFAULT_CIPHERS
+            hello['pake'] = peer.kex.public_b64()
+        elif self.ciphers:
+            peer.kex = KeyExchange()
+            hello['ciphers'] = self.ciphers
+            hello['key'] = peer.kex.public_b64()
+        if peer.primary is not None:
+            hello['channel'] = peer.primary.session.token
+            self._prove(hello, peer.primary, 'channel')
+        elif peer.session is not None and peer.session.token:
+            # Reconexão: o que foi enfileirado espera a resposta ao hello,
+            # para não passar na frente dos frames a retransmitir
+            hello['resume'] = peer.session.token
+            hello['recv'] = peer.session.recv_seq
+            self._prove(hello, peer, 'resume')
+            peer.pending = peer.outbox
+            peer.outbox = self._new_outbox()
+        else:
+            self._notify(self.on_connect, peer)
+            if self.resume_timeout:
+                # Conta desde o primeiro frame; o token vem na resposta
+                peer.session = SessionState('', self.resume_buffer)
+            if peer.kex is not None:
+                # Os dados esperam a chave, que vem na resposta ao hello
+                peer.pending = peer.outbox
+                peer.outbox = self._new_outbox()
+
+        peer.outbox.push(Frame(json.dumps(hello).encode('utf-8'), KIND_HELLO), front=True)
+        self._flush(peer)
+
+    def _reject(self, peer):
+        """Recusa um peer quando o limite de clientes foi atingido"""
+        try:
+            peer.sock.send(Frame(b'{"type":"room_full"}', KIND_HELLO).to_bytes())
+        except OSError:
+            pass
+        peer.sock.close()
+
+    def _members(self, room):
+        if room is None:
+            # Peers desanexados continuam recebendo na fila até expirarem
+            peers = list(self.peers.values()) + list(self.detached)
+            return [peer for peer in peers if not peer.outbound and peer.primary is None]
+        return self.rooms.members(room)
+
+    def _on_peer_event(self, sock, mask):
+        peer = self.peers.get(sock.fileno())
+        if peer is None:
+            return
+        if peer.connecting:
+            self._finish_connect(peer)
+            return
+        if mask & selectors.EVENT_READ:
+            self._read(peer)
+        if mask & selectors.EVENT_WRITE and not peer.closed:
+            self._flush(peer)
+
+    def _read(self, peer):
+        buffer = peer.reader.get_buffer()
+        if peer.byte_bucket is not None:
+            # Lê no máximo as fichas disponíveis: o excesso fica no socket
+            allowed = int(peer.byte_bucket.available())
+            if allowed < 1:
+                self._throttle(peer, peer.byte_bucket.delay())
+                return
+            buffer = buffer[:allowed]
+        try:
+            nbytes = peer.sock.recv_into(buffer)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self._close(peer)
+            return
+
+        if not nbytes:
+            self._close(peer)
+            return
+        peer.last_seen = time.monotonic()
+        if peer.byte_bucket is not None:
+            peer.byte_bucket.consume(nbytes)
+
+        try:
+            frames = peer.reader.buffer_updated(nbytes)
+        except FrameError as e:
+            logger.warning(f"Frame inválido de {peer.address}: {e}")
+            self._close(peer)
+            return
+        self._dispatch(peer, deque(frames))
+
+    def _dispatch(self, peer, frames, held=False):
+        fd = peer.sock.fileno()
+        while frames:
+            # Uma retomada transfere o socket para o peer da sessão antiga
+            peer = self.peers.get(fd)
+            if peer is None or peer.closing or peer.closed:
+                break
+            if peer.frame_bucket is not None and not is_flow_controlled(frames[0].stream) \
+                    and not peer.frame_bucket.consume():
+                # Acima do limite: o resto espera e o socket deixa de ser lido
+                peer.held = frames
+                if not held:
+                    peer.throttled += len(frames)
+                    self.stats['throttled_frames'] += len(frames)
+                self._throttle(peer, peer.frame_bucket.delay())
+                return
+            frame = frames.popleft()
+            if frame.kind == KIND_DATA:
+                self._on_data(peer, frame)
+            elif frame.kind == KIND_HELLO:
+                self._on_hello(peer, frame.payload)
+            elif frame.kind == KIND_ACK:
+                if len(frame.payload) < ACK.size:
+                    logger.warning(f"ACK curto demais de {peer.address}")
+                    self._close(peer)
+                    break
+                if peer.session is not None:
+                    peer.session.acknowledge(parse_ack(frame.payload))
+            elif frame.kind == KIND_WINDOW:
+                if len(frame.payload) < WINDOW_UPDATE.size:
+                    logger.warning(f"Atualização de janela curta demais de {peer.address}")
+                    self._close(peer)
+                    break
+                peer.outbox.window_update(frame.stream, parse_window(frame.payload))
+                self._flush(peer)
+            elif frame.kind in (KIND_PING, KIND_PONG):
+                self._on_heartbeat(peer, frame)
+            elif frame.kind == KIND_BYE:
+                self._finalize(peer)
+
+    def _throttle(self, peer, delay):
+        """Para de ler o peer por delay segundos"""
+        if peer.paused:
+            return
+        peer.paused = True
+        self._flush(peer)
+        peer.throttle_timer = self.call_later(delay, self._unthrottle, peer)
+
+    def _unthrottle(self, peer):
+        peer.throttle_timer = None
+        if not peer.paused or peer.closed or peer.detached:
+            return
+        peer.paused = False
+        frames, peer.held = peer.held, None
+        if frames:
+            self._dispatch(peer, frames, held=True)
+        if not peer.paused and not peer.closed and not peer.detached:
+            self._flush(peer)
+
+    def _on_data(self, peer, frame):
+        if peer.auth is not None:
+            logger.warning(f"Dados de {peer.address} antes de confirmar a senha")
+            self._finalize(peer)
+            return
+        if frame.flags & FLAG_ENCRYPTED:
+            try:
+                if peer.cipher is None:
+                    raise CryptoError('Frame cifrado sem chave negociada')
+                payload = peer.cipher.open(frame.payload, AAD.pack(frame.kind, frame.flags,
+                                                                   frame.stream))
+            except CryptoError as e:
+                logger.warning(f"Frame rejeitado de {peer.address}: {e}")
+                self._close(peer)
+                return
+            frame = Frame(payload, frame.kind, frame.flags & ~FLAG_ENCRYPTED, frame.stream)
+        elif peer.cipher is not None:
+            logger.warning(f"Frame em claro de {peer.address} numa conexão cifrada")
+            self._close(peer)
+            return
+
+        if peer.session is not None and peer.session.frame_received():
+            self._send(peer, peer.session.ack_payload(), KIND_ACK)
+
+        try:
+            payload, increment = peer.receiver.receive(frame)
+        except FrameError as e:
+            # Acima dos limites de remontagem: o que já foi guardado é descartado
+            logger.warning(f"Mensagem inválida de {peer.address}: {e}")
+            self._finalize(peer)
+            return
+        if increment:
+            self._send(peer, window_payload(increment), KIND_WINDOW, stream=frame.stream)
+        if payload is None:
+            # Fragmento: a mensagem continua nos próximos frames
+            return
+        if frame.flags & FLAG_COMPRESSED:
+            try:
+                payload = compression.decompress(payload)
+            except compression.CompressionError as e:
+                logger.warning(f"Mensagem inválida de {peer.address}: {e}")
+                self._close_when_flushed(peer)
+                return
+
+        if peer.primary is not None:
+            # Conexão auxiliar: entregue em nome do peer principal, sem relay
+            self._notify(self.on_message, peer.primary, payload, frame.stream)
+            return
+
+        if peer.outbound:
+            self._notify(self.on_message, peer, payload, frame.stream)
+            return
+
+        # Peers que não enviaram hello entram na sala padrão
+        if peer.room is None and not self._join(peer, self.default_room):
+            return
+
+        room = self.rooms.get(peer.room)
+        if room is not None and room.relay:
+            # Remontado e fragmentado de novo: fragmentos de origens
+            # diferentes não podem se misturar no mesmo stream
+            forward = Frame(payload, stream=frame.stream)
+            frames = {}
+            for member in list(room.members):
+                if member is peer:
+                    continue
+                if member.compression not in frames:
+                    frames[member.compression] = self._fragments(forward, member.compression)
+                self._send_frames(member, frames[member.compression])
+
+        self._notify(self.on_message, peer, payload, frame.stream)
+
+    def _on_hello(self, peer, payload):
+        """Negocia o codec, roteia o peer para a sala e responde ao hello"""
+        hello = parse_hello(payload, REPLY_FIELDS if peer.outbound else HELLO_FIELDS)
+        if hello is None:
+            logger.warning(f"Hello inválido de {peer.address}")
+            self._finalize(peer)
+            return
+
+        if peer.outbound:
+            self._on_hello_reply(peer, hello)
+            return
+
+        if peer.auth is not None:
+            self._on_confirm(peer, hello)
+            return
+
+        if 'channel' in hello:
+            self._open_channel(peer, hello)
+            return
+
+        if hello.get('resume') and self._resume(peer, hello):
+            return
+
+        peer.codec = codec.negotiate(hello.get('codecs') or [], self.codecs)
+        peer.compression = compression.negotiate(
+            hello.get('compression') or [], self.compression_methods
+        )
+        room_id = hello.get('room') or self.default_room
+        # Decidido antes da troca de chaves: a recusa vai em claro e quem
+        # conectou consegue lê-la
+        status = self.rooms.check(peer, room_id)
+        if status != JOIN_OK:
+            logger.info(f"Peer {peer.address} recusado: {status}")
+            self._refuse(peer, status)
+            return
+        reply = {'codec': peer.codec, 'compression': peer.compression, 'room': room_id}
+        if not self._accept_cipher(peer, hello, reply, self._room_key(room_id), room_id):
+            return
+        # Numa sala com senha o peer só entra depois de confirmá-la
+        if peer.auth is None and not self._join(peer, room_id):
+            return
+
+        if self.resume_timeout:
+            # Com cifra o token vem da chave e não vai na resposta, que é em claro
+            token = peer.cipher.session_id if peer.cipher is not None else None
+            peer.session = SessionState(token, buffer_size=self.resume_buffer)
+            self.sessions[peer.session.token] = peer
+            reply['session'] = True if peer.cipher is not None else peer.session.token
+        # Antes de qualquer dado enviado em on_join: o outro lado precisa da chave
+        peer.outbox.push(Frame(json.dumps(reply).encode('utf-8'), KIND_HELLO), front=True)
+        self._flush(peer)
+
+    def _accept_cipher(self, peer, hello, reply, key=None, room_id=None):
+        """
+        Escolhe a cifra da conexão e põe nossa chave pública na resposta.
+        Com key (sala com senha) a troca é o CPace; com room_id, o peer
+        fica esperando a confirmação para entrar na sala.
+        """
+        if key is not None:
+            return self._accept_password(peer, hello, reply, key, room_id)
+        name = negotiate_cipher(hello.get('ciphers') or [], self.ciphers)
+        if name is None or not hello.get('key'):
+            return True
+        kex = KeyExchange()
+        try:
+            peer.cipher = kex.derive(hello['key'], name, initiator=False)
+        except CryptoError as e:
+            logger.warning(f"Hello inválido de {peer.address}: {e}")
+            self._close_when_flushed(peer)
+            return False
+        reply['cipher'] = name
+        reply['key'] = kex.public_b64()
+        return True
+
+    def _accept_password(self, peer, hello, reply, key, room_id):
+        if self._auth_throttled(peer):
+            logger.warning(f"Tentativas de senha de {peer.address} acima do limite")
+            self.stats['auth_throttled'] += 1
+            self._refuse(peer, JOIN_AUTH_FAILED)
+            return False
+        name = negotiate_cipher(hello.get('ciphers') or [], self.ciphers or DEFAULT_CIPHERS)
+        if name is None or not hello.get('pake'):
+            logger.info(f"Peer {peer.address} sem a senha da sala")
+            self._refuse(peer, JOIN_AUTH_FAILED)
+            return False
+        kex = PasswordExchange(key)
+        try:
+            peer.cipher = kex.derive(hello['pake'], name, initiator=False)
+        except CryptoError as e:
+            logger.warning(f"Hello inválido de {peer.address}: {e}")
+            self._auth_failed(peer)
+            self._refuse(peer, JOIN_AUTH_FAILED)
+            return False
+        reply['cipher'] = name
+        reply['pake'] = kex.public_b64()
+        reply['confirm'] = kex.proof()
+        if room_id is not None:
+            peer.auth = (kex, room_id)
+        return True
+
+    def _on_confirm(self, peer, hello):
+        """Confirmação da senha por quem conectou: agora entra na sala"""
+        kex, room_id = peer.auth
+        peer.auth = None
+        if not kex.verify(hello.get('confirm')):
+            self._auth_failed(peer)
+            self._finalize(peer)
+            return
+        self._join(peer, room_id)
+
+    def _refuse(self, peer, status):
+        """Responde ao hello com a recusa (em claro, como todo hello) e fecha"""
+        self._send(peer, json.dumps({'type': status}).encode('utf-8'), KIND_HELLO)
+        self._close_when_flushed(peer)
+
+    def _auth_failed(self, peer):
+        """Conta uma senha errada para o endereço do peer"""
+        logger.warning(f"Senha da sala incorreta de {peer.address}")
+        self.stats['auth_failures'] += 1
+        host = peer.address[0]
+        bucket = self.auth_buckets.get(host)
+        if bucket is None:
+            if len(self.auth_buckets) >= 1024:
+                # Esquece os endereços que já voltaram ao limite cheio
+                for other in [h for h, b in self.auth_buckets.items()
+                              if b.available() >= b.burst]:
+                    del self.auth_buckets[other]
+            bucket = self.auth_buckets[host] = TokenBucket(AUTH_FAILURE_RATE, AUTH_FAILURE_BURST)
+        bucket.consume()
+
+    def _auth_throttled(self, peer):
+        bucket = self.auth_buckets.get(peer.address[0])
+        return bucket is not None and bucket.available() < 1
+
+    def _set_cipher(self, peer, hello):
+        """Deriva a chave da conexão da resposta ao nosso hello"""
+        kex, peer.kex = peer.kex, None
+        if peer.handshake_start is not None:
+            peer.handshake_time = time.monotonic() - peer.handshake_start
+        if hello.get('resumed'):
+            # Sessão retomada: continua com a chave que já tinha
+            return True
+        name = hello.get('cipher')
+        peer.cipher = None
+        if isinstance(kex, PasswordExchange):
+            try:
+                peer.cipher = kex.derive(hello.get('pake', ''), name, initiator=True)
+            except (CryptoError, KeyError) as e:
+                logger.warning(f"Resposta inválida de {peer.address}: {e}")
+            if peer.cipher is None or not kex.verify(hello.get('confirm')):
+                # Senha errada, ou o outro lado nem pediu senha
+                logger.warning(f"Senha da sala não confirmada por {peer.address}")
+                self.stats['auth_failures'] += 1
+                peer.error = JOIN_AUTH_FAILED
+                self._finalize(peer)
+                return False
+            if peer.primary is None:
+                # Nossa confirmação vai antes dos dados que esperavam a chave
+                confirm = json.dumps({'confirm': kex.proof()}).encode('utf-8')
+                peer.outbox.push(Frame(confirm, KIND_HELLO))
+        elif kex is not None and name in self.ciphers:
+            try:
+                peer.cipher = kex.derive(hello.get('key', ''), name, initiator=True)
+            except CryptoError as e:
+                logger.warning(f"Resposta inválida de {peer.address}: {e}")
+                self._finalize(peer)
+                return False
+        peer.outbox.unseal()
+        return True
+
+    def _prove(self, hello, owner, kind):
+        """Assina o hello de retomada ou de canal com a chave da sessão de owner"""
+        if owner.cipher is None:
+            return
+        hello['nonce'] = new_token()
+        hello['proof'] = owner.cipher.proof(
+            proof_data(kind, hello[kind], hello['nonce'], hello.get('recv', 0))
+        )
+
+    def _proven(self, owner, hello, kind):
+        """
+        O hello prova a posse da chave da sessão de owner, com um nonce
+        ainda não usado? Sessões sem cifra só têm o token (nunca numa sala
+        com senha, onde sempre há cifra).
+        """
+        if owner.cipher is None:
+            return self._room_key(owner.room) is None
+        nonce = hello.get('nonce')
+        if not isinstance(nonce, str) or nonce in owner.proofs or len(owner.proofs) >= MAX_PROOFS:
+            return False
+        data = proof_data(kind, hello[kind], nonce, hello.get('recv', 0))
+        if not owner.cipher.verify(data, hello.get('proof')):
+            return False
+        owner.proofs.add(nonce)
+        return True
+
+    def _open_channel(self, peer, hello):
+        """Associa uma conexão auxiliar recebida à sessão indicada"""
+        token = hello['channel']
+        primary = self.sessions.get(token) if isinstance(token, str) else None
+        if primary is not None and not self._proven(primary, hello, 'channel'):
+            logger.warning(f"Canal de {peer.address} sem prova da chave da sessão")
+            primary = None
+        if primary is None or primary.closed or primary.closing:
+            self._refuse(peer, 'session_not_found')
+            return
+        peer.primary = primary
+        peer.codec = primary.codec
+        peer.compression = primary.compression
+        peer.joined = True
+        primary.channels.append(peer)
+        reply = {'codec': peer.codec, 'channel': True}
+        # A senha vale também para o canal, mas sem esperar confirmação: quem
+        # errou não decifra nem forja os frames
+        if not self._accept_cipher(peer, hello, reply, self._room_key(primary.room)):
+            return
+        self._send(peer, json.dumps(reply).encode('utf-8'), KIND_HELLO)
+        self._notify(self.on_channel_open, primary, peer)
+
+    def _on_hello_reply(self, peer, hello):
+        """Resposta ao nosso hello: o outro lado já escolheu codec e compressão"""
+        if hello.get('type'):
+            # Recusa (sala cheia, inexistente, senha errada), a qualquer momento
+            logger.info(f"Recusado por {peer.address}: {hello['type']}")
+            peer.error = hello['type']
+            self._finalize(peer)
+            return
+        peer.codec = codec.negotiate([hello.get('codec')], self.codecs)
+        peer.compression = compression.negotiate(
+            [hello.get('compression')], self.compression_methods
+        )
+        if not self._set_cipher(peer, hello):
+            return
+        if peer.primary is not None:
+            if not hello.get('channel'):
+                self._finalize(peer)
+                return
+            peer.joined = True
+            self._flush(peer)
+            self._notify(self.on_channel_open, peer.primary, peer)
+            return
+        pending, peer.pending = peer.pending, None
+        resuming = peer.session is not None and bool(peer.session.token)
+        peer.attempts = 0
+        peer.deadline = None
+
+        if hello.get('resumed') and peer.session is not None:
+            frames = peer.session.replay(hello.get('recv', 0))
+            if frames is not None:
+                # As janelas de controle de fluxo recomeçam na nova conexão
+                peer.receiver.reset_windows()
+                for frame in frames:
+                    peer.outbox.push(frame)
+                peer.outbox.extend(pending)
+                self._flush(peer)
+                self._notify(self.on_resume, peer)
+                return
+
+        if pending is not None and resuming:
+            # Retomada recusada: o que não foi confirmado se perdeu
+            logger.info(f"Sessão com {peer.address} não foi retomada")
+            peer.session = SessionState('', self.resume_buffer)
+            peer.receiver = StreamReceiver()
+        if pending is not None:
+            peer.outbox.extend(pending)
+
+        if hello.get('session') and peer.session is not None:
+            peer.session.token = peer.cipher.session_id if peer.cipher is not None \
+                else str(hello['session'])
+        else:
+            peer.session = None
+        self._flush(peer)
+        peer.joined = True
+        self._notify(self.on_join, peer)
+
+    def _resume(self, peer, hello):
+        """Transfere a nova conexão para a sessão existente, se possível"""
+        token = hello['resume']
+        old = self.sessions.get(token)
+        if old is None or old.closed or old.auth is not None:
+            return False
+        if not self._proven(old, hello, 'resume'):
+            logger.warning(f"Retomada de {peer.address} sem prova da chave da sessão")
+            return False
+
+        frames = old.session.replay(hello.get('recv', 0))
+        if frames is None:
+            logger.info(f"Sessão de {old.address} não pode ser retomada")
+            self._finalize(old)
+            return False
+
+        if not old.detached:
+            # O outro lado percebeu a queda antes de nós
+            self._release(old)
+        self.detached.discard(old)
+        if old.timer is not None:
+            old.timer.cancel()
+            old.timer = None
+
+        # O peer da sessão (sala, codec, fila) passa a usar o novo socket
+        self.peers[peer.sock.fileno()] = old
+        old.sock = peer.sock
+        old.reader = peer.reader
+        old.address = peer.address
+        old.detached = False
+        old.deadline = None
+        old.last_seen = peer.last_seen
+
+        old.outbox.rewind()
+        old.outbox.reset_windows()
+        old.receiver.reset_windows()
+        for frame in reversed(frames):
+            old.outbox.push(frame, front=True)
+        reply = {
+            'codec': old.codec, 'compression': old.compression,
+            'room': old.room, 'resumed': True, 'recv': old.session.recv_seq
+        }
+        old.outbox.push(Frame(json.dumps(reply).encode('utf-8'), KIND_HELLO), front=True)
+        self._flush(old)
+        self._notify(self.on_resume, old)
+        return True
+
+    def _join(self, peer, room_id):
+        status = self.rooms.join(peer, room_id)
+        if status != JOIN_OK:
+            self._refuse(peer, status)
+            return False
+        peer.joined = True
+        self._notify(self.on_join, peer)
+        return True
+
+    def _send(self, peer, data, kind=KIND_DATA, policy=POLICY_KEEP, key=None,
+              stream=STREAM_CONTROL):
+        return self._send_frame(peer, Frame(data, kind, stream=stream), policy, key)
+
+    def _send_frame(self, peer, frame, policy=POLICY_KEEP, key=None):
+        """Enfileira um frame para o peer; retorna os bytes aceitos"""
+        return self._send_frames(peer, self._fragments(frame, peer.compression), policy, key)
+
+    def _fragments(self, frame, method):
+        """Comprime o frame (se compensar) e o fragmenta"""
+        if (method and frame.kind == KIND_DATA and type(frame) is Frame
+                and not is_flow_controlled(frame.stream)):
+            # Dados em volume ficam de fora: arquivos já são
+            # deduplicados (ver network.transfer)
+            packed = compression.compress(frame.payload, method)
+            if packed is not None:
+                frame = Frame(packed, KIND_DATA, frame.flags | FLAG_COMPRESSED, frame.stream)
+        return fragment(frame)
+
+    def _send_frames(self, peer, frames, policy=POLICY_KEEP, key=None):
+        """Enfileira os fragmentos de uma mensagem; retorna os bytes aceitos"""
+        if peer.closed or peer.closing:
+            return 0
+        if len(frames) > 1 and policy == POLICY_COALESCE:
+            # Substituir só o primeiro fragmento corromperia a mensagem
+            policy, key = POLICY_KEEP, None
+        # Durante uma reconexão os dados esperam a resposta ao hello
+        outbox = peer.pending if peer.pending is not None else peer.outbox
+        try:
+            if not outbox.push(frames[0], policy, key):
+                return 0
+            for frame in frames[1:]:
+                outbox.push(frame)
+        except OutboxFull as e:
+            logger.warning(f"Peer lento desconectado {peer.address}: {e}")
+            self._finalize(peer)
+            return 0
+        self._flush(peer)
+        return sum(len(frame) for frame in frames)
+
+    def _send_message(self, peer, message, policy, key, stream=STREAM_CONTROL):
+        self._send(peer, codec.encode(message, peer.codec), KIND_DATA, policy, key, stream)
+
+    def _broadcast_frame(self, frame, policy, key, room, future):
+        # Comprime (e fragmenta) uma vez por método, não uma vez por peer
+        frames = {}
+        counts = {}
+        for peer in self._members(room):
+            if peer.compression not in frames:
+                frames[peer.compression] = self._fragments(frame, peer.compression)
+            counts[peer.address] = self._send_frames(peer, frames[peer.compression], policy, key)
+        future.set_result(counts)
+
+    def _broadcast_message(self, message, policy, key, room, stream, future):
+        # Codifica (e fragmenta) uma vez por codec e compressão, não uma vez por peer
+        frames = {}
+        counts = {}
+        for peer in self._members(room):
+            variant = (peer.codec, peer.compression)
+            if variant not in frames:
+                frames[variant] = self._fragments(
+                    Frame(codec.encode(message, peer.codec), stream=stream), peer.compression
+                )
+            counts[peer.address] = self._send_frames(peer, frames[variant], policy, key)
+        future.set_result(counts)
+
+    def _write(self, peer):
+        """Escreve o máximo possível da fila com uma única chamada"""
+        seal = partial(seal_frame, peer.cipher) if peer.cipher is not None else None
+        bufs = peer.outbox.gather(max_bytes=1024 * 1024 if HAS_SENDMSG else SMALL_FRAME,
+                                  seal=seal)
+        if isinstance(bufs[0], FileRegion):
+            sent = bufs[0].send(peer.sock)
+            if not sent:
+                raise OSError(f"Arquivo terminou antes do esperado ({peer.address})")
+            return sent
+        if HAS_SENDMSG:
+            return peer.sock.sendmsg(bufs)
+        # Sem sendmsg: junta apenas buffers pequenos, nunca copia payloads grandes
+        if len(bufs[0]) >= SMALL_FRAME:
+            return peer.sock.send(bufs[0])
+        small = []
+        for buf in bufs:
+            if len(buf) >= SMALL_FRAME:
+                break
+            small.append(buf)
+        return peer.sock.send(b''.join(small))
+
+    def _flush(self, peer):
+        if peer.connecting or peer.detached or peer.closed:
+            # A fila é enviada quando a conexão completar ou for retomada
+            return
+        if not self._write_queue(peer):
+            return
+
+        # Produtores (ex.: transferências de arquivo) completam a fila uma
+        # vez por chamada; o loop volta a chamar enquanto produzirem
+        peer.producing = False
+        if peer.producers and peer.outbox.size < self.low_watermark:
+            size = peer.outbox.size
+            for producer in list(peer.producers):
+                if not producer.produce(peer):
+                    self.remove_producer(peer, producer)
+            peer.producing = peer.outbox.size != size
+            if not self._write_queue(peer):
+                return
+
+        pressure = peer.outbox.update_pressure()
+        if pressure is not None and peer.primary is None:
+            self._notify(self.on_backpressure, peer, pressure)
+
+        events = 0 if peer.paused else selectors.EVENT_READ
+        if peer.outbox.writable() or peer.producing:
+            events |= selectors.EVENT_WRITE
+        self._watch(peer, events)
+
+        if peer.closing and not peer.outbox:
+            self._finalize(peer)
+
+    def _watch(self, peer, events):
+        """Eventos do socket do peer; sem nenhum, ele sai do seletor"""
+        try:
+            if events:
+                self.selector.modify(peer.sock, events, self._on_peer_event)
+            else:
+                self.selector.unregister(peer.sock)
+        except KeyError:
+            if events:
+                self.selector.register(peer.sock, events, self._on_peer_event)
+
+    def _write_queue(self, peer):
+        """Escreve a fila até o socket bloquear; retorna False se o peer caiu"""
+        while peer.outbox.writable():
+            try:
+                sent = self._write(peer)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                self._close(peer)
+                return False
+            peer.bytes_sent += sent
+            for frame in peer.outbox.consume(sent):
+                if frame.kind == KIND_DATA and peer.session is not None:
+                    peer.session.frame_sent(frame)
+        return True
+
+    def _close_when_flushed(self, peer):
+        if peer.closed:
+            return
+        peer.closing = True
+        if peer.detached:
+            self._finalize(peer)
+            return
+        self._flush(peer)
+
+    def _close(self, peer):
+        """Conexão perdida: desanexa a sessão ou encerra o peer"""
+        if peer.closed or peer.detached:
+            return
+        # Só sessões já estabelecidas (com token) podem ser retomadas
+        if peer.session is not None and peer.session.token and self.running \
+                and peer.resumable and not peer.closing and peer.auth is None:
+            self._detach(peer)
+        else:
+            self._finalize(peer)
+
+    def _release(self, peer):
+        """Fecha o socket atual do peer, mantendo o resto do estado"""
+        self.peers.pop(peer.sock.fileno(), None)
+        try:
+            self.selector.unregister(peer.sock)
+        except (KeyError, ValueError):
+            pass
+        try:
+            peer.sock.close()
+        except OSError:
+            pass
+        if not peer.outbound:
+            self.inbound -= 1
+        peer.detached = True
+        if peer.throttle_timer is not None:
+            peer.throttle_timer.cancel()
+            peer.throttle_timer = None
+        peer.paused = False
+        if peer.held:
+            # Nunca entregues: numa retomada o outro lado os reenvia
+            peer.dropped += len(peer.held)
+            self.stats['dropped_frames'] += len(peer.held)
+        peer.held = None
+
+    def _detach(self, peer):
+        """Mantém a sessão enquanto aguarda a retomada"""
+        was_connecting = peer.connecting
+        self._release(peer)
+        self.detached.add(peer)
+        peer.connecting = False
+        if peer.pending is not None:
+            # A reconexão caiu antes da resposta ao hello
+            peer.outbox = peer.pending
+            peer.pending = None
+        peer.outbox.rewind()
+
+        if peer.deadline is None:
+            peer.deadline = time.monotonic() + self.resume_timeout
+            if not was_connecting:
+                logger.info(f"Conexão com {peer.address} perdida, aguardando retomada")
+                self._notify(self.on_detach, peer)
+
+        if peer.outbound:
+            delay = RECONNECT_DELAYS[min(peer.attempts, len(RECONNECT_DELAYS) - 1)]
+            peer.attempts += 1
+            peer.timer = self.call_later(delay, self._reconnect, peer)
+        else:
+            peer.timer = self.call_later(self.resume_timeout, self._expire, peer)
+
+    def _reconnect(self, peer):
+        peer.timer = None
+        if peer.closed:
+            return
+        if time.monotonic() >= peer.deadline:
+            self._finalize(peer)
+            return
+        self.detached.discard(peer)
+        peer.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        peer.sock.setblocking(False)
+        peer.reader = self._new_reader()
+        peer.connecting = True
+        peer.detached = False
+        self._start_connect(peer)
+
+    def _expire(self, peer):
+        peer.timer = None
+        if peer.detached:
+            logger.info(f"Sessão de {peer.address} expirou")
+            self._finalize(peer)
+
+    def _finalize(self, peer):
+        """Encerra o peer e sua sessão definitivamente"""
+        if peer.closed:
+            return
+        if peer.auth is not None:
+            # Saiu sem confirmar a senha
+            peer.auth = None
+            self._auth_failed(peer)
+        if not peer.detached:
+            self._release(peer)
+        peer.closed = True
+        self.detached.discard(peer)
+        if peer.timer is not None:
+            peer.timer.cancel()
+            peer.timer = None
+        if peer.session is not None and self.sessions.get(peer.session.token) is peer:
+            del self.sessions[peer.session.token]
+        if peer.primary is not None:
+            peer.primary.channels.remove(peer)
+            if peer.joined:
+                self._notify(self.on_channel_close, peer.primary, peer)
+            return
+        for channel in list(peer.channels):
+            self._finalize(channel)
+        self._notify(self.on_disconnect, peer)
+        if not peer.outbound:
+            self.rooms.leave(peer)
+
+    def _notify(self, callback, *args):
+        if callback is None:
+            return
+        try:
+            callback(*args)
+        except Exception as e:
+            logger.error(f"Erro em callback do engine: {e}")
+
+    def _shutdown(self):
+        # Avisa os peers para não aguardarem a retomada
+        bye = Frame(b'', KIND_BYE).to_bytes()
+        for peer in list(self.peers.values()):
+            if not peer.connecting:
+                try:
+                    peer.sock.send(bye)
+                except OSError:
+                    pass
+            self._finalize(peer)
+        for peer in list(self.detached):
+            self._finalize(peer)
+        for sock in self.listeners:
+            try:
+                self.selector.unregister(sock)
+            except (KeyError, ValueError):
+                pass
+            sock.close()
+        self.listeners = []
+        self.selector.close()
+        self._wake_r.close()
+        self._wake_w.close()
@@ -0,0 +1,255 @@
+import os
+import struct
+
+# Cabeçalho: tipo (1 byte), flags (1 byte), stream (2 bytes), tamanho (4 bytes)
+HEADER = struct.Struct('!BBHI')
+HEADER_SIZE = HEADER.size
+
+KIND_DATA = 0
+KIND_HELLO = 1
+KIND_ACK = 2
+KIND_BYE = 3
+KIND_PING = 4
+KIND_PONG = 5
+KIND_WINDOW = 6
+
+# O payload continua no próximo frame de dados do mesmo stream
+FLAG_MORE = 0x01
+
+# A mensagem (remontada) está comprimida (ver network.compression)
+FLAG_COMPRESSED = 0x02
+
+# O payload está cifrado com a chave da conexão (ver utils.crypto.SessionCipher)
+FLAG_ENCRYPTED = 0x04
+
+# Maior frame aceito: fragmentos de FRAGMENT_SIZE e dados de arquivo
+# (64 KiB, mais o prefixo e a cifra) cabem com folga. Mensagens maiores
+# chegam fragmentadas e são remontadas até MAX_MESSAGE_SIZE
+MAX_FRAME_SIZE = 128 * 1024
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+BUFFER_SIZE = 64 * 1024
+
+# sendfile não existe no Windows
+HAS_SENDFILE = hasattr(os, 'sendfile')
+
+# Abaixo deste tamanho é mais barato juntar cabeçalho e payload numa cópia
+# do que fazer duas chamadas de envio (quando não há sendmsg)
+SMALL_FRAME = 16 * 1024
+
+# Payloads maiores são fragmentados, para que um frame interativo nunca
+# espere mais que um fragmento na fila de saída
+FRAGMENT_SIZE = 16 * 1024
+
+# Limite até o primeiro hello: cabe no buffer de leitura, então quem ainda
+# não passou pelo handshake não faz o receptor alocar nada
+HELLO_FRAME_SIZE = FRAGMENT_SIZE
+
+
+class FrameError(Exception):
+    """Frame malformado ou maior que o limite permitido"""
+
+
+class Frame:
+    """
+    Frame completo: tipo, flags, stream e payload.
+
+    O cabeçalho é montado uma única vez e os buffers são imutáveis, então
+    o mesmo Frame pode ser entregue a vários peers sem cópias.
+    """
+
+    __slots__ = ('kind', 'flags', 'stream', 'payload', '_header')
+
+    def __init__(self, payload, kind=KIND_DATA, flags=0, stream=0):
+        self.kind = kind
+        self.flags = flags
+        self.stream = stream
+        self.payload = payload
+        self._header = None
+
+    def __len__(self):
+        return HEADER_SIZE + len(self.payload)
+
+    def header(self):
+        if self._header is None:
+            self._header = HEADER.pack(self.kind, self.flags, self.stream, len(self.payload))
+        return self._header
+
+    def buffers(self):
+        """Retorna cabeçalho e payload como buffers somente leitura"""
+        return [
+            memoryview(self.header()),
+            memoryview(self.payload).toreadonly()
+        ]
+
+    def to_bytes(self):
+        """Frame contíguo, para envios sem I/O vetorizado"""
+        return self.header() + bytes(self.payload)
+
+
+class FileRegion:
+    """
+    Trecho de um arquivo usado como buffer de saída.
+
+    Enviado com os.sendfile quando disponível (sem passar pela memória do
+    processo); fatiar avança o início, como em um memoryview.
+    """
+
+    __slots__ = ('file', 'offset', 'length')
+
+    def __init__(self, file, offset, length):
+        self.file = file
+        self.offset = offset
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        start = index.start or 0
+        return FileRegion(self.file, self.offset + start, self.length - start)
+
+    def read(self):
+        if hasattr(os, 'pread'):
+            return os.pread(self.file.fileno(), self.length, self.offset)
+        self.file.seek(self.offset)
+        return self.file.read(self.length)
+
+    def send(self, sock):
+        """Envia o trecho (ou parte dele); retorna os bytes escritos"""
+        if HAS_SENDFILE:
+            return os.sendfile(sock.fileno(), self.file.fileno(), self.offset, self.length)
+        return sock.send(self.read())
+
+
+class FileFrame(Frame):
+    """Frame de dados cujo payload é um prefixo em memória seguido de um FileRegion"""
+
+    __slots__ = ('prefix', 'region')
+
+    def __init__(self, prefix, region, flags=0, stream=0):
+        super().__init__(None, KIND_DATA, flags, stream)
+        self.prefix = prefix
+        self.region = region
+
+    def __len__(self):
+        return HEADER_SIZE + len(self.prefix) + len(self.region)
+
+    def header(self):
+        if self._header is None:
+            size = len(self.prefix) + len(self.region)
+            self._header = HEADER.pack(self.kind, self.flags, self.stream, size)
+        return self._header
+
+    def buffers(self):
+        return [memoryview(self.header()), memoryview(self.prefix), self.region]
+
+    def to_bytes(self):
+        return self.header() + self.prefix + self.region.read()
+
+
+def encode_frame(payload, kind=KIND_DATA, flags=0, stream=0):
+    """Codifica um payload como frame único em bytes"""
+    return HEADER.pack(kind, flags, stream, len(payload)) + bytes(payload)
+
+
+def fragment(frame, size=FRAGMENT_SIZE):
+    """Divide um frame de dados em fragmentos do mesmo stream (sem cópias)"""
+    payload = frame.payload
+    if frame.kind != KIND_DATA or len(payload) <= size:
+        return [frame]
+    view = memoryview(payload).toreadonly()
+    frames = []
+    for start in range(0, len(view), size):
+        last = start + size >= len(view)
+        flags = frame.flags if last else frame.flags | FLAG_MORE
+        frames.append(Frame(view[start:start + size], KIND_DATA, flags, frame.stream))
+    return frames
+
+
+class FrameReader:
+    """
+    Remonta frames a partir de um fluxo de bytes.
+
+    Os dados são recebidos com recv_into num buffer pré-alocado. Frames
+    maiores que o buffer ganham um bytearray do tamanho exato e o restante
+    do payload é recebido diretamente nele, sem cópias intermediárias.
+    Apenas frames completos são devolvidos.
+
+    Com hello_frame_size, frames maiores que ele são recusados até chegar
+    o primeiro KIND_HELLO; a partir dele vale max_frame_size.
+    """
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE, buffer_size=BUFFER_SIZE,
+                 hello_frame_size=None):
+        self.max_frame_size = max_frame_size
+        self.limit = max_frame_size if hello_frame_size is None \
+            else min(hello_frame_size, max_frame_size)
+        self._buf = bytearray(buffer_size)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+
+        # Estado de um frame grande sendo recebido diretamente no destino
+        self._large = None
+        self._large_view = None
+        self._large_filled = 0
+        self._large_header = None
+
+    def get_buffer(self):
+        """Retorna o buffer onde os próximos bytes devem ser recebidos"""
+        if self._large is not None:
+            return self._large_view[self._large_filled:]
+
+        if self._end == len(self._buf):
+            # Move o frame parcial para o início do buffer
+            pending = self._end - self._start
+            self._buf[:pending] = self._buf[self._start:self._end]
+            self._start = 0
+            self._end = pending
+        return self._view[self._end:]
+
+    def buffer_updated(self, nbytes):
+        """Registra nbytes recebidos e retorna a lista de frames completos"""
+        if self._large is not None:
+            self._large_filled += nbytes
+            if self._large_filled < len(self._large):
+                return []
+            kind, flags, stream = self._large_header
+            frame = Frame(self._large, kind, flags, stream)
+            self._large = None
+            self._large_view = None
+            self._large_header = None
+            return [frame]
+
+        self._end += nbytes
+        frames = []
+        while self._end - self._start >= HEADER_SIZE:
+            kind, flags, stream, length = HEADER.unpack_from(self._buf, self._start)
+            if length > self.limit:
+                raise FrameError(f"Frame de {length} bytes excede o limite")
+
+            body = self._start + HEADER_SIZE
+            available = self._end - body
+            if available >= length:
+                payload = bytes(self._view[body:body + length])
+                frames.append(Frame(payload, kind, flags, stream))
+                self._start = body + length
+                if kind == KIND_HELLO:
+                    self.limit = self.max_frame_size
+                continue
+
+            if HEADER_SIZE + length > len(self._buf):
+                self._begin_large(kind, flags, stream, length, body, available)
+            break
+
+        if self._start == self._end:
+            self._start = self._end = 0
+        return frames
+
+    def _begin_large(self, kind, flags, stream, length, body, available):
+        self._large = bytearray(length)
+        self._large_view = memoryview(self._large)
+        self._large_view[:available] = self._view[body:body + available]
+        self._large_filled = available
+        self._large_header = (kind, flags, stream)
+        self._start = self._end = 0
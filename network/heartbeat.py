@@ -0,0 +1,70 @@
+import struct
+import time
+
+# Intervalo (s) entre pings e tempo sem receber nada até o peer ser dado como morto
+HEARTBEAT_INTERVAL = 5.0
+DEAD_TIMEOUT = 15.0
+
+# Payload de PING/PONG: relógio de quem pingou (ns) e contagem recebida
+# (ACK de carona, ver network.session)
+HEARTBEAT = struct.Struct('!QQ')
+
+
+def ping_payload(recv_seq):
+    return HEARTBEAT.pack(time.monotonic_ns(), recv_seq)
+
+
+def pong_payload(ping, recv_seq):
+    """Devolve o relógio do ping recebido"""
+    stamp, _ = parse_heartbeat(ping)
+    return HEARTBEAT.pack(stamp, recv_seq)
+
+
+def parse_heartbeat(payload):
+    """Retorna (relógio em ns, contagem recebida)"""
+    return HEARTBEAT.unpack(bytes(payload[:HEARTBEAT.size]))
+
+
+class RttEstimator:
+    """
+    RTT suavizado no estilo do TCP (RFC 6298).
+
+    srtt é a média móvel exponencial das amostras e rttvar (o jitter) a
+    média do desvio em relação a ela; ambos em segundos.
+    """
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.last = None
+        self.samples = 0
+
+    def update(self, sample):
+        self.last = sample
+        self.samples += 1
+        if self.srtt is None:
+            self.srtt = sample
+            self.rttvar = sample / 2
+        else:
+            self.rttvar += self.BETA * (abs(self.srtt - sample) - self.rttvar)
+            self.srtt += self.ALPHA * (sample - self.srtt)
+        return self.srtt
+
+    def sample_pong(self, payload):
+        """Registra a amostra de um PONG; retorna a contagem recebida pelo peer"""
+        stamp, recv_seq = parse_heartbeat(payload)
+        self.update((time.monotonic_ns() - stamp) / 1e9)
+        return recv_seq
+
+    @property
+    def jitter(self):
+        return self.rttvar
+
+    def timeout(self, minimum=1.0):
+        """Tempo de espera recomendado (srtt + 4 * rttvar)"""
+        if self.srtt is None:
+            return minimum
+        return max(minimum, self.srtt + 4 * self.rttvar)
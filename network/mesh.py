@@ -0,0 +1,332 @@
+import os
+import json
+import math
+import time
+import random
+import struct
+import hashlib
+import logging
+from network.outbox import POLICY_KEEP
+from network.streams import STREAM_CONTROL
+
+# Configuração de logging
+logger = logging.getLogger('winp2p.mesh')
+
+# Salas em malha são reconhecidas pelo id (que vai no código da sala)
+MESH_PREFIX = 'mesh-'
+
+# Tamanho máximo de uma sala em malha
+MAX_MEMBERS = 50
+
+# Conexões diretas mantidas por membro (com MAX_MEMBERS, malha completa)
+MAX_NEIGHBORS = MAX_MEMBERS
+
+# Saltos de uma mensagem e vizinhos sorteados a cada repasse (malha completa)
+DEFAULT_TTL = 6
+FANOUT = 4
+
+# Membros aceitos de um OP_PEERS (a lista nunca passa de MAX_MEMBERS - 1)
+MAX_LEARNED = MAX_MEMBERS - 1
+
+# Tempo (s) sem discar de novo um endereço que falhou
+FAILED_TIMEOUT = 300
+
+# Ids lembrados por geração do filtro de repetidas e taxa de falso positivo
+BLOOM_CAPACITY = 4096
+BLOOM_ERROR = 0.001
+
+# Primeiro byte dos payloads da malha; fica fora das tags dos codecs
+# (JSON começa com '{', o binário usa tags até 0x7F)
+OP_GOSSIP = 0xE0    # Mensagem da aplicação espalhada por gossip
+OP_ANNOUNCE = 0xE1  # Novo membro, espalhado por gossip
+OP_HELLO = 0xE2     # Identificação ao abrir uma conexão direta
+OP_PEERS = 0xE3     # Membros conhecidos, resposta ao hello de quem entrou
+
+# Cabeçalho das mensagens por gossip: op, id da mensagem, saltos restantes
+GOSSIP_HEADER = struct.Struct('!B16sB')
+
+
+def is_mesh_room(room_id):
+    return room_id.startswith(MESH_PREFIX)
+
+
+class RotatingBloomFilter:
+    """
+    Ids de mensagens já vistas, com memória fixa.
+
+    Duas gerações de filtro de Bloom: os ids entram na atual e são
+    procurados nas duas. Quando a atual recebe capacity ids ela passa a ser
+    a anterior e uma vazia assume, então um id é lembrado por pelo menos
+    capacity inserções. Um falso positivo descarta uma mensagem nova; os
+    vários caminhos do gossip tornam isso raro de ser percebido.
+    """
+
+    def __init__(self, capacity=BLOOM_CAPACITY, error=BLOOM_ERROR):
+        self.capacity = capacity
+        self.bits = max(64, int(-capacity * math.log(error) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.current = bytearray((self.bits + 7) // 8)
+        self.previous = bytearray(len(self.current))
+        self.count = 0
+
+    def _positions(self, key):
+        # Hash duplo: k posições a partir de dois valores de 64 bits
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:], 'big') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    @staticmethod
+    def _test(bits, positions):
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in positions)
+
+    def __contains__(self, key):
+        positions = self._positions(key)
+        return self._test(self.current, positions) or self._test(self.previous, positions)
+
+    def add(self, key):
+        """Registra o id; retorna False se ele já tinha sido visto"""
+        positions = self._positions(key)
+        if self._test(self.current, positions) or self._test(self.previous, positions):
+            return False
+        if self.count >= self.capacity:
+            self.previous = self.current
+            self.current = bytearray(len(self.previous))
+            self.count = 0
+        for p in positions:
+            self.current[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+        return True
+
+
+class Member:
+    """Membro conhecido da malha e o endereço onde ele escuta"""
+
+    __slots__ = ('node', 'host', 'port', 'name')
+
+    def __init__(self, node, host, port, name=''):
+        self.node = node
+        self.host = host
+        self.port = port
+        self.name = name
+
+    def info(self):
+        return {'node': self.node, 'host': self.host, 'port': self.port, 'name': self.name}
+
+
+class Mesh:
+    """
+    Sala em malha: os membros se conectam entre si e as mensagens se
+    espalham por gossip, sem um host por onde passe todo o tráfego.
+
+    Quem entra conecta a qualquer membro, recebe a lista dos demais
+    (OP_PEERS) e é anunciado a todos (OP_ANNOUNCE). Para cada par só o
+    membro de id menor disca, então não há conexões duplicadas. A origem
+    envia a mensagem a todos os vizinhos; cada um a entrega e a repassa
+    enquanto houver saltos (TTL): a FANOUT vizinhos sorteados se está
+    ligado a todos os membros (a cópia extra só cobre conexões que caíram)
+    ou a todos os vizinhos se a malha é parcial (max_neighbors, membros
+    inalcançáveis). Um id aleatório por mensagem e um filtro de Bloom
+    rotativo descartam as cópias repetidas.
+
+    Endereços só são aprendidos de membros já identificados na sala
+    (OP_PEERS apenas do membro por onde entramos), no máximo MAX_LEARNED
+    por lista e até MAX_MEMBERS ao todo; um endereço que falhou não é
+    discado de novo por FAILED_TIMEOUT.
+
+    Roda na thread do Engine, como network.transfer: o adaptador repassa
+    peer_joined, peer_lost e handle. on_message recebe (payload, stream);
+    on_neighbor recebe (peer, Member) quando uma conexão direta se
+    identifica e on_member_left o Member cuja conexão direta caiu.
+    """
+
+    def __init__(self, engine, room_id, name='', node=None, fanout=FANOUT, ttl=DEFAULT_TTL,
+                 max_neighbors=MAX_NEIGHBORS, on_message=None, on_neighbor=None,
+                 on_member_left=None):
+        self.engine = engine
+        self.room_id = room_id
+        self.name = name
+        self.node = node or os.urandom(8).hex()
+        self.fanout = fanout
+        self.ttl = ttl
+        self.max_neighbors = max_neighbors
+        self.on_message = on_message
+        self.on_neighbor = on_neighbor
+        self.on_member_left = on_member_left
+
+        self.port = None       # Porta de escuta anunciada aos outros
+        self.members = {}      # node -> Member
+        self.neighbors = {}    # node -> peer com conexão direta
+        self._nodes = {}       # peer -> node
+        self._dialing = {}     # peer de saída ainda sem hello -> node (ou None)
+        self._failed = {}      # (host, port) -> quando a conexão falhou
+        self.seen = RotatingBloomFilter()
+
+    def join(self, host, port):
+        """Entra na malha por um membro qualquer"""
+        self._dial(None, host, port)
+
+    def publish(self, payload, stream=STREAM_CONTROL, policy=POLICY_KEEP, key=None):
+        """Origina uma mensagem: vai para todos os vizinhos"""
+        msg_id = os.urandom(16)
+        self.seen.add(msg_id)
+        data = GOSSIP_HEADER.pack(OP_GOSSIP, msg_id, self.ttl) + bytes(payload)
+        for peer in list(self.neighbors.values()):
+            self.engine.send(peer, data, policy, key, stream)
+
+    def peer_joined(self, peer):
+        hello = {'node': self.node, 'port': self.port, 'name': self.name}
+        self._send(peer, OP_HELLO, hello)
+
+    def peer_lost(self, peer):
+        if peer in self._dialing:
+            # Caiu antes do hello: não insiste nesse endereço
+            del self._dialing[peer]
+            self._failed[(peer.address[0], peer.address[1])] = time.monotonic()
+        node = self._nodes.pop(peer, None)
+        if node is None or self.neighbors.get(node) is not peer:
+            return
+        del self.neighbors[node]
+        member = self.members.pop(node, None)
+        if member is not None:
+            logger.info(f"{member.name or node} saiu da malha")
+            self._notify(self.on_member_left, member)
+        if not self.neighbors:
+            # Sem nenhum vizinho: tenta os membros restantes, sem a regra do id
+            for other in list(self.members.values()):
+                self._dial(other.node, other.host, other.port)
+
+    def handle(self, peer, payload, stream):
+        """Trata um payload da malha; retorna False se não for um deles"""
+        op = payload[0] if payload else None
+        if op in (OP_GOSSIP, OP_ANNOUNCE):
+            self._on_gossip(peer, payload, stream)
+        elif op in (OP_HELLO, OP_PEERS):
+            try:
+                body = json.loads(bytes(payload[1:]).decode('utf-8'))
+            except (UnicodeDecodeError, ValueError):
+                logger.warning(f"Mensagem da malha inválida de {peer.address}")
+                return True
+            if not isinstance(body, dict):
+                logger.warning(f"Mensagem da malha inválida de {peer.address}")
+            elif op == OP_HELLO:
+                self._on_hello(peer, body)
+            elif self._nodes.get(peer) is None or not peer.outbound:
+                # Só o membro por onde entramos (já identificado) manda a lista
+                logger.warning(f"Lista de membros não pedida de {peer.address}")
+            else:
+                members = body.get('members')
+                if isinstance(members, list):
+                    for info in members[:MAX_LEARNED]:
+                        self._learn(info)
+        else:
+            return False
+        return True
+
+    def _send(self, peer, op, body):
+        data = bytes((op,)) + json.dumps(body).encode('utf-8')
+        self.engine.send(peer, data, stream=STREAM_CONTROL)
+
+    def _dial(self, node, host, port):
+        if not port or (node is not None and node in self._dialing.values()):
+            return
+        failed = self._failed.get((host, port))
+        if failed is not None:
+            if time.monotonic() - failed < FAILED_TIMEOUT:
+                return
+            del self._failed[(host, port)]
+        peer = self.engine.connect(host, port, self.room_id)
+        self._dialing[peer] = node
+
+    def _on_gossip(self, peer, payload, stream):
+        if len(payload) < GOSSIP_HEADER.size:
+            logger.warning(f"Mensagem da malha truncada de {peer.address}")
+            return
+        if peer not in self._nodes:
+            # Quem ainda não se identificou como membro não fala na malha
+            logger.warning(f"Mensagem da malha de quem não é membro: {peer.address}")
+            return
+        op, msg_id, ttl = GOSSIP_HEADER.unpack_from(payload)
+        if not self.seen.add(msg_id):
+            return
+        body = payload[GOSSIP_HEADER.size:]
+        if ttl > 1:
+            others = [p for p in self.neighbors.values() if p is not peer]
+            if len(self.neighbors) >= len(self.members):
+                others = random.sample(others, min(self.fanout, len(others)))
+            data = GOSSIP_HEADER.pack(op, msg_id, ttl - 1) + bytes(body)
+            for target in others:
+                self.engine.send(target, data, stream=stream)
+        if op == OP_ANNOUNCE:
+            try:
+                info = json.loads(bytes(body).decode('utf-8'))
+            except (UnicodeDecodeError, ValueError):
+                logger.warning(f"Anúncio inválido de {peer.address}")
+                return
+            self._learn(info)
+        else:
+            self._notify(self.on_message, body, stream)
+
+    def _on_hello(self, peer, info):
+        node = info.get('node')
+        if not isinstance(node, str) or node == self.node:
+            # Conectamos em nós mesmos (endereço repetido na lista)
+            self._dialing.pop(peer, None)
+            self.engine.close_peer(peer)
+            return
+        self._dialing.pop(peer, None)
+        known = node in self.members
+        member = Member(node, peer.address[0], info.get('port'), info.get('name', ''))
+        self.members[node] = member
+        self._nodes[peer] = node
+        current = self.neighbors.get(node)
+        if current is None or current.closed:
+            self.neighbors[node] = peer
+            self._notify(self.on_neighbor, peer, member)
+
+        if not peer.outbound:
+            # Entrou por nós: recebe os outros membros e é anunciado a eles
+            others = [m.info() for m in self.members.values() if m.node != node]
+            self._send(peer, OP_PEERS, {'members': others})
+            if not known:
+                self._announce(member)
+
+    def _announce(self, member):
+        msg_id = os.urandom(16)
+        self.seen.add(msg_id)
+        data = GOSSIP_HEADER.pack(OP_ANNOUNCE, msg_id, self.ttl) + \
+            json.dumps(member.info()).encode('utf-8')
+        for peer in list(self.neighbors.values()):
+            if self._nodes.get(peer) != member.node:
+                self.engine.send(peer, data, stream=STREAM_CONTROL)
+
+    def _learn(self, info):
+        """Membro anunciado ou listado: conecta se o par couber a nós"""
+        if not isinstance(info, dict):
+            return
+        node, host, port = info.get('node'), info.get('host'), info.get('port')
+        if not isinstance(node, str) or node == self.node:
+            return
+        if not isinstance(host, str) or not isinstance(port, int) or not 0 < port < 65536:
+            logger.warning(f"Endereço inválido para o membro {node}")
+            return
+        member = self.members.get(node)
+        if member is None:
+            if len(self.members) >= MAX_MEMBERS:
+                return
+            member = Member(node, host, port, info.get('name', ''))
+            self.members[node] = member
+        if node in self.neighbors or node in self._dialing.values():
+            return
+        if node < self.node or len(self.neighbors) + len(self._dialing) >= self.max_neighbors:
+            # O outro lado disca (ou já temos conexões suficientes)
+            return
+        self._dial(node, member.host, member.port)
+
+    def _notify(self, callback, *args):
+        if callback is None:
+            return
+        try:
+            callback(*args)
+        except Exception as e:
+            logger.error(f"Erro em callback da malha: {e}")
@@ -0,0 +1,277 @@
+from collections import deque
+from network.framing import HEADER_SIZE, FileRegion
+from network.streams import INITIAL_WINDOW, priority, is_flow_controlled
+
+# Políticas de enfileiramento
+POLICY_KEEP = 'keep'          # Sempre entregue (ou o peer é desconectado)
+POLICY_DROP = 'drop'          # Descartado quando o peer está congestionado
+POLICY_COALESCE = 'coalesce'  # Substitui o frame pendente com a mesma chave
+
+HIGH_WATERMARK = 1024 * 1024
+LOW_WATERMARK = 256 * 1024
+QUEUE_LIMIT = 16 * 1024 * 1024
+
+
+class OutboxFull(Exception):
+    """A fila de saída do peer excedeu o limite"""
+
+
+class _Entry:
+    __slots__ = ('frame', 'bufs', 'size', 'key', 'started', 'sealed')
+
+    def __init__(self, frame, key):
+        self.frame = frame
+        self.bufs = frame.buffers()
+        self.size = len(frame)
+        self.key = key
+        self.started = False
+        self.sealed = False
+
+    @property
+    def cost(self):
+        """Bytes da janela de controle de fluxo consumidos pelo frame"""
+        return len(self.frame) - HEADER_SIZE
+
+
+class Outbox:
+    """
+    Fila de saída limitada de um peer.
+
+    Acima da marca alta o peer é considerado congestionado: frames com
+    POLICY_DROP são descartados e frames com POLICY_COALESCE substituem o
+    anterior de mesma chave que ainda não começou a ser enviado. O estado
+    só volta ao normal abaixo da marca baixa.
+
+    Os frames ficam em uma fila por stream (ver network.streams) e são
+    escritos por ordem de prioridade: um frame de chat passa na frente de
+    dados em volume já enfileirados, esperando no máximo o término do
+    fragmento em andamento. Streams em volume só enviam enquanto houver
+    janela, liberada pelo receptor com window_update.
+
+    Os frames ficam em claro na fila e são cifrados (seal, em gather) só
+    quando vão para o socket, já na ordem em que serão escritos. Assim
+    frames substituídos, reenviados ou que esperam a resposta ao hello
+    nunca gastam um contador de nonce fora de ordem.
+    """
+
+    def __init__(self, high_watermark=HIGH_WATERMARK, low_watermark=LOW_WATERMARK,
+                 limit=QUEUE_LIMIT, initial_window=INITIAL_WINDOW):
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.limit = limit
+        self.initial_window = initial_window
+        self.streams = {}
+        self.windows = {}
+        self.size = 0
+        self.backpressured = False
+        self.dropped = 0
+        self.coalesced = 0
+        self._keys = {}
+        self._order = []
+        self._current = None
+        self._gathered = []
+
+    def __bool__(self):
+        return bool(self.streams)
+
+    def push(self, frame, policy=POLICY_KEEP, key=None, front=False):
+        """
+        Enfileira um frame; retorna False se descartado.
+
+        front=True coloca o frame antes dos pendentes do mesmo stream (só é
+        seguro enquanto nada começou a ser enviado, como no hello de uma
+        conexão nova).
+        """
+        if policy == POLICY_COALESCE and key is not None:
+            pending = self._keys.get(key)
+            if pending is not None and not pending.started:
+                self.size += len(frame) - pending.size
+                pending.frame = frame
+                pending.bufs = frame.buffers()
+                pending.size = len(frame)
+                pending.sealed = False
+                self.coalesced += 1
+                return True
+
+        entry = _Entry(frame, key)
+
+        over_limit = self.size + entry.size > self.limit
+        if (policy == POLICY_DROP and self.backpressured) or (policy != POLICY_KEEP and over_limit):
+            self.dropped += 1
+            return False
+        if over_limit:
+            raise OutboxFull(f"Fila de saída excedeu {self.limit} bytes")
+
+        self._append(entry, front)
+        return True
+
+    def _append(self, entry, front=False):
+        stream = entry.frame.stream
+        queue = self.streams.get(stream)
+        if queue is None:
+            queue = self.streams[stream] = deque()
+            self._order.append(stream)
+            self._order.sort(key=lambda s: (priority(s), s))
+        if front:
+            queue.appendleft(entry)
+        else:
+            queue.append(entry)
+        self.size += entry.size
+        if entry.key is not None:
+            self._keys[entry.key] = entry
+
+    def _schedule(self):
+        """Frames prontos para envio, em ordem de prioridade"""
+        current = self._current
+        if current is not None:
+            # Um frame começado precisa terminar antes de qualquer outro
+            yield current
+        for stream in self._order:
+            window = None
+            if is_flow_controlled(stream):
+                window = self.windows.get(stream, self.initial_window)
+            for entry in self.streams[stream]:
+                if entry is current:
+                    continue
+                if window is not None:
+                    if entry.cost > window:
+                        break
+                    window -= entry.cost
+                yield entry
+
+    def pending(self, stream):
+        """Número de frames do stream ainda na fila"""
+        return len(self.streams.get(stream, ()))
+
+    def writable(self):
+        """Há frames que podem ser enviados agora (com janela disponível)"""
+        return next(self._schedule(), None) is not None
+
+    def gather(self, max_buffers=64, max_bytes=1024 * 1024, seal=None):
+        """
+        Retorna os próximos buffers pendentes para um envio vetorizado.
+
+        Um FileRegion só é devolvido sozinho (é enviado com sendfile), então
+        a lista para antes dele se já houver buffers em memória. seal(frame)
+        devolve o frame como deve ir para o socket (ex.: cifrado).
+        """
+        bufs = []
+        total = 0
+        self._gathered = gathered = []
+        for entry in self._schedule():
+            if seal is not None and not entry.started and not entry.sealed:
+                sealed = seal(entry.frame)
+                entry.sealed = True
+                if sealed is not entry.frame:
+                    self.size += len(sealed) - entry.size
+                    entry.bufs = sealed.buffers()
+                    entry.size = len(sealed)
+            gathered.append(entry)
+            for buf in entry.bufs:
+                if isinstance(buf, FileRegion):
+                    return bufs or [buf]
+                bufs.append(buf)
+                total += len(buf)
+                if len(bufs) >= max_buffers or total >= max_bytes:
+                    return bufs
+        return bufs
+
+    def consume(self, nbytes):
+        """
+        Descarta nbytes já escritos no socket (na ordem do último gather);
+        retorna os frames concluídos.
+        """
+        self.size -= nbytes
+        done = []
+        for entry in self._gathered:
+            if not nbytes:
+                break
+            if not entry.started:
+                entry.started = True
+                stream = entry.frame.stream
+                if is_flow_controlled(stream):
+                    self.windows[stream] = self.windows.get(stream, self.initial_window) - entry.cost
+            while nbytes and entry.bufs:
+                buf = entry.bufs[0]
+                if nbytes < len(buf):
+                    entry.bufs[0] = buf[nbytes:]
+                    entry.size -= nbytes
+                    nbytes = 0
+                    break
+                nbytes -= len(buf)
+                entry.size -= len(buf)
+                entry.bufs.pop(0)
+            if entry.bufs:
+                self._current = entry
+                break
+            self._remove(entry)
+            done.append(entry.frame)
+        self._gathered = []
+        return done
+
+    def _remove(self, entry):
+        if entry is self._current:
+            self._current = None
+        stream = entry.frame.stream
+        queue = self.streams[stream]
+        queue.popleft()
+        if not queue:
+            del self.streams[stream]
+            self._order.remove(stream)
+        if entry.key is not None and self._keys.get(entry.key) is entry:
+            del self._keys[entry.key]
+
+    def window_update(self, stream, increment):
+        """O receptor liberou increment bytes no stream"""
+        self.windows[stream] = self.windows.get(stream, self.initial_window) + increment
+
+    def reset_windows(self):
+        """Nova conexão (retomada): as janelas voltam ao valor inicial"""
+        self.windows.clear()
+
+    def rewind(self):
+        """Volta ao início o frame parcialmente escrito (a conexão caiu)"""
+        entry = self._current
+        if entry is None:
+            return
+        self._reset(entry)
+        entry.started = False
+        self._current = None
+        stream = entry.frame.stream
+        if is_flow_controlled(stream):
+            self.window_update(stream, entry.cost)
+
+    def _reset(self, entry):
+        """Volta o frame ao estado de antes do seal"""
+        self.size += len(entry.frame) - entry.size
+        entry.bufs = entry.frame.buffers()
+        entry.size = len(entry.frame)
+        entry.sealed = False
+
+    def unseal(self):
+        """A chave mudou: frames ainda não começados serão cifrados de novo"""
+        for queue in self.streams.values():
+            for entry in queue:
+                if entry.sealed and not entry.started:
+                    self._reset(entry)
+
+    def extend(self, other):
+        """Move para o fim desta fila todos os frames pendentes de outra"""
+        other.rewind()
+        for stream in other._order:
+            for entry in other.streams[stream]:
+                self._append(entry)
+        other.streams.clear()
+        other._order = []
+        other.size = 0
+        other._keys.clear()
+
+    def update_pressure(self):
+        """Atualiza o estado de congestionamento; retorna o novo estado se mudou"""
+        if not self.backpressured and self.size > self.high_watermark:
+            self.backpressured = True
+            return True
+        if self.backpressured and self.size <= self.low_watermark:
+            self.backpressured = False
+            return False
+        return None
@@ -0,0 +1,82 @@
+import logging
+
+logger = logging.getLogger('winp2p.presence')
+
+# Janela (s) em que mudanças de status locais são juntadas num frame só
+PRESENCE_WINDOW = 0.25
+
+
+class Presence:
+    """
+    Presença versionada dos usuários de uma sala.
+
+    Cada usuário só altera o próprio status, e cada alteração enviada
+    ganha uma versão nova. As mensagens levam só as entradas alteradas
+    (username -> [versão, status]) e quem recebe aplica uma entrada só se
+    a versão for maior que a conhecida. Cópias repetidas ou atrasadas
+    (relay, gossip) não desfazem um status mais novo. Quem entra recebe
+    um snapshot com todas as entradas.
+    """
+
+    def __init__(self, username, status='online'):
+        self.username = username
+        self.users = {username: status}
+        self.versions = {username: 1}
+        self.sent = status
+
+    def local_delta(self):
+        """Entrada própria a enviar, ou None se o status enviado não mudou"""
+        status = self.users[self.username]
+        if status == self.sent:
+            return None
+        self.sent = status
+        self.versions[self.username] += 1
+        return {self.username: [self.versions[self.username], status]}
+
+    def snapshot(self):
+        return {name: [self.versions.get(name, 0), status] for name, status in self.users.items()}
+
+    def add(self, username, version=1, status='online'):
+        self.users[username] = status
+        self.versions[username] = version
+
+    def remove(self, username):
+        self.users.pop(username, None)
+        self.versions.pop(username, None)
+
+    def apply(self, entries, add=False, limit=None):
+        """
+        Aplica entradas recebidas; add aceita usuários ainda desconhecidos
+        (snapshot) enquanto a sala tiver menos que limit usuários. Retorna
+        [(username, status)] do que mudou.
+        """
+        changes = []
+        if not isinstance(entries, dict):
+            logger.warning(f"Presença descartada: {type(entries).__name__} em vez de objeto")
+            return changes
+        for username, entry in entries.items():
+            if not isinstance(username, str) or not isinstance(entry, (list, tuple)):
+                logger.warning(f"Entrada de presença descartada: {username!r}")
+                continue
+            try:
+                version, status = int(entry[0]), str(entry[1])
+            except (TypeError, ValueError, IndexError):
+                continue
+            if username == self.username:
+                # Versão nossa de uma sessão anterior: a próxima passa dela
+                if version >= self.versions[username]:
+                    self.versions[username] = version + 1
+                continue
+            if username not in self.users:
+                if not add:
+                    continue
+                if limit is not None and len(self.users) >= limit:
+                    logger.warning(f"Snapshot com usuários demais: {username} ignorado")
+                    continue
+            elif version <= self.versions.get(username, 0):
+                continue
+            self.versions[username] = version
+            if self.users.get(username) != status:
+                self.users[username] = status
+                changes.append((username, status))
+        return changes
@@ -0,0 +1,51 @@
+import time
+
+# Limites usados pelo Server da interface: cada frame recebido vira um
+# sinal na thread da GUI, então um peer não pode mandar frames sem limite
+FRAME_RATE = 200        # Frames por segundo por conexão
+BYTE_RATE = 64 * 1024 * 1024  # Bytes por segundo por conexão (arquivos inclusos)
+ACCEPT_RATE = 20        # Conexões aceitas por segundo
+
+# Senhas de sala erradas por endereço: AUTH_FAILURE_BURST seguidas, depois
+# uma a cada 1 / AUTH_FAILURE_RATE segundos; acima disso o hello é recusado
+AUTH_FAILURE_RATE = 0.2
+AUTH_FAILURE_BURST = 5
+
+
+class TokenBucket:
+    """
+    Balde de fichas: enche rate fichas por segundo até burst (por padrão,
+    um segundo de fichas). Cada uso gasta fichas; sem fichas, o chamador
+    espera delay() segundos em vez de seguir.
+    """
+
+    __slots__ = ('rate', 'burst', 'tokens', 'stamp')
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def available(self):
+        """Fichas disponíveis agora"""
+        self._refill()
+        return self.tokens
+
+    def consume(self, amount=1):
+        """Gasta amount fichas se houver; retorna False sem gastar se não"""
+        self._refill()
+        if self.tokens < amount:
+            return False
+        self.tokens -= amount
+        return True
+
+    def delay(self, amount=1):
+        """Segundos até haver amount fichas (0 se já houver)"""
+        self._refill()
+        return max(0.0, (min(amount, self.burst) - self.tokens) / self.rate)
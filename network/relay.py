@@ -0,0 +1,89 @@
+"""
+Relay headless do WinP2P.
+
+Hospeda salas sem interface gráfica e sem PyQt5: cada sala é criada no
+primeiro join e os frames de um membro são repassados aos demais.
+
+Uso: python -m network.relay --port 5000
+"""
+import argparse
+import logging
+import signal
+import threading
+
+from network.engine import Engine
+from network.rooms import RoomTable
+
+# Configuração de logging
+logger = logging.getLogger('winp2p.relay')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='WinP2P - Relay headless')
+    parser.add_argument('--host', default='0.0.0.0', help='Endereço de escuta')
+    parser.add_argument('--port', type=int, default=5000, help='Porta de escuta')
+    parser.add_argument('--backlog', type=int, default=1024, help='Fila de conexões pendentes')
+    parser.add_argument('--max-connections', type=int, default=None,
+                        help='Limite total de conexões')
+    parser.add_argument('--max-members', type=int, default=None,
+                        help='Limite de membros por sala')
+    parser.add_argument('--recv-buffer', type=int, default=16 * 1024,
+                        help='Buffer de recepção por conexão (bytes)')
+    parser.add_argument('--frame-rate', type=float, default=None,
+                        help='Frames por segundo aceitos de cada conexão')
+    parser.add_argument('--byte-rate', type=float, default=None,
+                        help='Bytes por segundo aceitos de cada conexão')
+    parser.add_argument('--accept-rate', type=float, default=None,
+                        help='Conexões novas aceitas por segundo')
+    parser.add_argument('--log-level', default='INFO')
+    return parser.parse_args(argv)
+
+
+def build_engine(args):
+    """Monta o Engine do relay a partir dos argumentos"""
+    rooms = RoomTable(auto_create=True, max_members=args.max_members)
+
+    def on_join(peer):
+        logger.info(f"{peer.address} entrou na sala {peer.room!r}")
+
+    def on_disconnect(peer):
+        logger.info(f"{peer.address} saiu da sala {peer.room!r}")
+        if peer.throttled or peer.dropped:
+            logger.info(f"{peer.address}: {peer.throttled} frames atrasados, "
+                        f"{peer.dropped} descartados pelo limite de taxa")
+
+    return Engine(
+        backlog=args.backlog,
+        max_clients=args.max_connections,
+        rooms=rooms,
+        recv_buffer_size=args.recv_buffer,
+        frame_rate=args.frame_rate,
+        byte_rate=args.byte_rate,
+        accept_rate=args.accept_rate,
+        on_join=on_join,
+        on_disconnect=on_disconnect
+    )
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(
+        level=args.log_level.upper(),
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    engine = build_engine(args)
+    address = engine.listen(args.host, args.port)
+    logger.info(f"Relay escutando em {address[0]}:{address[1]}")
+
+    if threading.current_thread() is threading.main_thread():
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: engine.stop())
+
+    engine.run()
+    logger.info(f"Relay encerrado ({engine.stats})")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
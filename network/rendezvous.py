@@ -0,0 +1,379 @@
+"""
+Serviço de rendezvous do WinP2P para caminhos diretos por UDP.
+
+O host registra a sala; quem quer entrar pede a conexão e o serviço
+responde aos dois com os endereços um do outro (o público, visto pelo
+serviço, e o da rede local) e um id de sessão. Os dois lados então abrem
+o caminho com hole punching e seguem por um stream confiável sobre UDP
+(network.udpstream). Nenhum dado da sala passa pelo serviço.
+
+Uso: python -m network.rendezvous --port 5001
+"""
+import os
+import json
+import time
+import socket
+import signal
+import logging
+import argparse
+import threading
+
+from network.discovery import local_address
+from network.ratelimit import TokenBucket
+from network.udpstream import UdpStream, punch
+
+# Configuração de logging
+logger = logging.getLogger('winp2p.rendezvous')
+
+RENDEZVOUS_PORT = 5001
+
+# Um registro vale por REGISTRATION_TTL e é renovado a cada REGISTER_INTERVAL (s)
+REGISTRATION_TTL = 30.0
+REGISTER_INTERVAL = 10.0
+
+# Pedido de conexão: tempo máximo pela resposta e intervalo entre reenvios (s)
+REQUEST_TIMEOUT = 3.0
+REQUEST_INTERVAL = 0.5
+
+# Sessões novas por endereço de origem: CONNECT_BURST seguidas, depois
+# CONNECT_RATE por segundo; acima disso o pedido é ignorado
+CONNECT_RATE = 0.5
+CONNECT_BURST = 5
+MAX_BUCKETS = 1024
+
+MAX_DATAGRAM = 2048
+
+
+def _encode(message):
+    message['winp2p'] = 1
+    return json.dumps(message).encode('utf-8')
+
+
+def _decode(data):
+    try:
+        message = json.loads(data.decode('utf-8'))
+    except (UnicodeDecodeError, ValueError):
+        return None
+    if not isinstance(message, dict) or message.get('winp2p') != 1:
+        return None
+    return message
+
+
+def _address(value):
+    """Endereço [host, porta] vindo da rede, ou None se inválido"""
+    try:
+        host, port = value
+        return (str(host), int(port))
+    except (TypeError, ValueError):
+        return None
+
+
+class RendezvousServer:
+    """
+    Apresenta host e visitante de uma sala.
+
+    Cada registro (sala -> endereços do host) atende um pedido de conexão:
+    o socket do host passa a ser o do stream e ele registra outro para o
+    próximo. Pedidos repetidos do mesmo visitante recebem a mesma sessão.
+
+    A sala pertence a quem a registrou primeiro: 'registered' devolve um
+    segredo, e enquanto a posse não expirar (REGISTRATION_TTL sem renovar)
+    só um register com esse segredo substitui o endereço. Sessões novas
+    são limitadas por endereço de origem (CONNECT_RATE), para que ninguém
+    consuma os registros do host em sequência.
+    """
+
+    def __init__(self, host='0.0.0.0', port=RENDEZVOUS_PORT):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.sock.settimeout(1.0)
+        self.registrations = {}  # sala -> (público, local, expira em)
+        self.owners = {}         # sala -> (segredo, expira em)
+        self.sessions = {}       # (sala, público do visitante) -> (mensagens, expira em)
+        self.connect_buckets = {}  # host -> balde de sessões novas
+        self.running = False
+
+    @property
+    def address(self):
+        return self.sock.getsockname()
+
+    def serve_forever(self):
+        self.running = True
+        while self.running:
+            try:
+                data, address = self.sock.recvfrom(MAX_DATAGRAM)
+            except socket.timeout:
+                continue
+            except OSError:
+                if not self.running:
+                    break
+                continue
+            message = _decode(data)
+            if message is not None:
+                self.handle(message, address)
+        self.sock.close()
+
+    def stop(self):
+        self.running = False
+
+    def handle(self, message, address):
+        now = time.monotonic()
+        for key in [k for k, v in self.registrations.items() if v[2] <= now]:
+            del self.registrations[key]
+        for key in [k for k, v in self.owners.items() if v[1] <= now]:
+            del self.owners[key]
+        for key in [k for k, v in self.sessions.items() if v[1] <= now]:
+            del self.sessions[key]
+
+        op = message.get('op')
+        room = str(message.get('room', ''))
+        local = _address(message.get('local')) or address
+        if op == 'register':
+            owner = self.owners.get(room)
+            secret = str(message.get('secret', ''))
+            if owner is None:
+                secret = os.urandom(16).hex()
+            elif secret != owner[0]:
+                logger.warning(f"Registro da sala {room!r} recusado para {address}")
+                self._reply({'op': 'taken', 'room': room}, address)
+                return
+            self.owners[room] = (secret, now + REGISTRATION_TTL)
+            self.registrations[room] = (address, local, now + REGISTRATION_TTL)
+            self._reply({'op': 'registered', 'public': list(address), 'secret': secret}, address)
+        elif op == 'connect':
+            key = (room, address)
+            if key not in self.sessions:
+                if not self._allow_connect(address[0]):
+                    logger.warning(f"Pedidos de conexão demais de {address[0]}")
+                    return
+                host = self.registrations.pop(room, None)
+                if host is None:
+                    self._reply({'op': 'unknown', 'room': room}, address)
+                    return
+                session = int.from_bytes(os.urandom(4), 'big') or 1
+                to_host = ({
+                    'op': 'punch', 'session': session, 'room': room,
+                    'public': list(address), 'local': list(local)
+                }, host[0])
+                to_visitor = ({
+                    'op': 'punch', 'session': session, 'room': room,
+                    'public': list(host[0]), 'local': list(host[1])
+                }, address)
+                self.sessions[key] = ((to_host, to_visitor), now + REQUEST_TIMEOUT * 2)
+                logger.info(f"Sessão {session:08x} na sala {room!r}: {host[0]} <-> {address}")
+            for reply, target in self.sessions[key][0]:
+                self._reply(dict(reply), target)
+
+    def _allow_connect(self, host):
+        bucket = self.connect_buckets.get(host)
+        if bucket is None:
+            if len(self.connect_buckets) >= MAX_BUCKETS:
+                # Esquece os endereços que já voltaram ao limite cheio
+                for other in [h for h, b in self.connect_buckets.items()
+                              if b.available() >= b.burst]:
+                    del self.connect_buckets[other]
+            bucket = self.connect_buckets[host] = TokenBucket(CONNECT_RATE, CONNECT_BURST)
+        return bucket.consume()
+
+    def _reply(self, message, address):
+        try:
+            self.sock.sendto(_encode(message), address)
+        except OSError as e:
+            logger.debug(f"Falha ao responder {address}: {e}")
+
+
+def _resolve(server):
+    """(host, porta) do rendezvous com o host já resolvido, para comparar
+    com o remetente das respostas"""
+    return (socket.gethostbyname(server[0]), int(server[1]))
+
+
+def _open_socket():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('0.0.0.0', 0))
+    return sock
+
+
+def _candidates(message):
+    """Endereços do outro lado a tentar: o público e o da rede local"""
+    candidates = []
+    for key in ('public', 'local'):
+        address = _address(message.get(key))
+        if address is not None and address not in candidates:
+            candidates.append(address)
+    return candidates
+
+
+def connect_direct(server, room, timeout=REQUEST_TIMEOUT):
+    """
+    Pede ao rendezvous um caminho direto até o host da sala.
+
+    Bloqueia até o caminho estar aberto. Retorna (UdpStream, endereço do
+    host) com o stream ainda não iniciado, ou None se a sala não está
+    registrada ou o hole punching falhou (NAT simétrico, firewall); nesse
+    caso resta a conexão TCP.
+    """
+    try:
+        server = _resolve(server)
+    except OSError as e:
+        logger.warning(f"Rendezvous {server} indisponível: {e}")
+        return None
+    sock = _open_socket()
+    request = _encode({
+        'op': 'connect', 'room': room,
+        'local': [local_address(), sock.getsockname()[1]]
+    })
+    deadline = time.monotonic() + timeout
+    message = None
+    try:
+        while message is None and time.monotonic() < deadline:
+            sock.sendto(request, server)
+            sock.settimeout(REQUEST_INTERVAL)
+            try:
+                data, address = sock.recvfrom(MAX_DATAGRAM)
+            except socket.timeout:
+                continue
+            if address != server:
+                continue
+            reply = _decode(data)
+            if reply is None:
+                continue
+            if reply.get('op') == 'unknown':
+                logger.info(f"Sala {room!r} não registrada no rendezvous")
+                break
+            if reply.get('op') == 'punch':
+                message = reply
+    except OSError as e:
+        logger.warning(f"Rendezvous {server} indisponível: {e}")
+    if message is None:
+        sock.close()
+        return None
+
+    session = int(message.get('session', 0))
+    remote = punch(sock, session, _candidates(message))
+    if remote is None:
+        logger.info(f"Hole punching com a sala {room!r} falhou")
+        sock.close()
+        return None
+    return UdpStream(sock, remote, session), remote
+
+
+class PunchListener:
+    """
+    Lado do host: mantém a sala registrada e abre um caminho direto para
+    cada visitante apresentado pelo rendezvous.
+
+    on_stream(sock, address) recebe a ponta local de cada stream aberto,
+    pronta para Engine.attach. O hole punching de um visitante roda numa
+    thread própria enquanto um novo socket já fica registrado.
+    """
+
+    def __init__(self, server, room, on_stream):
+        self.server = server
+        self.room = room
+        self.on_stream = on_stream
+        self.secret = None   # Posse da sala no rendezvous (ver RendezvousServer)
+        self.sock = None
+        self.running = False
+        self._thread = None
+
+    def start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name='rendezvous', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def _run(self):
+        try:
+            self.server = _resolve(self.server)
+        except OSError as e:
+            logger.warning(f"Rendezvous {self.server} indisponível: {e}")
+            return
+        while self.running:
+            self.sock = _open_socket()
+            message = self._wait_visitor()
+            if message is None:
+                self.sock.close()
+                break
+            threading.Thread(
+                target=self._punch, args=(self.sock, message), name='punch', daemon=True
+            ).start()
+
+    def _wait_visitor(self):
+        """Registra o socket atual até um pedido de conexão chegar"""
+        local = [local_address(), self.sock.getsockname()[1]]
+        next_register = 0.0
+        self.sock.settimeout(1.0)
+        while self.running:
+            now = time.monotonic()
+            if now >= next_register:
+                register = {'op': 'register', 'room': self.room, 'local': local}
+                if self.secret is not None:
+                    register['secret'] = self.secret
+                try:
+                    self.sock.sendto(_encode(register), self.server)
+                except OSError as e:
+                    logger.warning(f"Rendezvous {self.server} indisponível: {e}")
+                next_register = now + REGISTER_INTERVAL
+            try:
+                data, address = self.sock.recvfrom(MAX_DATAGRAM)
+            except socket.timeout:
+                continue
+            except OSError:
+                return None
+            if address != self.server:
+                continue
+            message = _decode(data)
+            if message is None:
+                continue
+            if message.get('op') == 'registered' and message.get('secret'):
+                self.secret = str(message['secret'])
+            elif message.get('op') == 'taken':
+                logger.warning(f"Sala {self.room!r} já registrada por outro host no rendezvous")
+            elif message.get('op') == 'punch':
+                return message
+        return None
+
+    def _punch(self, sock, message):
+        session = int(message.get('session', 0))
+        remote = punch(sock, session, _candidates(message))
+        if remote is None or not self.running:
+            logger.info(f"Hole punching da sessão {session:08x} falhou")
+            sock.close()
+            return
+        stream = UdpStream(sock, remote, session)
+        self.on_stream(stream.start(), remote)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='WinP2P - Rendezvous')
+    parser.add_argument('--host', default='0.0.0.0', help='Endereço de escuta')
+    parser.add_argument('--port', type=int, default=RENDEZVOUS_PORT, help='Porta UDP')
+    parser.add_argument('--log-level', default='INFO')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(
+        level=args.log_level.upper(),
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    server = RendezvousServer(args.host, args.port)
+    address = server.address
+    logger.info(f"Rendezvous escutando em {address[0]}:{address[1]}/udp")
+
+    if threading.current_thread() is threading.main_thread():
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: server.stop())
+
+    server.serve_forever()
+    logger.info('Rendezvous encerrado')
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,106 @@
+DEFAULT_ROOM = ''
+
+# Tamanho máximo (caracteres) do id de uma sala pedido no hello
+MAX_ROOM_ID = 256
+
+JOIN_OK = 'ok'
+JOIN_FULL = 'room_full'
+JOIN_NOT_FOUND = 'room_not_found'
+JOIN_AUTH_FAILED = 'auth_failed'
+
+
+def valid_room_id(room_id):
+    return isinstance(room_id, str) and len(room_id) <= MAX_ROOM_ID
+
+
+class Room:
+    """Sala hospedada: membros, limite de participantes e chave da senha (opcional)"""
+
+    def __init__(self, room_id, max_members=None, relay=True, auto=False, key=None):
+        self.room_id = room_id
+        self.max_members = max_members
+        self.relay = relay
+        self.auto = auto
+        self.key = key
+        self.members = set()
+
+    def is_full(self):
+        return self.max_members is not None and len(self.members) >= self.max_members
+
+
+class RoomTable:
+    """
+    Tabela de roteamento sala -> membros.
+
+    Um único processo pode hospedar várias salas; cada peer pertence a no
+    máximo uma delas, escolhida pelo hello enviado ao conectar. Com
+    auto_create, salas desconhecidas são criadas no primeiro join (modo
+    relay); caso contrário o join é recusado.
+    """
+
+    def __init__(self, auto_create=False, max_members=None):
+        self.auto_create = auto_create
+        self.max_members = max_members
+        self.rooms = {}
+
+    def open(self, room_id, max_members=None, relay=True, key=None):
+        """Registra uma sala hospedada"""
+        room = self.rooms.get(room_id)
+        if room is None:
+            room = Room(room_id, max_members, relay, key=key)
+            self.rooms[room_id] = room
+        return room
+
+    def close(self, room_id):
+        """Remove a sala e retorna os membros que estavam nela"""
+        room = self.rooms.pop(room_id, None)
+        if room is None:
+            return set()
+        for peer in room.members:
+            peer.room = None
+        return room.members
+
+    def check(self, peer, room_id):
+        """O que join retornaria agora, sem entrar na sala"""
+        if not valid_room_id(room_id):
+            return JOIN_NOT_FOUND
+        room = self.rooms.get(room_id)
+        if room is None:
+            return JOIN_OK if self.auto_create else JOIN_NOT_FOUND
+        if room.is_full() and peer not in room.members:
+            return JOIN_FULL
+        return JOIN_OK
+
+    def join(self, peer, room_id):
+        """Coloca o peer na sala; retorna JOIN_OK, JOIN_FULL ou JOIN_NOT_FOUND"""
+        status = self.check(peer, room_id)
+        if status != JOIN_OK:
+            return status
+        room = self.rooms.get(room_id)
+        if room is None:
+            room = Room(room_id, self.max_members, relay=True, auto=True)
+            self.rooms[room_id] = room
+        if peer in room.members:
+            return JOIN_OK
+
+        self.leave(peer)
+        room.members.add(peer)
+        peer.room = room_id
+        return JOIN_OK
+
+    def leave(self, peer):
+        """Remove o peer da sua sala (salas automáticas vazias são descartadas)"""
+        room = self.rooms.get(peer.room)
+        peer.room = None
+        if room is None:
+            return
+        room.members.discard(peer)
+        if room.auto and not room.members:
+            del self.rooms[room.room_id]
+
+    def members(self, room_id):
+        room = self.rooms.get(room_id)
+        return list(room.members) if room else []
+
+    def get(self, room_id):
+        return self.rooms.get(room_id)
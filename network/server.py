@@ -1,135 +1,254 @@
-import socket
-import threading
-import json
 from PyQt5.QtCore import QThread, pyqtSignal
+from network.engine import Engine
+from network.outbox import POLICY_KEEP, HIGH_WATERMARK, LOW_WATERMARK
+from network.rooms import DEFAULT_ROOM
+from network.heartbeat import DEAD_TIMEOUT
+from network.streams import STREAM_CONTROL, STREAM_BULK
+from network.transfer import FileTransfers
+from network.mesh import Mesh
+from network.rendezvous import PunchListener
+from network.ratelimit import FRAME_RATE, BYTE_RATE, ACCEPT_RATE
+from network import codec
 
 class Server(QThread):
-    message_received = pyqtSignal(str)
+    message_received = pyqtSignal(bytes)
     client_connected = pyqtSignal(tuple)
     client_disconnected = pyqtSignal()
-    
-    def __init__(self, host, port, max_clients=1):
+    client_detached = pyqtSignal(tuple)
+    client_resumed = pyqtSignal(tuple)
+    peer_backpressure = pyqtSignal(tuple, bool)
+    peer_rtt = pyqtSignal(tuple, float)
+    transfer_progress = pyqtSignal(str, int, int, bool)
+    transfer_finished = pyqtSignal(str, bool)
+    transfer_failed = pyqtSignal(str, str)
+    transfer_offered = pyqtSignal(int, str, int)
+    member_left = pyqtSignal(str)
+
+    def __init__(self, host, port, max_clients=1, backlog=128,
+                 high_watermark=HIGH_WATERMARK, low_watermark=LOW_WATERMARK,
+                 room_id=DEFAULT_ROOM, max_connections=None, timeout=DEAD_TIMEOUT,
+                 store=None, compression_methods=None, mesh=False, username='',
+                 rendezvous=None, frame_rate=FRAME_RATE, byte_rate=BYTE_RATE,
+                 accept_rate=ACCEPT_RATE, ciphers=None, password=None):
         super().__init__()
         self.host = host
         self.port = port
         self.max_clients = max_clients
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.clients = []
+        self.backlog = backlog
+        self.room_id = room_id
+        self.engine = Engine(
+            backlog=backlog,
+            max_clients=max_connections,
+            high_watermark=high_watermark,
+            low_watermark=low_watermark,
+            default_room=room_id,
+            compression_methods=compression_methods,
+            ciphers=ciphers,
+            heartbeat_interval=timeout / 3,
+            dead_timeout=timeout,
+            on_message=self._on_message,
+            on_join=self._on_join,
+            on_disconnect=self._on_disconnect,
+            on_detach=self._on_detach,
+            on_resume=self._on_resume,
+            on_backpressure=self._on_backpressure,
+            on_rtt=self._on_rtt,
+            on_channel_open=self._on_channel_open,
+            on_channel_close=self._on_channel_close,
+            frame_rate=frame_rate,
+            byte_rate=byte_rate,
+            accept_rate=accept_rate
+        )
+        # A sala da interface; outras salas podem ser hospedadas com host_room.
+        # Na malha o repasse é feito pelo gossip, não pelo relay do engine.
+        self.room = self.engine.open_room(room_id, max_members=max_clients, relay=not mesh,
+                                          password=password or None)
+        self.mesh = None
+        if mesh:
+            self.mesh = Mesh(
+                self.engine, room_id, name=username,
+                on_message=self._on_mesh_message,
+                on_neighbor=self._on_neighbor,
+                on_member_left=self._on_member_left
+            )
+        self.transfers = FileTransfers(
+            self.engine,
+            store=store,
+            on_progress=self._on_transfer_progress,
+            on_complete=self._on_transfer_complete,
+            on_failed=self._on_transfer_failed,
+            on_offer=self._on_transfer_offered
+        )
+        # Caminhos diretos por UDP para quem entra pelo rendezvous
+        self.punch_listener = None
+        if rendezvous and not mesh:
+            self.punch_listener = PunchListener(rendezvous, room_id, self._on_direct_path)
         self.running = True
-        self.client_handlers = []
-    
+
     def run(self):
-        self.sock.bind((self.host, self.port))
-        self.sock.listen(1)
-        self.sock.settimeout(1) 
-        
-        while self.running:
-            try:
-                conn, addr = self.sock.accept()
-                
-                
-                if len(self.clients) >= self.max_clients:
-                   
-                    reject_msg = json.dumps({"type": "room_full"})
-                    conn.send(reject_msg.encode())
-                    conn.close()
-                    continue
-                
-                self.clients.append(conn)
-                self.client_connected.emit(addr)
-                
-                handler = threading.Thread(
-                    target=self.handle_client, 
-                    args=(conn, addr), 
-                    daemon=True
-                )
-                self.client_handlers.append(handler)
-                handler.start()
-                
-            except socket.timeout:
-                continue
-            except Exception as e:
-                print(f"Server accept error: {e}")
-                if not self.running:
-                    break
-    
-    def handle_client(self, conn, addr):
-        """Processa mensagens de um cliente"""
-        buffer = b""
-        
-        while self.running:
-            try:
-                chunk = conn.recv(4096)
-                if not chunk:
-                    break
-                
-                buffer += chunk
-                
-                while b"\n" in buffer:
-                    message, buffer = buffer.split(b"\n", 1)
-                    if message:
-                        self.message_received.emit(message.decode())
-                
-               
-                if buffer:
-                    self.message_received.emit(buffer.decode())
-                    buffer = b""
-                    
-            except ConnectionResetError:
-                break
-            except Exception as e:
-                print(f"Client handler error: {e}")
-                break
-        
-        if conn in self.clients:
-            self.clients.remove(conn)
-            self.client_disconnected.emit()
-        
         try:
-            conn.close()
-        except:
-            pass
-    
+            address = self.engine.listen(self.host, self.port)
+        except OSError as e:
+            if self.mesh is None:
+                print(f"Server bind error: {e}")
+                return
+            # Membro da malha: qualquer porta serve, ela é anunciada no hello
+            address = self.engine.listen(self.host, 0)
+        if self.mesh is not None:
+            self.mesh.port = address[1]
+        if self.punch_listener is not None:
+            self.punch_listener.start()
+
+        self.engine.run()
+        self.transfers.shutdown()
+
+    def _on_direct_path(self, sock, address):
+        """Visitante chegou pelo hole punching (thread do rendezvous)"""
+        self.engine.attach(sock, address)
+
+    def host_room(self, room_id, max_members=None):
+        """Hospeda uma sala adicional neste processo (sem entrega à interface)"""
+        return self.engine.open_room(room_id, max_members=max_members)
+
+    def _on_message(self, peer, data, stream):
+        """Repassa para a interface as mensagens da sala local"""
+        if peer.room != self.room_id:
+            return
+        if stream >= STREAM_BULK:
+            self.transfers.handle(peer, data, stream)
+        elif self.mesh is None or not self.mesh.handle(peer, data, stream):
+            self.message_received.emit(bytes(data))
+
+    def _on_mesh_message(self, data, stream):
+        self.message_received.emit(bytes(data))
+
+    def _on_neighbor(self, peer, member):
+        self.client_connected.emit(peer.address)
+
+    def _on_member_left(self, member):
+        self.member_left.emit(member.name)
+
+    def _on_join(self, peer):
+        if peer.room == self.room_id:
+            self.transfers.peer_joined(peer)
+            if self.mesh is not None:
+                # Na malha o peer conta quando se identifica (_on_neighbor)
+                self.mesh.peer_joined(peer)
+                return
+            self.client_connected.emit(peer.address)
+
+    def _on_disconnect(self, peer):
+        if peer.room == self.room_id:
+            self.transfers.peer_lost(peer)
+            if self.mesh is None:
+                self.client_disconnected.emit()
+                return
+            had_neighbors = bool(self.mesh.neighbors)
+            self.mesh.peer_lost(peer)
+            if had_neighbors and not self.mesh.neighbors:
+                self.client_disconnected.emit()
+
+    def _on_detach(self, peer):
+        """Conexão caiu; a sessão aguarda a retomada"""
+        if peer.room == self.room_id:
+            self.client_detached.emit(peer.address)
+
+    def _on_resume(self, peer):
+        if peer.room == self.room_id:
+            self.client_resumed.emit(peer.address)
+
+    def _on_backpressure(self, peer, congested):
+        self.peer_backpressure.emit(peer.address, congested)
+
+    def _on_rtt(self, peer):
+        """RTT suavizado do cliente, em milissegundos"""
+        if peer.room == self.room_id:
+            self.peer_rtt.emit(peer.address, peer.rtt.srtt * 1000)
+
+    def _on_channel_open(self, peer, channel):
+        self.transfers.channel_opened(peer, channel)
+
+    def _on_channel_close(self, peer, channel):
+        self.transfers.channel_closed(peer, channel)
+
+    def _on_transfer_progress(self, transfer, outgoing):
+        self.transfer_progress.emit(transfer.name, transfer.done, transfer.size, outgoing)
+
+    def _on_transfer_complete(self, transfer, outgoing):
+        self.transfer_finished.emit(transfer.path or transfer.name, outgoing)
+
+    def _on_transfer_failed(self, transfer, error):
+        self.transfer_failed.emit(transfer.name, error)
+
+    def _on_transfer_offered(self, transfer):
+        self.transfer_offered.emit(transfer.offer_id, transfer.name, transfer.size)
+
+    def answer_transfer(self, offer_id, accept):
+        """Resposta do usuário a transfer_offered"""
+        self.engine.call_soon(self.transfers.answer_offer, offer_id, accept)
+
+    def join_mesh(self, host, port):
+        """Entra na malha por um de seus membros"""
+        self.engine.call_soon(self.mesh.join, host, port)
+
+    def _peers(self):
+        """Clientes da sala local, ou os vizinhos diretos na malha"""
+        if self.mesh is not None:
+            return list(self.mesh.neighbors.values())
+        return list(self.room.members)
+
+    def send_file(self, path):
+        """Oferece um arquivo a todos os clientes da sala local"""
+        self.engine.call_soon(self._send_file, path)
+
+    def _send_file(self, path):
+        for peer in self._peers():
+            self.transfers.send_file(peer, path)
+
+    @property
+    def compression(self):
+        """Compressão aceita por todos os clientes da sala (o chat é cifrado uma vez só)"""
+        methods = {peer.compression for peer in self._peers()}
+        return methods.pop() if len(methods) == 1 else None
+
+    @property
+    def secure(self):
+        """Se todos os clientes da sala têm cifra de sessão negociada"""
+        peers = self._peers()
+        return bool(peers) and all(peer.cipher is not None for peer in peers)
+
     def has_clients(self):
-        """Verifica se existem clientes conectados"""
-        return len(self.clients) > 0
-    
-    def broadcast(self, message):
-        """Envia mensagem para todos os clientes"""
+        """Verifica se existem clientes conectados à sala local"""
+        return len(self._peers()) > 0
+
+    def broadcast(self, message, policy=POLICY_KEEP, key=None, stream=STREAM_CONTROL):
+        """Envia mensagem para todos os clientes da sala sem bloquear"""
         if isinstance(message, str):
-            if not message.endswith('\n'):
-                message = message + '\n'
             message = message.encode()
-        elif isinstance(message, bytes) and not message.endswith(b'\n'):
-            message = message + b'\n'
-            
-        disconnected = []
-        
-        for client in self.clients:
-            try:
-                client.send(message)
-            except:
-                disconnected.append(client)
-        
-        for client in disconnected:
-            if client in self.clients:
-                self.clients.remove(client)
-                self.client_disconnected.emit()
-    
+
+        return self.engine.broadcast(message, policy, key, self.room_id, stream)
+
+    def broadcast_frame(self, frame, policy=POLICY_KEEP, key=None):
+        """
+        Envia um Frame já codificado (e criptografado) a todos os clientes.
+
+        Retorna um Future com os bytes enfileirados por destinatário.
+        """
+        return self.engine.broadcast_frame(frame, policy, key, self.room_id)
+
+    def broadcast_message(self, message, policy=POLICY_KEEP, key=None, stream=STREAM_CONTROL):
+        """Envia uma mensagem (dict) com o codec negociado por cliente"""
+        if self.mesh is not None:
+            # A mesma cópia é repassada adiante: todos decodificam o binário
+            payload = codec.encode(message, 'binary')
+            self.engine.call_soon(self.mesh.publish, payload, stream, policy, key)
+            return None
+        return self.engine.broadcast_message(message, policy, key, self.room_id, stream)
+
     def stop(self):
         """Para o servidor e libera recursos"""
         self.running = False
-        
-        for client in self.clients:
-            try:
-                client.close()
-            except:
-                pass
-        
-        try:
-            self.sock.close()
-        except:
-            pass
-        
-        self.wait()
\ No newline at end of file
+        if self.punch_listener is not None:
+            self.punch_listener.stop()
+        self.engine.stop()
+        self.wait()
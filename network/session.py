@@ -0,0 +1,95 @@
+import secrets
+import struct
+from collections import deque
+
+# Quantos frames recebidos antes de enviar um ACK
+ACK_EVERY = 16
+
+# Tempo (s) que uma sessão desconectada aguarda a retomada
+RESUME_TIMEOUT = 60.0
+
+# Frames enviados e ainda não confirmados guardados para retransmissão
+RESUME_BUFFER = 1024
+
+ACK = struct.Struct('!Q')
+
+# Provas de posse da chave aceitas por sessão (uma por retomada ou canal)
+MAX_PROOFS = 256
+
+
+def new_token():
+    return secrets.token_hex(16)
+
+
+def proof_data(kind, token, nonce, recv=0):
+    """
+    O que quem retoma a sessão ou abre um canal assina com a chave de
+    retomada (ver SessionCipher.proof): o token sozinho, que vai em
+    claro, não basta. O nonce é novo a cada hello e só vale uma vez.
+    """
+    return f'{kind} {token} {nonce} {recv}'.encode('utf-8')
+
+
+class SessionState:
+    """
+    Numeração e retransmissão de uma sessão.
+
+    Os números de sequência são implícitos: cada lado conta os frames de
+    dados que terminou de escrever (sent_seq) e os que recebeu (recv_seq).
+    Frames escritos ficam em unacked até o outro lado confirmar (ACK) a
+    contagem recebida. Ao retomar, cada lado informa recv_seq e o outro
+    reenvia apenas o que faltou.
+    """
+
+    def __init__(self, token=None, buffer_size=RESUME_BUFFER):
+        self.token = new_token() if token is None else token
+        self.sent_seq = 0
+        self.recv_seq = 0
+        self.acked_recv = 0
+        self.unacked = deque(maxlen=buffer_size)
+
+    def frame_sent(self, frame):
+        """Registra um frame de dados completamente escrito no socket"""
+        self.sent_seq += 1
+        self.unacked.append((self.sent_seq, frame))
+
+    def frame_received(self):
+        """Registra um frame de dados recebido; retorna True se é hora de um ACK"""
+        self.recv_seq += 1
+        return self.recv_seq - self.acked_recv >= ACK_EVERY
+
+    def take_ack(self):
+        """Contagem a confirmar agora (ex.: de carona num PING)"""
+        self.acked_recv = self.recv_seq
+        return self.recv_seq
+
+    def ack_payload(self):
+        return ACK.pack(self.take_ack())
+
+    def acknowledge(self, count):
+        """Descarta os frames que o outro lado confirmou"""
+        while self.unacked and self.unacked[0][0] <= count:
+            self.unacked.popleft()
+
+    def replay(self, remote_recv):
+        """
+        Retorna os frames que o outro lado não recebeu, ou None se algum
+        deles já saiu do buffer (retomada impossível).
+
+        Os frames retornados serão reenviados e contados de novo, então a
+        contagem volta para remote_recv.
+        """
+        if remote_recv > self.sent_seq:
+            return None
+        self.acknowledge(remote_recv)
+        missing = self.sent_seq - remote_recv
+        if len(self.unacked) < missing:
+            return None
+        frames = [frame for _, frame in self.unacked]
+        self.unacked.clear()
+        self.sent_seq = remote_recv
+        return frames
+
+
+def parse_ack(payload):
+    return ACK.unpack(bytes(payload[:ACK.size]))[0]
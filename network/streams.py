@@ -0,0 +1,103 @@
+import struct
+from network.framing import FLAG_MORE, MAX_MESSAGE_SIZE, FrameError
+
+# Streams lógicos de uma conexão. Quanto menor o número, maior a prioridade;
+# streams a partir de STREAM_BULK dividem a prioridade mais baixa.
+STREAM_CONTROL = 0   # Hello, ACK, ping e mensagens sem stream definido
+STREAM_CHAT = 1      # Mensagens de chat
+STREAM_PRESENCE = 2  # Digitação, entrada e lista de usuários
+STREAM_BULK = 3      # Dados em volume (arquivos)
+
+# Janela de controle de fluxo inicial (bytes) de cada stream em volume; deve
+# cobrir banda x RTT, senão limita a vazão em links longos
+INITIAL_WINDOW = 4 * 1024 * 1024
+
+# Por peer: streams remontando mensagens ao mesmo tempo e bytes guardados
+# em todos eles (acima disso a conexão é derrubada)
+MAX_PARTIAL_STREAMS = 32
+MAX_BUFFERED = MAX_MESSAGE_SIZE
+
+# Payload de KIND_WINDOW: bytes liberados para o stream do cabeçalho
+WINDOW_UPDATE = struct.Struct('!I')
+
+
+def priority(stream):
+    """Classe de prioridade do stream (0 é a mais alta)"""
+    return min(stream, STREAM_BULK)
+
+
+def is_flow_controlled(stream):
+    """Só streams em volume consomem janela; os interativos nunca esperam"""
+    return stream >= STREAM_BULK
+
+
+def window_payload(increment):
+    return WINDOW_UPDATE.pack(increment)
+
+
+def parse_window(payload):
+    return WINDOW_UPDATE.unpack(bytes(payload[:WINDOW_UPDATE.size]))[0]
+
+
+class StreamReceiver:
+    """
+    Lado receptor dos streams de um peer.
+
+    Remonta mensagens fragmentadas (FLAG_MORE) por stream e contabiliza os
+    bytes recebidos nos streams com controle de fluxo, liberando janela
+    para o outro lado a cada metade da janela inicial. No máximo
+    max_streams mensagens ficam incompletas ao mesmo tempo, somando até
+    max_buffered bytes.
+    """
+
+    def __init__(self, window=INITIAL_WINDOW, max_message=MAX_MESSAGE_SIZE,
+                 max_streams=MAX_PARTIAL_STREAMS, max_buffered=MAX_BUFFERED):
+        self.window = window
+        self.max_message = max_message
+        self.max_streams = max_streams
+        self.max_buffered = max_buffered
+        self.buffered = 0
+        self._parts = {}
+        self._sizes = {}
+        self._credit = {}
+
+    def receive(self, frame):
+        """
+        Registra um frame de dados.
+
+        Retorna (payload completo ou None, bytes de janela a liberar).
+        """
+        stream = frame.stream
+        increment = 0
+        if is_flow_controlled(stream):
+            credit = self._credit.get(stream, 0) + len(frame.payload)
+            if credit >= self.window // 2:
+                increment, credit = credit, 0
+            self._credit[stream] = credit
+
+        parts = self._parts.get(stream)
+        if frame.flags & FLAG_MORE:
+            if parts is None:
+                if len(self._parts) >= self.max_streams:
+                    raise FrameError(f"Mais de {self.max_streams} mensagens incompletas")
+                parts = self._parts[stream] = []
+                self._sizes[stream] = 0
+            self._sizes[stream] += len(frame.payload)
+            self.buffered += len(frame.payload)
+            if self._sizes[stream] > self.max_message:
+                raise FrameError(f"Mensagem do stream {stream} excede o limite")
+            if self.buffered > self.max_buffered:
+                raise FrameError(f"Mensagens incompletas excedem {self.max_buffered} bytes")
+            parts.append(frame.payload)
+            return None, increment
+
+        if parts is None:
+            return frame.payload, increment
+        parts.append(frame.payload)
+        self.buffered -= self._sizes.pop(stream)
+        del self._parts[stream]
+        return b''.join(parts), increment
+
+    def reset_windows(self):
+        """Nova conexão (retomada): as janelas recomeçam dos dois lados"""
+        self._credit.clear()
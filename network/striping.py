@@ -0,0 +1,56 @@
+# Máximo de conexões (principal + auxiliares) usadas por um envio
+MAX_STRIPES = 8
+
+# Só arquivos a partir deste tamanho são divididos entre conexões
+STRIPE_MIN_SIZE = 16 * 1024 * 1024
+
+# Intervalo (s) entre medições de vazão
+STRIPE_INTERVAL = 1.0
+
+# Ganho relativo mínimo para uma conexão a mais valer a pena
+STRIPE_GAIN = 0.1
+
+
+class StripeController:
+    """
+    Número de conexões de um envio, ajustado pela vazão medida.
+
+    Começa com uma conexão e acrescenta mais uma a cada medição enquanto a
+    vazão crescer pelo menos STRIPE_GAIN; quando a última não trouxe ganho
+    ela é retirada e o número se estabiliza. Uma queda da vazão depois
+    disso (outro tráfego, rota nova) recomeça a sondagem.
+    """
+
+    def __init__(self, maximum=MAX_STRIPES, gain=STRIPE_GAIN):
+        self.maximum = maximum
+        self.gain = gain
+        self.stripes = 1
+        self.best = 0.0
+        self.settled = False
+
+    def update(self, rate):
+        """Registra a vazão (bytes/s) do último intervalo; retorna o novo alvo"""
+        if rate > self.best * (1 + self.gain):
+            self.best = rate
+            if not self.settled and self.stripes < self.maximum:
+                self.stripes += 1
+        elif not self.settled:
+            self.settled = True
+            if self.stripes > 1:
+                self.stripes -= 1
+        elif rate < self.best * (1 - self.gain):
+            self.best = rate
+            self.settled = False
+        return self.stripes
+
+    def reset(self, stripes):
+        """Uma conexão caiu: a comparação com a vazão anterior não vale mais"""
+        self.stripes = max(1, min(stripes, self.maximum))
+        self.best = 0.0
+        self.settled = False
+
+    def cap(self, available):
+        """Não foi possível abrir mais conexões: fica com as disponíveis"""
+        self.maximum = max(1, available)
+        self.stripes = min(self.stripes, self.maximum)
+        self.settled = True
@@ -0,0 +1,1043 @@
+import os
+import json
+import shutil
+import struct
+import hashlib
+import logging
+import time
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from network.framing import Frame, FileFrame, FileRegion
+from network.streams import STREAM_BULK
+from network.chunkstore import iter_chunks
+from network.striping import StripeController, STRIPE_MIN_SIZE, STRIPE_INTERVAL, MAX_STRIPES
+
+# Configuração de logging
+logger = logging.getLogger('winp2p.transfer')
+
+RECEIVED_DIR = 'received_files'
+
+# Unidade de verificação (sha256) e de retomada, e os limites aceitos
+# numa oferta recebida
+CHUNK_SIZE = 1024 * 1024
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 16 * 1024 * 1024
+
+# Espaço (bytes) que sempre fica livre no disco depois de pré-alocar um arquivo
+DISK_RESERVE = 64 * 1024 * 1024
+
+# Dados por frame: pequeno o bastante para não atrasar o chat
+FRAME_DATA = 64 * 1024
+
+# Frames de um envio mantidos na fila de saída de cada conexão
+MAX_QUEUED_FRAMES = 4
+
+# Reenvios de um mesmo chunk antes de desistir (o arquivo mudou?)
+MAX_RETRIES = 3
+
+# Intervalo mínimo (s) entre avisos de progresso
+PROGRESS_INTERVAL = 0.1
+
+# Intervalo mínimo (s) entre gravações do estado de retomada
+STATE_INTERVAL = 1.0
+
+# Quantos streams em volume são usados pelas transferências
+TRANSFER_STREAMS = 16
+
+# Cabeçalho das mensagens de transferência: operação e id da transferência
+HEADER = struct.Struct('!B16s')
+OFFSET = struct.Struct('!Q')
+VERIFY = struct.Struct('!Q32s')
+ACK = struct.Struct('!QQ')
+COUNT = struct.Struct('!I')
+MANIFEST_ENTRY = struct.Struct('!32sI')
+
+OP_OFFER = 1    # Remetente oferece o arquivo (JSON com nome e tamanho)
+OP_ACCEPT = 2   # Chunks contíguos já verificados e, depois, os avulsos
+OP_DATA = 3     # Deslocamento e dados
+OP_VERIFY = 4   # Fim de um chunk e seu sha256
+OP_ACK = 5      # Chunks contíguos verificados e o chunk confirmado
+OP_RETRY = 6    # Chunk com hash incorreto, reenviar
+OP_DONE = 7     # Arquivo completo
+OP_CANCEL = 8
+OP_STRIPES = 9  # Remetente pede conexões auxiliares ao lado que conectou
+OP_MANIFEST = 10  # Chunks por conteúdo e sha256 de cada chunk de verificação
+OP_HAVE = 11      # Bitmap dos chunks por conteúdo que o destinatário já tem
+
+
+class TransferError(Exception):
+    """Mensagem de transferência inválida"""
+
+
+def transfer_id(path):
+    """Id estável de um arquivo: o mesmo arquivo inalterado retoma a transferência"""
+    st = os.stat(path)
+    key = f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}"
+    return hashlib.sha256(key.encode('utf-8')).digest()[:16]
+
+
+# Caracteres proibidos em nomes no Windows; ':' também abriria um fluxo
+# alternativo do NTFS ou um caminho relativo a outra unidade (C:x)
+INVALID_CHARS = frozenset('<>:"/\\|?*')
+RESERVED_NAMES = frozenset(
+    ['CON', 'PRN', 'AUX', 'NUL'] + [f'{p}{n}' for p in ('COM', 'LPT') for n in range(1, 10)]
+)
+
+
+def safe_name(name):
+    """Nome de arquivo sem diretórios, seguro para gravar em received_files"""
+    name = os.path.basename(str(name).replace('\\', '/'))
+    name = ''.join('_' if c in INVALID_CHARS or ord(c) < 32 else c for c in name)
+    # O Windows descarta pontos e espaços no fim do nome
+    name = name.strip().rstrip('. ')
+    if name.split('.')[0].strip().upper() in RESERVED_NAMES:
+        name = '_' + name
+    if not name or name.startswith('.'):
+        name = 'arquivo' + name
+    return name
+
+
+def received_path(directory, name):
+    """Caminho de name em directory, garantindo que não saia dele"""
+    path = os.path.join(directory, name)
+    root = os.path.realpath(directory)
+    if os.path.commonpath([root, os.path.realpath(path)]) != root:
+        raise TransferError(f'Nome de arquivo inválido: {name!r}')
+    return path
+
+
+def free_space(directory):
+    return shutil.disk_usage(directory).free
+
+
+def message(op, tid, body=b''):
+    return HEADER.pack(op, tid) + body
+
+
+def chunk_count(size, chunk_size):
+    return max(1, -(-size // chunk_size))
+
+
+class Manifest:
+    """
+    Descrição de um arquivo para deduplicação.
+
+    entries são os chunks definidos pelo conteúdo (sha256, tamanho), na
+    ordem do arquivo (ver network.chunkstore); fixed é o sha256 de cada
+    chunk de verificação, de chunk_size bytes.
+    """
+
+    def __init__(self, entries, fixed):
+        self.entries = entries
+        self.fixed = fixed
+
+    @classmethod
+    def build(cls, path, chunk_size):
+        """Lê o arquivo uma vez (em uma thread de trabalho)"""
+        entries = []
+        fixed = []
+        hasher = hashlib.sha256()
+        filled = 0
+        with open(path, 'rb') as f:
+            for data in iter_chunks(f):
+                entries.append((hashlib.sha256(data).digest(), len(data)))
+                view = memoryview(data)
+                while view:
+                    take = min(len(view), chunk_size - filled)
+                    hasher.update(view[:take])
+                    view = view[take:]
+                    filled += take
+                    if filled == chunk_size:
+                        fixed.append(hasher.digest())
+                        hasher = hashlib.sha256()
+                        filled = 0
+        if filled or not fixed:
+            fixed.append(hasher.digest())
+        return cls(entries, fixed)
+
+    def pack(self):
+        parts = [COUNT.pack(len(self.entries))]
+        parts.extend(MANIFEST_ENTRY.pack(digest, length) for digest, length in self.entries)
+        parts.extend(self.fixed)
+        return b''.join(parts)
+
+    @classmethod
+    def unpack(cls, body, size, chunks):
+        (count,) = COUNT.unpack_from(body)
+        end = COUNT.size + count * MANIFEST_ENTRY.size
+        if len(body) != end + chunks * 32:
+            raise TransferError('Manifesto com tamanho inválido')
+        entries = [tuple(entry) for entry in MANIFEST_ENTRY.iter_unpack(body[COUNT.size:end])]
+        if sum(length for _, length in entries) != size:
+            raise TransferError('Manifesto não corresponde ao arquivo')
+        fixed = [bytes(body[i:i + 32]) for i in range(end, len(body), 32)]
+        return cls(entries, fixed)
+
+
+class OutgoingTransfer:
+    """
+    Envio de um arquivo para um peer.
+
+    É produtor (ver Engine.add_producer) em cada conexão usada com o peer:
+    a principal e, em arquivos grandes, as auxiliares. Cada conexão envia
+    chunks inteiros, pegos em ordem de uma fila comum; o destinatário
+    grava cada um na sua posição, então a ordem de chegada não importa.
+
+    Com o manifesto, os trechos que o destinatário já tem no cache (held)
+    são pulados; um chunk recusado é reenviado inteiro.
+    """
+
+    def __init__(self, manager, peer, path, stream):
+        self.manager = manager
+        self.peer = peer
+        self.path = path
+        self.stream = stream
+        self.id = transfer_id(path)
+        self.name = os.path.basename(path)
+        self.size = os.path.getsize(path)
+        self.chunk_size = CHUNK_SIZE
+        self.chunks = chunk_count(self.size, self.chunk_size)
+        self.stripes = StripeController() if self.size >= STRIPE_MIN_SIZE else None
+        self.manifest = None
+        self.held = []
+        self._held_starts = []
+        self.full = set()
+        self.failures = {}
+        self.file = None
+        self.started = False
+        self.finished = False
+        self.next_chunk = 0
+        self.retry = deque()
+        self.acked = set()
+        self.inflight = {}   # chunk -> conexão que enviou o VERIFY
+        self.cursors = {}    # conexão -> posição no chunk em andamento
+        self.lanes = []      # conexões em que o envio é produtor
+        self.waits = 0
+        self._sample = (time.monotonic(), 0)
+
+    @property
+    def done(self):
+        if self.finished:
+            return self.size
+        return min(self.size, len(self.acked) * self.chunk_size)
+
+    @property
+    def stripe_count(self):
+        return self.stripes.stripes if self.stripes is not None else 1
+
+    def offer(self):
+        info = {'name': self.name, 'size': self.size, 'chunk_size': self.chunk_size,
+                'manifest': self.manifest is not None}
+        body = json.dumps(info).encode('utf-8')
+        self.manager.send(self.peer, OP_OFFER, self.id, body, self.stream)
+        if self.manifest is not None:
+            self.manager.send(self.peer, OP_MANIFEST, self.id, self.manifest.pack(), self.stream)
+
+    def set_have(self, bitmap):
+        """Trechos que o destinatário já tem, a partir do bitmap do HAVE"""
+        entries = self.manifest.entries if self.manifest is not None else []
+        if len(bitmap) < (len(entries) + 7) // 8:
+            raise TransferError('Bitmap de chunks incompleto')
+        held = []
+        offset = 0
+        for i, (_, length) in enumerate(entries):
+            if bitmap[i // 8] >> (i % 8) & 1:
+                if held and held[-1][1] == offset:
+                    held[-1][1] += length
+                else:
+                    held.append([offset, offset + length])
+            offset += length
+        self.held = held
+        self._held_starts = [start for start, _ in held]
+        return sum(end - start for start, end in held)
+
+    def start(self, verified, extra=()):
+        """Começa (ou recomeça) a enviar o que o destinatário ainda não tem"""
+        if self.file is None:
+            self.file = open(self.path, 'rb')
+        self.started = True
+        self.acked = set(range(min(verified, self.chunks)))
+        self.acked.update(index for index in extra if index < self.chunks)
+        self.next_chunk = min(verified, self.chunks)
+        self.retry.clear()
+        self.inflight.clear()
+        self.cursors.clear()
+        self.full.clear()
+        self.failures.clear()
+        self._sample = (time.monotonic(), self.done)
+        self.wake()
+
+    def wake(self):
+        """Passa a produzir nas conexões em uso que ainda estão paradas"""
+        if self.peer is None or self.file is None or self.finished:
+            return
+        for lane in self.manager.lanes(self.peer)[:self.stripe_count]:
+            if lane not in self.lanes:
+                self.lanes.append(lane)
+                self.manager.engine.add_producer(lane, self)
+
+    def produce(self, lane):
+        """Enfileira os próximos frames; retorna False quando a conexão fica sem chunks"""
+        outbox = lane.pending if lane.pending is not None else lane.outbox
+        while outbox.pending(self.stream) < MAX_QUEUED_FRAMES:
+            position = self.cursors.pop(lane, None)
+            if position is None:
+                index = self._take_chunk(lane)
+                if index is None:
+                    if lane in self.lanes:
+                        self.lanes.remove(lane)
+                    return False
+                position = index * self.chunk_size
+            frames, position = self._next_frames(lane, position)
+            if position is not None:
+                self.cursors[lane] = position
+            self.manager.engine.queue_frames(lane, frames)
+        return True
+
+    def _take_chunk(self, lane):
+        if lane not in self.manager.lanes(self.peer)[:self.stripe_count]:
+            # Conexão a mais depois de uma redução: termina o chunk e para
+            return None
+        while self.retry:
+            index = self.retry.popleft()
+            if index not in self.acked:
+                return index
+        while self.next_chunk < self.chunks:
+            index = self.next_chunk
+            self.next_chunk += 1
+            if index not in self.acked:
+                return index
+        return None
+
+    def _next_frames(self, lane, position):
+        """Próximo frame de dados do chunk e, no fim dele, o VERIFY"""
+        index = position // self.chunk_size
+        chunk_start = index * self.chunk_size
+        chunk_end = min(chunk_start + self.chunk_size, self.size)
+        dedup = self.held and index not in self.full
+        if dedup:
+            position = self._skip_held(position, chunk_end)
+        limit = min(chunk_end, self._next_held(position)) if dedup else chunk_end
+        length = min(FRAME_DATA, limit - position)
+        frames = []
+        if length > 0:
+            prefix = message(OP_DATA, self.id, OFFSET.pack(position))
+            region = FileRegion(self.file, position, length)
+            frames.append(FileFrame(prefix, region, stream=self.stream))
+            position += length
+            if dedup:
+                position = self._skip_held(position, chunk_end)
+        if position >= chunk_end:
+            if self.manifest is not None:
+                digest = self.manifest.fixed[index]
+            else:
+                digest = self._digest(chunk_start, chunk_end - chunk_start)
+            body = VERIFY.pack(index, digest)
+            frames.append(Frame(message(OP_VERIFY, self.id, body), stream=self.stream))
+            self.inflight[index] = lane
+            position = None
+        return frames, position
+
+    def _skip_held(self, position, end):
+        """Pula o trecho que o destinatário já tem, se position estiver nele"""
+        i = bisect_right(self._held_starts, position) - 1
+        if i >= 0 and self.held[i][1] > position:
+            return min(self.held[i][1], end)
+        return position
+
+    def _next_held(self, position):
+        i = bisect_right(self._held_starts, position)
+        return self._held_starts[i] if i < len(self._held_starts) else self.size
+
+    def _digest(self, offset, length):
+        """sha256 do chunk lido em blocos (memória constante)"""
+        digest = hashlib.sha256()
+        while length:
+            data = FileRegion(self.file, offset, min(length, FRAME_DATA)).read()
+            if not data:
+                raise OSError(f"{self.path} mudou durante o envio")
+            digest.update(data)
+            offset += len(data)
+            length -= len(data)
+        return digest.digest()
+
+    def ack(self, index):
+        self.acked.add(index)
+        self.inflight.pop(index, None)
+
+    def resend(self, index):
+        """O destinatário recusou o chunk (hash incorreto): reenvia inteiro"""
+        self.inflight.pop(index, None)
+        if index in self.acked:
+            return
+        self.failures[index] = self.failures.get(index, 0) + 1
+        if self.failures[index] > MAX_RETRIES:
+            raise TransferError(f"Chunk {index} recusado {MAX_RETRIES} vezes")
+        self.full.add(index)
+        self.retry.append(index)
+        self.wake()
+
+    def drop_lane(self, lane):
+        """Conexão auxiliar caiu: o que passava por ela volta para a fila"""
+        position = self.cursors.pop(lane, None)
+        if position is not None:
+            self.retry.append(position // self.chunk_size)
+        for index, owner in list(self.inflight.items()):
+            if owner is lane:
+                del self.inflight[index]
+                self.retry.append(index)
+        if lane in self.lanes:
+            self.lanes.remove(lane)
+        self.wake()
+
+    def sample_rate(self):
+        """Vazão confirmada (bytes/s) desde a última amostra"""
+        now = time.monotonic()
+        last, done = self._sample
+        self._sample = (now, self.done)
+        return (self.done - done) / max(now - last, 1e-3)
+
+    def close(self):
+        for lane in self.lanes:
+            self.manager.engine.remove_producer(lane, self)
+        self.lanes = []
+        self.cursors.clear()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class IncomingTransfer:
+    """
+    Recepção de um arquivo em received_files.
+
+    Os dados são gravados num arquivo .part pré-alocado; um .json ao lado
+    guarda quais chunks já foram verificados, para retomar depois de uma
+    desconexão (mesmo com o programa reiniciado). Cada chunk é conferido
+    lendo o que foi gravado, então os dados podem chegar fora de ordem
+    (várias conexões) ou vir do cache de chunks.
+
+    A oferta é validada (tamanho do chunk, limite de tamanho e espaço em
+    disco) antes de qualquer coisa ser gravada.
+    """
+
+    def __init__(self, manager, peer, tid, info, stream):
+        self.manager = manager
+        self.peer = peer
+        self.id = tid
+        self.stream = stream
+        self.offer_id = None
+        self.name = safe_name(info.get('name', ''))
+        self.size = int(info['size'])
+        self.chunk_size = int(info['chunk_size'])
+        self.expects_manifest = bool(info.get('manifest'))
+        if self.size < 0 or not MIN_CHUNK_SIZE <= self.chunk_size <= MAX_CHUNK_SIZE:
+            raise TransferError('Oferta inválida')
+        if manager.max_size is not None and self.size > manager.max_size:
+            raise TransferError(f'Arquivo maior que o limite de {manager.max_size} bytes')
+        self.chunks = chunk_count(self.size, self.chunk_size)
+        base = os.path.join(manager.directory, '.' + tid.hex())
+        self.part_path = base + '.part'
+        self.state_path = base + '.json'
+        self.verified, self.extra = self._load_state()
+        if not os.path.exists(self.part_path) \
+                and self.size + DISK_RESERVE > free_space(manager.directory):
+            raise TransferError('Espaço em disco insuficiente')
+        self.manifest = None
+        self.filling = False
+        self._close_pending = False
+        self.file = None
+        self.path = None
+        self._saved = 0
+
+    @property
+    def done(self):
+        return min(self.size, (self.verified + len(self.extra)) * self.chunk_size)
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return 0, set()
+        if state.get('size') != self.size or state.get('chunk_size') != self.chunk_size \
+                or not os.path.exists(self.part_path):
+            return 0, set()
+        verified = min(int(state.get('verified', 0)), self.chunks)
+        extra = {int(i) for i in state.get('extra', []) if verified < int(i) < self.chunks}
+        return verified, extra
+
+    def _save_state(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._saved < STATE_INTERVAL:
+            return
+        self._saved = now
+        state = {
+            'name': self.name, 'size': self.size, 'chunk_size': self.chunk_size,
+            'verified': self.verified, 'extra': sorted(self.extra)
+        }
+        with open(self.state_path, 'w') as f:
+            json.dump(state, f)
+
+    def accept_body(self):
+        """Corpo do ACCEPT: chunks contíguos verificados e os avulsos"""
+        return OFFSET.pack(self.verified) + b''.join(OFFSET.pack(i) for i in sorted(self.extra))
+
+    def open(self):
+        """Abre (ou cria e pré-aloca) o arquivo parcial"""
+        mode = 'r+b' if os.path.exists(self.part_path) else 'w+b'
+        if mode == 'w+b' and self.size + DISK_RESERVE > free_space(self.manager.directory):
+            raise TransferError('Espaço em disco insuficiente')
+        self.file = open(self.part_path, mode)
+        if mode == 'w+b' and self.size:
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(self.file.fileno(), 0, self.size)
+            else:
+                self.file.truncate(self.size)
+
+    def _has(self, index):
+        return index < self.verified or index in self.extra
+
+    def _pwrite(self, offset, data):
+        if hasattr(os, 'pwrite'):
+            written = 0
+            view = memoryview(data)
+            while written < len(view):
+                written += os.pwrite(self.file.fileno(), view[written:], offset + written)
+        else:
+            self.file.seek(offset)
+            self.file.write(data)
+
+    def _hash(self, index):
+        """sha256 do chunk como está no arquivo parcial"""
+        start = index * self.chunk_size
+        length = min(start + self.chunk_size, self.size) - start
+        digest = hashlib.sha256()
+        while length:
+            data = FileRegion(self.file, start, min(length, FRAME_DATA * 4)).read()
+            if not data:
+                break
+            digest.update(data)
+            start += len(data)
+            length -= len(data)
+        return digest.digest()
+
+    def _mark(self, index):
+        self.extra.add(index)
+        while self.verified in self.extra:
+            self.extra.remove(self.verified)
+            self.verified += 1
+
+    def write(self, offset, data):
+        """Grava os dados na sua posição (a ordem de chegada não importa)"""
+        index = offset // self.chunk_size
+        if index >= self.chunks or self._has(index) or offset + len(data) > self.size:
+            return False
+        self._pwrite(offset, data)
+        return True
+
+    def verify(self, index, digest):
+        """
+        Fecha um chunk, conferindo o que está gravado (dados recebidos e os
+        vindos do cache); retorna True se confere com o hash do remetente.
+        """
+        if index >= self.chunks or self._has(index):
+            # Chunk repetido (reenviado após a queda de uma conexão)
+            return None
+        if self._hash(index) != digest:
+            return False
+        self._mark(index)
+        self._save_state()
+        return True
+
+    def fill(self, store):
+        """
+        Copia do cache os chunks do manifesto que já temos e confirma os
+        chunks de verificação completos (em uma thread de trabalho).
+
+        Retorna o bitmap do HAVE e quantos bytes vieram do cache.
+        """
+        entries = self.manifest.entries
+        have = bytearray((len(entries) + 7) // 8)
+        missing = set()
+        reused = 0
+        offset = 0
+        for i, (digest, length) in enumerate(entries):
+            first = offset // self.chunk_size
+            last = (offset + length - 1) // self.chunk_size
+            if all(self._has(index) for index in range(first, last + 1)):
+                held = True
+            else:
+                data = store.get(digest) if store is not None else None
+                held = data is not None and len(data) == length
+                if held:
+                    self._pwrite(offset, data)
+                    reused += length
+            if held:
+                have[i // 8] |= 1 << (i % 8)
+            else:
+                missing.update(range(first, last + 1))
+            offset += length
+        for index in range(self.chunks):
+            if index not in missing and not self._has(index) \
+                    and self._hash(index) == self.manifest.fixed[index]:
+                self._mark(index)
+        self._save_state(force=True)
+        return bytes(have), reused
+
+    def store_chunks(self, store):
+        """Guarda no cache os chunks do arquivo recebido (em uma thread de trabalho)"""
+        offset = 0
+        with open(self.path, 'rb') as f:
+            for digest, length in self.manifest.entries:
+                if digest not in store:
+                    data = FileRegion(f, offset, length).read()
+                    if hashlib.sha256(data).digest() == digest:
+                        store.put(digest, data)
+                offset += length
+
+    @property
+    def resuming(self):
+        """Já aceita antes (há um .part com estado): continua sem perguntar"""
+        return os.path.exists(self.part_path) and os.path.exists(self.state_path)
+
+    def complete(self):
+        """Move o arquivo verificado para o nome final"""
+        self.file.close()
+        self.file = None
+        root, ext = os.path.splitext(self.name)
+        path = received_path(self.manager.directory, self.name)
+        n = 1
+        while os.path.exists(path):
+            path = received_path(self.manager.directory, f"{root} ({n}){ext}")
+            n += 1
+        os.replace(self.part_path, path)
+        try:
+            os.remove(self.state_path)
+        except OSError:
+            pass
+        self.path = path
+        return path
+
+    def close(self):
+        if self.filling:
+            # fill ainda usa o arquivo; fecha quando terminar
+            self._close_pending = True
+            return
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self._save_state(force=True)
+
+
+class FileTransfers:
+    """
+    Transferência de arquivos sobre os streams em volume do Engine.
+
+    Roda na thread do loop, sem Qt. O remetente oferece o arquivo e o
+    destinatário aceita informando os chunks que já tem. Os dados saem
+    do disco (FileFrame: sendfile se a conexão não é cifrada) em frames
+    pequenos, para que o chat continue passando na frente; cada chunk
+    termina com seu sha256, que o destinatário confere antes de confirmar. Uma sessão expirada interrompe
+    a transferência, que é oferecida de novo quando o peer voltar.
+
+    Arquivos grandes são divididos entre várias conexões com o peer (ver
+    Engine.open_channel): a cada STRIPE_INTERVAL a vazão confirmada de
+    cada envio ajusta quantas são usadas (ver network.striping). Quem
+    abre as conexões é sempre o lado que conectou; o outro pede com
+    OP_STRIPES. O Server/Client deve repassar on_channel_open e
+    on_channel_close do Engine para channel_opened e channel_closed.
+
+    Antes de oferecer, o remetente calcula o manifesto do arquivo (chunks
+    definidos pelo conteúdo, ver network.chunkstore). O destinatário
+    copia do seu cache (store) os chunks que já tem, responde com o
+    bitmap HAVE e só o resto atravessa a rede; ao terminar, os chunks do
+    arquivo recebido entram no cache. Leituras do arquivo inteiro rodam
+    em uma thread de trabalho, fora do loop.
+
+    Nada é gravado sem consentimento: cada oferta recebida vai para
+    on_offer(transfer) e só começa quando answer_offer(transfer.offer_id,
+    True) for chamado (sem on_offer, as ofertas são recusadas). Só a
+    retomada de um arquivo já aceito continua sozinha.
+
+    Os callbacks on_offer, on_progress(transfer, outgoing) e
+    on_complete(transfer, outgoing) também são chamados na thread do loop.
+    """
+
+    def __init__(self, engine, directory=RECEIVED_DIR, store=None, on_progress=None,
+                 on_complete=None, on_failed=None, on_offer=None, max_size=None):
+        self.engine = engine
+        self.directory = directory
+        self.store = store
+        self.max_size = max_size
+        self.on_offer = on_offer
+        self.on_progress = on_progress
+        self.on_complete = on_complete
+        self.on_failed = on_failed
+        self.outgoing = {}
+        self.incoming = {}
+        self.offers = {}     # ofertas esperando resposta, como incoming
+        self._next_offer = 0
+        self._next_stream = 0
+        self._last_progress = {}
+        self._adapt_timer = None
+        self._executor = None
+        os.makedirs(directory, exist_ok=True)
+
+    def send_file(self, peer, path):
+        """Oferece um arquivo ao peer (apenas na thread do loop)"""
+        stream = STREAM_BULK + self._next_stream % TRANSFER_STREAMS
+        self._next_stream += 1
+        transfer = OutgoingTransfer(self, peer, path, stream)
+        previous = self.outgoing.pop((id(peer), transfer.id), None)
+        if previous is not None:
+            previous.close()
+        self.outgoing[(id(peer), transfer.id)] = transfer
+        self._background(Manifest.build, self._offer, transfer, path, transfer.chunk_size)
+        return transfer
+
+    def _offer(self, future, transfer):
+        if transfer not in self.outgoing.values():
+            # Cancelado enquanto o manifesto era calculado
+            return
+        try:
+            transfer.manifest = future.result()
+        except OSError as e:
+            logger.error(f"Erro ao ler {transfer.path}: {e}")
+            for key, value in list(self.outgoing.items()):
+                if value is transfer:
+                    del self.outgoing[key]
+            transfer.close()
+            self._notify(self.on_failed, transfer, str(e))
+            return
+        if transfer.peer is not None:
+            transfer.offer()
+
+    def _background(self, function, callback, context, *args):
+        """Roda function(*args) numa thread de trabalho e callback(future, context) no loop"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='transfer')
+        future = self._executor.submit(function, *args)
+        future.add_done_callback(lambda f: self.engine.call_soon(callback, f, context))
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def send(self, peer, op, tid, body=b'', stream=STREAM_BULK):
+        self.engine.send(peer, message(op, tid, body), stream=stream)
+
+    def lanes(self, peer):
+        """Conexões utilizáveis com o peer: a principal e as auxiliares prontas"""
+        return [peer] + [channel for channel in peer.channels
+                         if channel.joined and not channel.closing and not channel.closed]
+
+    def handle(self, peer, payload, stream):
+        """Processa uma mensagem recebida num stream em volume"""
+        if len(payload) < HEADER.size:
+            return
+        op, tid = HEADER.unpack_from(payload)
+        body = memoryview(payload)[HEADER.size:]
+        try:
+            if op == OP_OFFER:
+                self._on_offer(peer, tid, body, stream)
+            elif op == OP_DATA:
+                self._on_data(peer, tid, body)
+            elif op == OP_VERIFY:
+                self._on_verify(peer, tid, body)
+            elif op == OP_ACCEPT:
+                self._on_accept(peer, tid, body)
+            elif op == OP_ACK:
+                self._on_ack(peer, tid, body)
+            elif op == OP_RETRY:
+                self._on_retry(peer, tid, body)
+            elif op == OP_DONE:
+                self._on_done(peer, tid)
+            elif op == OP_STRIPES:
+                self._on_stripes(peer, body)
+            elif op == OP_MANIFEST:
+                self._on_manifest(peer, tid, body)
+            elif op == OP_HAVE:
+                self._on_have(peer, tid, body)
+            elif op == OP_CANCEL:
+                self._on_cancel(peer, tid)
+        except (TransferError, OSError, ValueError, KeyError, struct.error) as e:
+            logger.error(f"Erro na transferência {tid.hex()}: {e}")
+            self._fail(peer, tid, e)
+
+    def _on_offer(self, peer, tid, body, stream):
+        info = json.loads(bytes(body).decode('utf-8'))
+        if not isinstance(info, dict):
+            raise TransferError('Oferta inválida')
+        previous = self.incoming.pop((id(peer), tid), None)
+        if previous is not None:
+            previous.close()
+        self.offers.pop((id(peer), tid), None)
+        transfer = IncomingTransfer(self, peer, tid, info, stream)
+        if transfer.resuming:
+            logger.info(f"Retomando {transfer.name} em {transfer.done} bytes")
+            self._start_incoming(peer, transfer)
+            return
+        if self.on_offer is None:
+            logger.info(f"Oferta de {transfer.name} recusada (sem quem a aceite)")
+            self.send(peer, OP_CANCEL, tid)
+            return
+        self._next_offer += 1
+        transfer.offer_id = self._next_offer
+        self.offers[(id(peer), tid)] = transfer
+        self._notify(self.on_offer, transfer)
+
+    def answer_offer(self, offer_id, accept):
+        """Aceita ou recusa uma oferta de on_offer (apenas na thread do loop)"""
+        for key, transfer in list(self.offers.items()):
+            if transfer.offer_id != offer_id:
+                continue
+            del self.offers[key]
+            peer = transfer.peer
+            if not accept:
+                self.send(peer, OP_CANCEL, transfer.id)
+                return
+            try:
+                self._start_incoming(peer, transfer)
+            except (TransferError, OSError) as e:
+                logger.error(f"Erro ao receber {transfer.name}: {e}")
+                self.send(peer, OP_CANCEL, transfer.id)
+                self._notify(self.on_failed, transfer, str(e))
+            return
+
+    def _start_incoming(self, peer, transfer):
+        """Oferta aceita: pré-aloca o arquivo e responde (depois do manifesto, se houver)"""
+        transfer.open()
+        self.incoming[(id(peer), transfer.id)] = transfer
+        if transfer.manifest is not None:
+            self._fill(peer, transfer)
+        elif not transfer.expects_manifest:
+            self._accept(peer, transfer)
+
+    def _on_manifest(self, peer, tid, body):
+        transfer = self.incoming.get((id(peer), tid)) or self.offers.get((id(peer), tid))
+        if transfer is None or transfer.manifest is not None:
+            return
+        transfer.manifest = Manifest.unpack(body, transfer.size, transfer.chunks)
+        if transfer.file is not None:
+            self._fill(peer, transfer)
+
+    def _fill(self, peer, transfer):
+        transfer.filling = True
+        self._background(transfer.fill, self._filled, (peer, transfer), self.store)
+
+    def _filled(self, future, context):
+        peer, transfer = context
+        transfer.filling = False
+        if transfer._close_pending or self.incoming.get((id(peer), transfer.id)) is not transfer:
+            transfer.close()
+            return
+        try:
+            have, reused = future.result()
+        except OSError as e:
+            logger.error(f"Erro ao preparar {transfer.name}: {e}")
+            self._fail(peer, transfer.id, e)
+            return
+        if reused:
+            logger.info(f"{transfer.name}: {reused} de {transfer.size} bytes vieram do cache")
+        self.send(peer, OP_HAVE, transfer.id, have, transfer.stream)
+        self._accept(peer, transfer)
+
+    def _accept(self, peer, transfer):
+        self.send(peer, OP_ACCEPT, transfer.id, transfer.accept_body(), transfer.stream)
+        if transfer.verified == transfer.chunks:
+            self._finish_incoming(peer, transfer)
+
+    def _on_data(self, peer, tid, body):
+        transfer = self.incoming.get((id(peer), tid))
+        if transfer is None:
+            return
+        (offset,) = OFFSET.unpack_from(body)
+        transfer.write(offset, body[OFFSET.size:])
+
+    def _on_verify(self, peer, tid, body):
+        transfer = self.incoming.get((id(peer), tid))
+        if transfer is None:
+            return
+        index, digest = VERIFY.unpack_from(body)
+        ok = transfer.verify(index, digest)
+        if ok is None:
+            return
+        if not ok:
+            logger.warning(f"Chunk {index} de {transfer.name} não confere, reenviando")
+            self.send(peer, OP_RETRY, tid, OFFSET.pack(index), transfer.stream)
+            return
+        self.send(peer, OP_ACK, tid, ACK.pack(transfer.verified, index), transfer.stream)
+        self._progress(transfer, False)
+        if transfer.verified == transfer.chunks:
+            self._finish_incoming(peer, transfer)
+
+    def _finish_incoming(self, peer, transfer):
+        del self.incoming[(id(peer), transfer.id)]
+        path = transfer.complete()
+        logger.info(f"Arquivo recebido: {path}")
+        self.send(peer, OP_DONE, transfer.id, b'', transfer.stream)
+        self._notify(self.on_complete, transfer, False)
+        if self.store is not None and transfer.manifest is not None:
+            self._background(transfer.store_chunks, self._stored, transfer, self.store)
+
+    def _stored(self, future, transfer):
+        if future.exception() is not None:
+            logger.warning(f"Falha ao guardar {transfer.name} no cache: {future.exception()}")
+
+    def _on_accept(self, peer, tid, body):
+        transfer = self.outgoing.get((id(peer), tid))
+        if transfer is None or transfer.started:
+            # Aceite repetido, ou de um envio de outro membro (via relay)
+            return
+        (verified,) = OFFSET.unpack_from(body)
+        extra = [i for (i,) in OFFSET.iter_unpack(body[OFFSET.size:])]
+        transfer.start(verified, extra)
+        self._schedule_adapt()
+
+    def _on_have(self, peer, tid, body):
+        transfer = self.outgoing.get((id(peer), tid))
+        if transfer is not None and not transfer.started:
+            held = transfer.set_have(body)
+            if held:
+                logger.info(f"{transfer.name}: {held} de {transfer.size} bytes já estão no destino")
+
+    def _on_ack(self, peer, tid, body):
+        transfer = self.outgoing.get((id(peer), tid))
+        if transfer is not None:
+            _, index = ACK.unpack_from(body)
+            transfer.ack(index)
+            self._progress(transfer, True)
+
+    def _on_retry(self, peer, tid, body):
+        transfer = self.outgoing.get((id(peer), tid))
+        if transfer is not None:
+            (index,) = OFFSET.unpack_from(body)
+            transfer.resend(index)
+
+    def _on_done(self, peer, tid):
+        transfer = self.outgoing.pop((id(peer), tid), None)
+        if transfer is not None:
+            transfer.finished = True
+            transfer.close()
+            self._notify(self.on_complete, transfer, True)
+
+    def _on_stripes(self, peer, body):
+        """O remetente quer mais conexões e só este lado pode abri-las"""
+        (count,) = OFFSET.unpack_from(body)
+        self._open_channels(peer, min(count, MAX_STRIPES) - 1)
+
+    def _open_channels(self, peer, count):
+        while len(peer.channels) < count:
+            if self.engine.open_channel(peer) is None:
+                break
+
+    def _schedule_adapt(self):
+        if self._adapt_timer is None:
+            self._adapt_timer = self.engine.call_later(STRIPE_INTERVAL, self._adapt)
+
+    def _adapt(self):
+        """Ajusta o número de conexões de cada envio pela vazão do último intervalo"""
+        self._adapt_timer = None
+        running = False
+        for transfer in list(self.outgoing.values()):
+            if transfer.peer is None or not transfer.started:
+                continue
+            running = True
+            rate = transfer.sample_rate()
+            if transfer.stripes is None:
+                continue
+            available = len(self.lanes(transfer.peer))
+            if available < transfer.stripe_count:
+                # Conexões ainda abrindo: a amostra não vale
+                transfer.waits += 1
+                if transfer.waits < 3:
+                    continue
+                transfer.stripes.cap(available)
+            transfer.waits = 0
+            stripes = transfer.stripes.update(rate)
+            if stripes > available:
+                if transfer.peer.outbound:
+                    self._open_channels(transfer.peer, stripes - 1)
+                else:
+                    self.send(transfer.peer, OP_STRIPES, transfer.id,
+                              OFFSET.pack(stripes), transfer.stream)
+            transfer.wake()
+        if running:
+            self._schedule_adapt()
+
+    def channel_opened(self, peer, channel):
+        for transfer in list(self.outgoing.values()):
+            if transfer.peer is peer:
+                transfer.wake()
+
+    def channel_closed(self, peer, channel):
+        for transfer in list(self.outgoing.values()):
+            if transfer.peer is peer:
+                if transfer.stripes is not None:
+                    transfer.stripes.reset(len(self.lanes(peer)))
+                transfer.drop_lane(channel)
+
+    def _on_cancel(self, peer, tid):
+        """O outro lado recusou a oferta ou desistiu da transferência"""
+        transfer = self.outgoing.get((id(peer), tid)) or self.incoming.get((id(peer), tid))
+        self._cancel(peer, tid)
+        if transfer is not None:
+            self._notify(self.on_failed, transfer, 'cancelada pelo outro lado')
+
+    def _cancel(self, peer, tid):
+        self.offers.pop((id(peer), tid), None)
+        for table in (self.outgoing, self.incoming):
+            transfer = table.pop((id(peer), tid), None)
+            if transfer is not None:
+                transfer.close()
+
+    def _fail(self, peer, tid, error):
+        transfer = self.outgoing.get((id(peer), tid)) or self.incoming.get((id(peer), tid))
+        self._cancel(peer, tid)
+        self.send(peer, OP_CANCEL, tid)
+        if transfer is not None:
+            self._notify(self.on_failed, transfer, str(error))
+
+    def peer_joined(self, peer):
+        """Oferece de novo os envios interrompidos (novo peer na sala)"""
+        for (key, tid), transfer in list(self.outgoing.items()):
+            if transfer.peer is None:
+                del self.outgoing[(key, tid)]
+                transfer.peer = peer
+                transfer.started = False
+                self.outgoing[(id(peer), tid)] = transfer
+                if transfer.manifest is not None:
+                    transfer.offer()
+
+    def peer_lost(self, peer):
+        """Sessão encerrada: envios ficam aguardando, recepções são fechadas"""
+        for (key, tid), transfer in list(self.outgoing.items()):
+            if key == id(peer):
+                transfer.close()
+                transfer.peer = None
+                del self.outgoing[(key, tid)]
+                self.outgoing[(None, tid)] = transfer
+        for (key, tid), transfer in list(self.incoming.items()):
+            if key == id(peer):
+                transfer.close()
+                del self.incoming[(key, tid)]
+        for key in [key for key in self.offers if key[0] == id(peer)]:
+            del self.offers[key]
+
+    def _progress(self, transfer, outgoing):
+        now = time.monotonic()
+        key = (outgoing, transfer.id)
+        if transfer.done < transfer.size and now - self._last_progress.get(key, 0) < PROGRESS_INTERVAL:
+            return
+        self._last_progress[key] = now
+        self._notify(self.on_progress, transfer, outgoing)
+
+    def _notify(self, callback, *args):
+        if callback is None:
+            return
+        try:
+            callback(*args)
+        except Exception as e:
+            logger.error(f"Erro em callback de transferência: {e}")
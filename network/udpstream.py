@@ -0,0 +1,429 @@
+import time
+import struct
+import socket
+import logging
+import selectors
+import threading
+from network.heartbeat import RttEstimator, DEAD_TIMEOUT
+
+# Configuração de logging
+logger = logging.getLogger('winp2p.udpstream')
+
+# Cabeçalho: tipo, sessão, seq, ack cumulativo (próximo esperado), janela
+# livre do receptor (pacotes) e SACK (bit i: recebido o pacote ack + 1 + i)
+HEADER = struct.Struct('!BIIIHQ')
+
+PKT_PUNCH = 1
+PKT_PUNCH_ACK = 2
+PKT_DATA = 3
+PKT_ACK = 4
+PKT_FIN = 5
+
+# Dados por pacote: cabe numa MTU de 1280 (mínimo do IPv6) com folga
+MSS = 1200
+
+# Pacotes em trânsito (e fora de ordem no receptor) no máximo
+MAX_WINDOW = 1024
+
+# Janela de congestionamento inicial (pacotes)
+INITIAL_CWND = 16
+
+# Limites do timeout de retransmissão (s)
+MIN_RTO = 0.2
+MAX_RTO = 8.0
+
+# Fração do RTT tolerada como reordenação antes de dar um pacote por perdido
+REORDER = 0.25
+
+# Buffers do socket UDP: comportam a janela inteira em rajada
+SOCKET_BUFFER = 2 * 1024 * 1024
+
+# Sem tráfego, um ACK a cada KEEPALIVE_INTERVAL mantém o mapeamento do NAT
+KEEPALIVE_INTERVAL = 5.0
+
+# Abertura do caminho: intervalo entre tentativas e tempo máximo (s)
+PUNCH_INTERVAL = 0.1
+PUNCH_TIMEOUT = 5.0
+
+# Leitura máxima do lado local por vez
+LOCAL_READ = 64 * 1024
+
+
+def packet(kind, session, seq=0, ack=0, window=0, sack=0, payload=b''):
+    return HEADER.pack(kind, session, seq, ack, window, sack) + payload
+
+
+def punch(sock, session, candidates, timeout=PUNCH_TIMEOUT):
+    """
+    Abre o caminho UDP até o outro lado (hole punching).
+
+    Os dois lados enviam PKT_PUNCH a todos os endereços candidatos
+    (público e local); o envio cria o mapeamento no próprio NAT e o
+    primeiro pacote que chega do outro lado mostra qual endereço funciona.
+    Retorna esse endereço, ou None se nada chegou dentro do tempo.
+    """
+    deadline = time.monotonic() + timeout
+    remote = None
+    confirmed = False
+    previous = sock.gettimeout()
+    try:
+        while time.monotonic() < deadline and not confirmed:
+            for address in ([remote] if remote else candidates):
+                try:
+                    sock.sendto(packet(PKT_PUNCH, session), address)
+                except OSError:
+                    pass
+            end = time.monotonic() + PUNCH_INTERVAL
+            while time.monotonic() < end:
+                sock.settimeout(max(0.001, end - time.monotonic()))
+                try:
+                    # Espia antes: um pacote do stream fica para o UdpStream
+                    data, address = sock.recvfrom(2048, socket.MSG_PEEK)
+                except socket.timeout:
+                    break
+                except OSError:
+                    continue
+                kind, got_session = HEADER.unpack_from(data)[:2] \
+                    if len(data) >= HEADER.size else (0, None)
+                if kind in (PKT_DATA, PKT_ACK) and got_session == session:
+                    # O outro lado já começou o stream
+                    remote = address
+                    confirmed = True
+                    break
+                try:
+                    sock.recvfrom(2048)
+                except OSError:
+                    pass
+                if got_session != session:
+                    continue
+                if kind == PKT_PUNCH:
+                    sock.sendto(packet(PKT_PUNCH_ACK, session), address)
+                    remote = address
+                elif kind == PKT_PUNCH_ACK:
+                    # O outro lado recebe e responde: caminho aberto nos dois sentidos
+                    remote = address
+                    confirmed = True
+                    break
+    finally:
+        sock.settimeout(previous)
+    return remote if confirmed else None
+
+
+class UdpStream:
+    """
+    Stream confiável e ordenado sobre um caminho UDP já aberto.
+
+    Os bytes são numerados em pacotes de até MSS bytes. O receptor
+    confirma com ACK cumulativo mais SACK e anuncia a janela livre; o
+    emissor retransmite por timeout (RTO a partir do RTT suavizado, ver
+    network.heartbeat) ou ao ver buracos no SACK, e controla o envio com
+    uma janela de congestionamento AIMD. Números de pacote têm 32 bits.
+
+    Para o resto do programa o stream é um socket local (socketpair)
+    devolvido por start(): o Engine o adota com attach como se fosse uma
+    conexão TCP. Uma thread própria liga as duas pontas.
+    """
+
+    def __init__(self, sock, remote, session):
+        self.sock = sock
+        self.remote = remote
+        self.session = session
+        self.local = None
+        self.running = False
+        self.selector = selectors.DefaultSelector()
+        self.rtt = RttEstimator()
+        self.rto = 1.0
+
+        # Emissor
+        self.next_seq = 0
+        self.unacked = {}       # seq -> [tipo, dados, enviado em, retransmitido]
+        self.snd_una = 0
+        self.cwnd = float(INITIAL_CWND)
+        self.ssthresh = float(MAX_WINDOW)
+        self.peer_window = MAX_WINDOW
+        self.recover = 0
+        self.rto_deadline = None
+        self.local_eof = False
+        self.fin_sent = False
+
+        # Receptor
+        self.rcv_next = 0
+        self.out_of_order = {}  # seq -> (tipo, dados)
+        self.deliver = bytearray()
+        self.remote_fin = False
+
+        self.last_recv = time.monotonic()
+        self.last_send = 0.0
+        self._thread = None
+        self._events = {}
+
+    def start(self):
+        """Inicia a thread e retorna a ponta local do stream"""
+        family = socket.AF_UNIX if hasattr(socket, 'AF_UNIX') else socket.AF_INET
+        engine_end, self.local = socket.socketpair(family, socket.SOCK_STREAM)
+        self.local.setblocking(False)
+        self.sock.setblocking(False)
+        for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+            try:
+                self.sock.setsockopt(socket.SOL_SOCKET, option, SOCKET_BUFFER)
+            except OSError:
+                pass
+        self.running = True
+        self.selector.register(self.sock, selectors.EVENT_READ, 'udp')
+        self.selector.register(self.local, selectors.EVENT_READ, 'local')
+        self._events = {'local': selectors.EVENT_READ}
+        self._thread = threading.Thread(target=self._run, name='udpstream', daemon=True)
+        self._thread.start()
+        return engine_end
+
+    def close(self):
+        self.running = False
+
+    def _run(self):
+        try:
+            while self.running:
+                for key, mask in self.selector.select(self._next_timeout()):
+                    if key.data == 'udp':
+                        self._read_udp()
+                    else:
+                        if mask & selectors.EVENT_READ:
+                            self._read_local()
+                        if mask & selectors.EVENT_WRITE:
+                            self._write_local()
+                self._on_timers()
+                self._update_interest()
+        except Exception as e:
+            logger.error(f"Erro no stream UDP com {self.remote}: {e}")
+        finally:
+            self.selector.close()
+            self.local.close()
+            self.sock.close()
+
+    def _next_timeout(self):
+        now = time.monotonic()
+        deadlines = [self.last_send + KEEPALIVE_INTERVAL, self.last_recv + DEAD_TIMEOUT]
+        if self.rto_deadline is not None:
+            deadlines.append(self.rto_deadline)
+        return max(0.0, min(deadlines) - now)
+
+    def _send(self, kind, seq=0, payload=b''):
+        window = max(0, MAX_WINDOW - len(self.out_of_order) - len(self.deliver) // MSS)
+        try:
+            self.sock.sendto(
+                packet(kind, self.session, seq, self.rcv_next, window, self._sack(), payload),
+                self.remote
+            )
+        except (BlockingIOError, InterruptedError):
+            # Buffer do socket cheio: tratado como perda, o RTO reenvia
+            pass
+        except OSError as e:
+            logger.debug(f"Falha ao enviar para {self.remote}: {e}")
+        self.last_send = time.monotonic()
+
+    def _sack(self):
+        bits = 0
+        for seq in self.out_of_order:
+            offset = seq - self.rcv_next - 1
+            if 0 <= offset < 64:
+                bits |= 1 << offset
+        return bits
+
+    # Emissor
+
+    def _window(self):
+        return min(int(self.cwnd), self.peer_window, MAX_WINDOW)
+
+    def _read_local(self):
+        room = self._window() - len(self.unacked)
+        while room > 0 and not self.local_eof:
+            try:
+                data = self.local.recv(min(LOCAL_READ, room * MSS))
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                data = b''
+            if not data:
+                self.local_eof = True
+                break
+            for start in range(0, len(data), MSS):
+                self._transmit(PKT_DATA, data[start:start + MSS])
+                room -= 1
+        if self.local_eof and not self.fin_sent:
+            self.fin_sent = True
+            self._transmit(PKT_FIN, b'')
+
+    def _transmit(self, kind, payload):
+        seq = self.next_seq
+        self.next_seq += 1
+        self.unacked[seq] = [kind, payload, time.monotonic(), False]
+        self._send(kind, seq, payload)
+        if self.rto_deadline is None:
+            self.rto_deadline = time.monotonic() + self.rto
+
+    def _retransmit(self, seq):
+        entry = self.unacked[seq]
+        entry[2] = time.monotonic()
+        entry[3] = True
+        self._send(entry[0], seq, entry[1])
+
+    def _on_ack(self, ack, window, sack):
+        self.peer_window = window
+        now = time.monotonic()
+        acked = 0
+        latest = None
+        for seq in range(self.snd_una, min(ack, self.next_seq)):
+            entry = self.unacked.pop(seq, None)
+            if entry is None:
+                continue
+            acked += 1
+            latest = entry[2]
+            if not entry[3]:
+                # Karn: só pacotes não retransmitidos dão amostra de RTT
+                self.rtt.update(now - entry[2])
+        seq = ack + 1
+        while sack:
+            if sack & 1:
+                entry = self.unacked.pop(seq, None)
+                if entry is not None:
+                    acked += 1
+                    latest = entry[2] if latest is None else max(latest, entry[2])
+            sack >>= 1
+            seq += 1
+
+        if ack > self.snd_una:
+            self.snd_una = ack
+            self.rto = min(MAX_RTO, self.rtt.timeout(MIN_RTO))
+            self.rto_deadline = now + self.rto if self.unacked else None
+        if acked and self.snd_una >= self.recover:
+            for _ in range(acked):
+                # Crescimento exponencial até ssthresh, depois linear
+                self.cwnd += 1 if self.cwnd < self.ssthresh else 1 / self.cwnd
+            self.cwnd = min(self.cwnd, MAX_WINDOW)
+        if latest is not None and self.unacked:
+            self._detect_losses(latest)
+
+    def _detect_losses(self, latest):
+        """
+        Perda por tempo: um pacote enviado antes do último confirmado (com
+        folga de REORDER do RTT para reordenação) não vai mais chegar. Vale
+        para vários buracos numa janela só, sem esperar um RTO por buraco.
+        """
+        threshold = latest - (self.rtt.srtt or 0.0) * REORDER
+        lost = []
+        for seq, entry in self.unacked.items():
+            if entry[2] >= threshold:
+                if entry[3]:
+                    # Retransmitido há pouco: os seguintes ainda podem estar velhos
+                    continue
+                break
+            lost.append(seq)
+        if not lost:
+            return
+        if self.snd_una >= self.recover:
+            # Uma redução da janela por rodada de perdas
+            self.recover = self.next_seq
+            self.ssthresh = max(2.0, self.cwnd / 2)
+            self.cwnd = self.ssthresh
+        for seq in lost:
+            self._retransmit(seq)
+
+    def _on_rto(self):
+        if not self.unacked:
+            self.rto_deadline = None
+            return
+        self.ssthresh = max(2.0, self.cwnd / 2)
+        self.cwnd = 2.0
+        self.rto = min(MAX_RTO, self.rto * 2)
+        self._retransmit(min(self.unacked))
+        self.rto_deadline = time.monotonic() + self.rto
+
+    # Receptor
+
+    def _read_udp(self):
+        while True:
+            try:
+                data, address = self.sock.recvfrom(MSS + HEADER.size + 64)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            if len(data) < HEADER.size:
+                continue
+            kind, session, seq, ack, window, sack = HEADER.unpack_from(data)
+            if session != self.session:
+                continue
+            self.last_recv = time.monotonic()
+            if address != self.remote:
+                # O NAT do outro lado mudou o mapeamento
+                self.remote = address
+            if kind == PKT_PUNCH:
+                self._send(PKT_PUNCH_ACK)
+                continue
+            if kind == PKT_PUNCH_ACK:
+                continue
+            self._on_ack(ack, window, sack)
+            if kind in (PKT_DATA, PKT_FIN):
+                self._on_data(kind, seq, data[HEADER.size:])
+
+    def _on_data(self, kind, seq, payload):
+        if self.rcv_next <= seq < self.rcv_next + MAX_WINDOW:
+            self.out_of_order.setdefault(seq, (kind, payload))
+            while self.rcv_next in self.out_of_order:
+                got_kind, got = self.out_of_order.pop(self.rcv_next)
+                self.rcv_next += 1
+                if got_kind == PKT_FIN:
+                    self.remote_fin = True
+                else:
+                    self.deliver += got
+            self._write_local()
+        self._send(PKT_ACK)
+
+    def _write_local(self):
+        while self.deliver:
+            try:
+                sent = self.local.send(self.deliver)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                self.running = False
+                return
+            del self.deliver[:sent]
+        if self.remote_fin and not self.deliver:
+            try:
+                self.local.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+            if self.fin_sent and not self.unacked:
+                self.running = False
+
+    def _on_timers(self):
+        now = time.monotonic()
+        if self.rto_deadline is not None and now >= self.rto_deadline:
+            self._on_rto()
+        if now - self.last_recv >= DEAD_TIMEOUT:
+            logger.info(f"Stream UDP com {self.remote} sem resposta, encerrando")
+            self.running = False
+        elif now - self.last_send >= KEEPALIVE_INTERVAL:
+            self._send(PKT_ACK)
+        if self.fin_sent and self.remote_fin and not self.unacked and not self.deliver:
+            self.running = False
+
+    def _update_interest(self):
+        """Lê do lado local só com janela livre; escreve só com dados pendentes"""
+        if not self.running:
+            return
+        events = 0
+        if not self.local_eof and len(self.unacked) < self._window():
+            events |= selectors.EVENT_READ
+        if self.deliver:
+            events |= selectors.EVENT_WRITE
+        if events == self._events.get('local'):
+            return
+        if events:
+            if self._events.get('local'):
+                self.selector.modify(self.local, events, 'local')
+            else:
+                self.selector.register(self.local, events, 'local')
+        else:
+            self.selector.unregister(self.local)
+        self._events['local'] = events
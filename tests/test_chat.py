@@ -0,0 +1,69 @@
+import pytest
+
+from network.chat import ChatSession, EVENT_USERS, EVENT_TYPING
+
+
+def session():
+    return ChatSession('alice', lambda *args: None, max_users=4, encrypted=False)
+
+
+@pytest.mark.parametrize('message', [
+    [], 'texto', 3, None,
+    {'type': 'user_join', 'data': []},
+    {'type': 'user_join', 'data': {'username': ['x']}},
+    {'type': 'presence', 'data': {'users': []}},
+    {'type': 'presence_snapshot', 'data': {'users': 'bob'}},
+    {'type': 'presence_snapshot', 'data': {'users': {'bob': 5}}},
+    {'type': 'user_list', 'data': {'users': ['bob']}},
+    {'type': 'typing_status', 'data': {'username': {}, 'status': 'typing'}},
+    {'type': 'chat', 'content': {'a': 1}, 'username': 'bob'},
+])
+def test_malformed_message_dropped(message):
+    chat = session()
+    assert chat.handle(message) == []
+    assert chat.users == {'alice': 'online'}
+
+
+def test_snapshot_applies_valid_entries():
+    chat = session()
+    events = chat.handle({'type': 'presence_snapshot',
+                          'data': {'users': {'bob': [2, 'typing'], 'eve': 'x'}}})
+    assert events[0] == (EVENT_USERS,)
+    assert chat.users == {'alice': 'online', 'bob': 'typing'}
+
+
+def test_snapshot_clamped_to_max_users():
+    chat = session()
+    users = {name: [1, 'online'] for name in ('bob', 'carol', 'dave', 'eve', 'frank')}
+    chat.handle({'type': 'presence_snapshot', 'data': {'users': users}})
+    assert len(chat.users) == chat.max_users
+    assert list(chat.users) == ['alice', 'bob', 'carol', 'dave']
+    # Entradas de quem já está na sala continuam valendo com a sala cheia
+    chat.handle({'type': 'presence_snapshot', 'data': {'users': {'bob': [2, 'typing']}}})
+    assert chat.users['bob'] == 'typing'
+
+
+def test_presence_delta_applies_newer_versions_only():
+    chat = session()
+    chat.handle({'type': 'presence_snapshot', 'data': {'users': {'bob': [3, 'online']}}})
+    # Delta não adiciona desconhecidos
+    assert chat.handle({'type': 'presence', 'data': {'users': {'eve': [9, 'online']}}}) == []
+    assert 'eve' not in chat.users
+
+    events = chat.handle({'type': 'presence', 'data': {'users': {'bob': [4, 'typing']}}})
+    assert events == [(EVENT_USERS,), (EVENT_TYPING, 'bob', True)]
+    # Cópia atrasada (relay, gossip) não desfaz o status mais novo
+    assert chat.handle({'type': 'presence', 'data': {'users': {'bob': [3, 'online']}}}) == []
+    assert chat.users['bob'] == 'typing'
+
+    events = chat.handle({'type': 'presence', 'data': {'users': {'bob': [5, 'online']}}})
+    assert events == [(EVENT_USERS,), (EVENT_TYPING, 'bob', False)]
+
+
+def test_own_stale_version_bumps_next_delta():
+    chat = session()
+    chat.handle({'type': 'presence', 'data': {'users': {'alice': [7, 'typing']}}})
+    assert chat.users['alice'] == 'online'
+    chat.users['alice'] = 'typing'
+    version, status = chat.presence.local_delta()['alice']
+    assert version > 7 and status == 'typing'
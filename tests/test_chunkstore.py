@@ -0,0 +1,55 @@
+import io
+import os
+import random
+import hashlib
+
+from network.chunkstore import ChunkStore, iter_chunks, MIN_CHUNK, MAX_CHUNK
+
+
+def digests(data):
+    return [hashlib.sha256(chunk).digest() for chunk in iter_chunks(io.BytesIO(data))]
+
+
+def chunk(seed, size=1000):
+    data = random.Random(seed).randbytes(size)
+    return hashlib.sha256(data).digest(), data
+
+
+def test_chunks_cover_file_within_bounds():
+    data = random.Random(1).randbytes(3 * 1024 * 1024 + 17)
+    chunks = list(iter_chunks(io.BytesIO(data)))
+    assert b''.join(chunks) == data
+    assert all(MIN_CHUNK <= len(c) <= MAX_CHUNK for c in chunks[:-1])
+
+
+def test_chunks_stable_after_insert():
+    data = random.Random(2).randbytes(4 * 1024 * 1024)
+    edited = data[:1000000] + b'trecho novo' * 100 + data[1000000:]
+    before, after = digests(data), digests(edited)
+    # Só os chunks em volta da inserção mudam; os cortes seguintes se realinham
+    assert len(set(after) - set(before)) <= 2
+    assert len(set(before) - set(after)) <= 2
+    assert before[-5:] == after[-5:]
+
+
+def test_lru_eviction_at_budget(tmp_path):
+    store = ChunkStore(str(tmp_path), budget=3000)
+    a, b, c, d = (chunk(seed) for seed in range(4))
+    for digest, data in (a, b, c):
+        store.put(digest, data)
+    assert store.get(a[0]) == a[1]
+    store.put(*d)
+    # b era o menos usado: sai da memória e do disco
+    assert b[0] not in store and a[0] in store and d[0] in store
+    assert store.size == 3000 and len(store) == 3
+    assert not os.path.exists(store._path(b[0].hex()))
+
+
+def test_corrupted_chunk_discarded(tmp_path):
+    store = ChunkStore(str(tmp_path))
+    digest, data = chunk(5)
+    store.put(digest, data)
+    with open(store._path(digest.hex()), 'wb') as f:
+        f.write(b'outro conteudo')
+    assert store.get(digest) is None
+    assert digest not in store and store.size == 0
@@ -0,0 +1,118 @@
+import os
+
+import pytest
+
+from utils import crypto
+from utils.crypto import FILE_HEADER, TAG_SIZE, encrypt_file, decrypt_file
+
+KEY = os.urandom(32)
+CHUNK = 1024
+
+
+class PlainAead:
+    """AEAD sem encrypt_into/decrypt_into, como no cryptography fixado"""
+
+    def __init__(self, aead):
+        self.aead = aead
+
+    def encrypt(self, nonce, data, aad):
+        return self.aead.encrypt(nonce, data, aad)
+
+    def decrypt(self, nonce, data, aad):
+        return self.aead.decrypt(nonce, data, aad)
+
+
+@pytest.fixture(params=['into', 'fallback'])
+def aead_api(request, monkeypatch):
+    if request.param == 'fallback':
+        original = crypto._file_aead
+        monkeypatch.setattr(crypto, '_file_aead', lambda *args: PlainAead(original(*args)))
+    return request.param
+
+
+def encrypted(tmp_path, data, workers=1):
+    source = tmp_path / 'dados.bin'
+    source.write_bytes(data)
+    path = encrypt_file(str(source), key=KEY, chunk_size=CHUNK, workers=workers)
+    assert path is not None
+    return path
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+@pytest.mark.parametrize('size', [0, 1, CHUNK - 1, CHUNK, CHUNK + 1, 40 * CHUNK + 7])
+def test_file_round_trip(tmp_path, aead_api, size, workers):
+    data = os.urandom(size)
+    path = encrypted(tmp_path, data, workers)
+    output = decrypt_file(path, str(tmp_path / 'saida.bin'), key=KEY, workers=workers)
+    assert output is not None
+    assert (tmp_path / 'saida.bin').read_bytes() == data
+
+
+def damage_cases(data):
+    header = FILE_HEADER.size
+    full = CHUNK + TAG_SIZE
+    yield 'adulterado', data[:header + 10] + bytes([data[header + 10] ^ 1]) + data[header + 11:]
+    yield 'sem o último bloco', data[:header + 2 * full]
+    yield 'cortado no meio', data[:-5]
+    yield 'estendido', data + data[header:header + full]
+    yield 'blocos trocados', data[:header] + data[header + full:header + 2 * full] + \
+        data[header:header + full] + data[header + 2 * full:]
+    yield 'outra chave', None
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+@pytest.mark.parametrize('case', [name for name, _ in damage_cases(b'\0' * 10000)])
+def test_damaged_file_leaves_no_output(tmp_path, aead_api, case, workers):
+    path = encrypted(tmp_path, os.urandom(3 * CHUNK + 100))
+    with open(path, 'rb') as f:
+        damaged = dict(damage_cases(f.read()))[case]
+    key = KEY
+    if damaged is None:
+        key = os.urandom(32)
+    else:
+        with open(path, 'wb') as f:
+            f.write(damaged)
+    output = tmp_path / 'saida.bin'
+    assert decrypt_file(path, str(output), key=key, workers=workers) is None
+    assert not output.exists() and not (tmp_path / 'saida.bin.part').exists()
+
+
+def test_encrypted_file_random_reads(tmp_path):
+    data = os.urandom(10 * CHUNK + 300)
+    with crypto.EncryptedFile(encrypted(tmp_path, data), key=KEY, cache=2) as f:
+        assert len(f) == len(data)
+        for offset, size in [(0, 10), (CHUNK - 3, 6), (5 * CHUNK, 3 * CHUNK), (len(data) - 5, 100),
+                             (len(data), 10), (0, -1), (-5, 3)]:
+            start = max(0, offset)
+            end = len(data) if size < 0 else start + size
+            assert f.read(offset, size) == data[start:end]
+
+
+def test_encrypted_file_tampered_block(tmp_path):
+    path = encrypted(tmp_path, os.urandom(3 * CHUNK))
+    with open(path, 'r+b') as f:
+        f.seek(FILE_HEADER.size + CHUNK + TAG_SIZE + 1)
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([byte[0] ^ 1]))
+    with crypto.EncryptedFile(path, key=KEY) as f:
+        assert f.read(0, CHUNK) is not None
+        with pytest.raises(crypto.CryptoError):
+            f.read(CHUNK, 1)
+
+
+@pytest.mark.parametrize('cut', [CHUNK + TAG_SIZE, 1, 3 * (CHUNK + TAG_SIZE) + 1])
+def test_encrypted_file_truncated_does_not_open(tmp_path, cut):
+    path = encrypted(tmp_path, os.urandom(3 * CHUNK + 10))
+    size = os.path.getsize(path)
+    os.truncate(path, max(0, size - cut))
+    with pytest.raises(crypto.CryptoError):
+        crypto.EncryptedFile(path, key=KEY)
+
+
+def test_encrypted_file_extended_does_not_open(tmp_path):
+    path = encrypted(tmp_path, os.urandom(2 * CHUNK))
+    with open(path, 'ab') as f:
+        f.write(b'\0' * 40)
+    with pytest.raises(crypto.CryptoError):
+        crypto.EncryptedFile(path, key=KEY)
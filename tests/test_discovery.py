@@ -0,0 +1,60 @@
+import json
+import time
+
+import pytest
+
+from network.discovery import Discovery, RoomDirectory, RoomEntry, MAX_ROOMS
+
+
+def entry(port, seen=None, room='sala'):
+    return RoomEntry(room, '10.0.0.2', port, seen=time.time() if seen is None else seen)
+
+
+def write_cache(path, data):
+    path.write_text(json.dumps(data) if not isinstance(data, str) else data)
+    return RoomDirectory(str(path))
+
+
+@pytest.mark.parametrize('bad', [
+    {'room': 'x', 'host': 'h', 'port': 1, 'seen': 'ontem'},
+    {'room': 'x', 'host': 'h', 'port': 'porta'},
+    {'room': 'x', 'host': 'h', 'port': 1, 'max_members': 'dois'},
+    {'room': 'x', 'host': 'h', 'port': 1, 'members': 1e400},
+    {'room': 'x', 'port': 1},
+    [1, 2], 'texto', None, 5,
+])
+def test_corrupted_cache_entries_skipped(tmp_path, bad):
+    good = entry(4000).to_dict()
+    directory = write_cache(tmp_path / 'rooms.json', [bad, good])
+    assert [e.key for e in directory.rooms()] == [entry(4000).key]
+
+
+@pytest.mark.parametrize('data', ['[', '{"room": 1}', '5', 'null'])
+def test_corrupted_cache_file_ignored(tmp_path, data):
+    assert write_cache(tmp_path / 'rooms.json', data).rooms() == []
+
+
+def test_directory_capped_oldest_dropped(tmp_path):
+    directory = RoomDirectory(str(tmp_path / 'rooms.json'))
+    now = time.time()
+    for port in range(MAX_ROOMS + 10):
+        directory.update(entry(port, seen=now - 1000 + port))
+    ports = {e.port for e in directory.rooms()}
+    assert len(ports) == MAX_ROOMS and min(ports) == 10
+
+    directory.save(force=True)
+    with open(tmp_path / 'rooms.json') as f:
+        data = json.load(f)
+    reloaded = write_cache(tmp_path / 'rooms.json', data + [entry(9999).to_dict()])
+    assert len(reloaded.rooms()) == MAX_ROOMS
+
+
+def test_bad_announce_ignored(tmp_path):
+    discovery = Discovery(RoomDirectory(str(tmp_path / 'rooms.json')))
+    announce = {'winp2p': 1, 'instance': 'outro', 'op': 'announce', 'room': 'sala', 'port': 4000}
+    for bad in ({'max_members': []}, {'port': None}, {'members': 'muitos'}):
+        discovery._on_datagram(json.dumps(dict(announce, **bad)).encode(), ('10.0.0.3', 1))
+    assert discovery.rooms() == []
+    discovery._on_datagram(json.dumps(dict(announce, max_members=4)).encode(), ('10.0.0.3', 1))
+    (room,) = discovery.rooms()
+    assert (room.host, room.port, room.max_members) == ('10.0.0.3', 4000, 4)
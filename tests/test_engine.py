@@ -0,0 +1,317 @@
+import json
+import queue
+import socket
+import threading
+import time
+
+import pytest
+
+from network.engine import Engine
+from network.rooms import DEFAULT_ROOM, MAX_ROOM_ID, JOIN_FULL, JOIN_NOT_FOUND
+from utils.crypto import DEFAULT_CIPHERS, KeyExchange
+from network.framing import (
+    Frame, FileFrame, FileRegion, FrameReader, FLAG_ENCRYPTED, KIND_HELLO, KIND_PING,
+    KIND_WINDOW, KIND_ACK, encode_frame
+)
+from network.ratelimit import FRAME_RATE, ACCEPT_RATE
+from network.session import proof_data
+
+STREAM = 3
+TIMEOUT = 5
+
+
+class Node:
+    """Engine rodando numa thread, com os eventos numa fila"""
+
+    def __init__(self, **kwargs):
+        self.events = queue.Queue()
+        kwargs.setdefault('heartbeat_interval', 0)
+        self.engine = Engine(
+            on_join=lambda peer: self.events.put(('join', peer)),
+            on_message=lambda peer, data, stream: self.events.put(('message', bytes(data))),
+            on_disconnect=lambda peer: self.events.put(('disconnect', peer)),
+            on_detach=lambda peer: self.events.put(('detach', peer)),
+            on_resume=lambda peer: self.events.put(('resume', peer)),
+            **kwargs
+        )
+        self.thread = threading.Thread(target=self.engine.run, daemon=True)
+        self.thread.start()
+
+    def call(self, function, *args):
+        """Roda function na thread do loop e retorna o resultado"""
+        done = queue.Queue()
+        self.engine.call_soon(lambda: done.put(function(*args)))
+        return done.get(timeout=TIMEOUT)
+
+    def wait(self, kind):
+        while True:
+            event = self.events.get(timeout=TIMEOUT)
+            if event[0] == kind:
+                return event[1]
+
+    def stop(self):
+        self.engine.stop()
+        self.thread.join(TIMEOUT)
+
+
+@pytest.fixture
+def nodes():
+    created = []
+
+    def make(**kwargs):
+        node = Node(**kwargs)
+        created.append(node)
+        return node
+    yield make
+    for node in created:
+        node.stop()
+
+
+def connected(nodes, server_args=None, client_args=None, password=None, **connect_args):
+    server = nodes(**(server_args or {}))
+    client = nodes(**(client_args or {}))
+    server.call(server.engine.open_room, DEFAULT_ROOM, None, True, password)
+    host, port = server.call(server.engine.listen, '127.0.0.1', 0)
+    peer = client.engine.connect(host, port, password=password, **connect_args)
+    client.wait('join')
+    return server, client, peer, server.wait('join')
+
+
+def test_file_frames_are_sealed(nodes, tmp_path):
+    server, client, peer, _ = connected(nodes)
+    flags = []
+    on_data = server.engine._on_data
+    server.engine._on_data = lambda peer, frame: (flags.append(frame.flags), on_data(peer, frame))
+    path = tmp_path / 'dados.bin'
+    path.write_bytes(b'conteudo do arquivo')
+    with open(path, 'rb') as f:
+        frame = FileFrame(b'prefixo:', FileRegion(f, 0, 19), stream=STREAM)
+        client.call(lambda: (client.engine.queue_frames(peer, [frame]),
+                             client.engine._flush(peer)))
+        assert server.wait('message') == b'prefixo:conteudo do arquivo'
+    assert flags and all(flag & FLAG_ENCRYPTED for flag in flags)
+
+
+def test_plaintext_data_dropped_on_encrypted_connection(nodes):
+    server, client, peer, _ = connected(nodes, {'resume_timeout': 0})
+    # Escrito direto no socket, sem passar pela cifra
+    client.call(lambda: peer.sock.send(Frame(b'em claro', stream=STREAM).to_bytes()))
+    server.wait('disconnect')
+    assert server.events.empty()
+
+
+@pytest.mark.parametrize('hello', [
+    [], 1, 'oi', {'codecs': 5}, {'codecs': ['json', 1]}, {'ciphers': 'chacha20'},
+    {'compression': 5}, {'compression': 'zlib'}, {'key': 5, 'ciphers': DEFAULT_CIPHERS}, {'resume': ['x']}, {'resume': 'x', 'recv': -1},
+])
+def test_invalid_hello_closes_only_that_peer(nodes, hello):
+    server, client, peer, server_peer = connected(nodes)
+    address = server.call(lambda: server.engine.listeners[0].getsockname())
+    raw_closed(address, encode_frame(json.dumps(hello).encode('utf-8'), KIND_HELLO))
+
+    other = nodes()
+    other.engine.connect(*address)
+    other.wait('join')
+    server.wait('join')
+    assert not server_peer.closed
+
+
+def test_short_ack_closes_session_peer(nodes):
+    server, client, peer, server_peer = connected(nodes, {'resume_timeout': 30})
+    assert server_peer.session is not None
+    client.call(lambda: peer.sock.send(encode_frame(b'\0', KIND_ACK)))
+    assert server.wait('detach') is server_peer
+
+    other = nodes()
+    address = server.call(lambda: server.engine.listeners[0].getsockname())
+    other.engine.connect(*address)
+    other.wait('join')
+    server.wait('join')
+
+
+def raw_hello(address, hello):
+    """Manda um hello por um socket comum e retorna a resposta (dict)"""
+    with socket.create_connection(address, timeout=TIMEOUT) as sock:
+        sock.sendall(encode_frame(json.dumps(hello).encode('utf-8'), KIND_HELLO))
+        reader = FrameReader()
+        while True:
+            buffer = reader.get_buffer()
+            size = sock.recv_into(buffer)
+            assert size, 'conexão fechada sem resposta'
+            for frame in reader.buffer_updated(size):
+                return json.loads(bytes(frame.payload))
+
+
+def raw_closed(address, data):
+    """Manda bytes crus e espera o servidor fechar a conexão"""
+    with socket.create_connection(address, timeout=TIMEOUT) as sock:
+        sock.sendall(data)
+        while sock.recv(4096):
+            pass
+
+
+@pytest.mark.parametrize('frame', [
+    encode_frame(b'\0', KIND_PING),
+    encode_frame(b'', KIND_WINDOW, stream=STREAM),
+])
+def test_short_control_frame_closes_only_that_peer(nodes, frame):
+    server, client, peer, server_peer = connected(nodes)
+    address = server.call(lambda: server.engine.listeners[0].getsockname())
+    raw_closed(address, frame)
+
+    other = nodes()
+    other.engine.connect(*address)
+    other.wait('join')
+    server.wait('join')
+    assert not server_peer.closed
+    client.call(lambda: client.engine.send(peer, b'ainda aqui', stream=STREAM))
+    assert server.wait('message') == b'ainda aqui'
+
+
+@pytest.mark.parametrize('room', [['sala'], {'a': 1}, 5, 'x' * (MAX_ROOM_ID + 1)])
+def test_invalid_room_id_refused(nodes, room):
+    server, client, peer, server_peer = connected(nodes)
+    address = server.call(lambda: server.engine.listeners[0].getsockname())
+    assert raw_hello(address, {'room': room}) == {'type': JOIN_NOT_FOUND}
+    assert not server_peer.closed
+
+
+@pytest.mark.parametrize('password', [None, 'segredo'])
+@pytest.mark.parametrize('room, status', [(DEFAULT_ROOM, JOIN_FULL),
+                                          ('outra', JOIN_NOT_FOUND)])
+def test_encrypted_refusal_reaches_client(nodes, password, room, status):
+    server, client, peer, _ = connected(nodes, password=password)
+    server.call(lambda: setattr(server.engine.rooms.get(DEFAULT_ROOM), 'max_members', 1))
+    address = server.call(lambda: server.engine.listeners[0].getsockname())
+    other = nodes()
+    refused = other.engine.connect(*address, room=room, password=password)
+    assert other.wait('disconnect') is refused
+    assert refused.error == status
+    assert not peer.closed
+
+
+def detached_session(nodes, password=None):
+    """Sessão cifrada cujo cliente caiu; retorna (servidor, endereço, peer do servidor)"""
+    server, client, peer, server_peer = connected(
+        nodes, {'resume_timeout': 30}, {'resume_timeout': 30}, password=password
+    )
+    address = server.call(lambda: server.engine.listeners[0].getsockname())
+    # O cliente desiste da sessão sem avisar: só o atacante vai aparecer
+    client.call(client.engine._finalize, peer)
+    server.wait('detach')
+    return server, address, server_peer
+
+
+def test_session_token_not_in_hello_reply(nodes):
+    server, client, peer, server_peer = connected(nodes, {'resume_timeout': 30})
+    assert server_peer.session.token == peer.session.token == server_peer.cipher.session_id
+    address = server.call(lambda: server.engine.listeners[0].getsockname())
+    kex = KeyExchange()
+    reply = raw_hello(address, {'ciphers': DEFAULT_CIPHERS, 'key': kex.public_b64()})
+    assert reply['session'] is True
+    assert kex.derive(reply['key'], reply['cipher'], initiator=True).session_id \
+        in server.call(lambda: list(server.engine.sessions))
+
+
+def test_resume_after_drop(nodes):
+    server, client, peer, server_peer = connected(
+        nodes, {'resume_timeout': 30}, {'resume_timeout': 30}
+    )
+    client.call(lambda: client.engine._close(peer))
+    client.wait('resume')
+    server.wait('resume')
+    client.call(lambda: client.engine.send(peer, b'depois da queda', stream=STREAM))
+    assert server.wait('message') == b'depois da queda'
+
+
+@pytest.mark.parametrize('password', [None, 'segredo'])
+@pytest.mark.parametrize('proof', ['sem prova', 'prova errada', 'outro nonce'])
+def test_resume_without_key_rejected(nodes, password, proof):
+    server, address, server_peer = detached_session(nodes, password)
+    token = server_peer.session.token
+    hello = {'resume': token, 'recv': 0, 'codecs': ['json']}
+    if proof != 'sem prova':
+        hello['nonce'] = 'n1'
+        hello['proof'] = server_peer.cipher.proof(proof_data('resume', token, 'n2', 0)) \
+            if proof == 'outro nonce' else 'AAAA'
+    reply = raw_hello(address, hello)
+    assert not reply.get('resumed')
+    assert server_peer.detached and server.call(lambda: server.engine.sessions.get(token)) \
+        is server_peer
+
+
+def test_resume_proof_not_replayable(nodes):
+    server, address, server_peer = detached_session(nodes)
+    token = server_peer.session.token
+    hello = {'resume': token, 'recv': 0, 'nonce': 'n1',
+             'proof': server_peer.cipher.proof(proof_data('resume', token, 'n1', 0))}
+    assert raw_hello(address, hello).get('resumed')
+    server.wait('resume')
+    server.wait('detach')
+    assert not raw_hello(address, hello).get('resumed')
+
+
+def test_channel_without_key_rejected(nodes):
+    server, client, peer, server_peer = connected(nodes, {'resume_timeout': 30})
+    address = server.call(lambda: server.engine.listeners[0].getsockname())
+    reply = raw_hello(address, {'channel': server_peer.session.token, 'nonce': 'n1',
+                                'proof': 'AAAA'})
+    assert reply == {'type': 'session_not_found'}
+    assert server_peer.channels == []
+
+    opened = queue.Queue()
+    server.engine.on_channel_open = lambda primary, conn: opened.put(primary)
+    channel = client.call(client.engine.open_channel, peer)
+    assert opened.get(timeout=TIMEOUT) is server_peer
+    assert not channel.closed
+
+
+def wait_message(node, data):
+    """Espera a mensagem data, ignorando as outras"""
+    while node.wait('message') != data:
+        pass
+
+
+@pytest.mark.parametrize('limit, stream, message, count', [
+    ({'frame_rate': FRAME_RATE}, 1, b'spam', 5 * FRAME_RATE),
+    ({'byte_rate': 1024 * 1024}, STREAM, b'x' * 64 * 1024, 80),
+])
+def test_flooding_peer_throttled_others_unaffected(nodes, limit, stream, message, count):
+    server, flooder, flood_peer, server_flooder = connected(
+        nodes, limit, {'high_watermark': 1 << 30, 'queue_limit': 1 << 30}
+    )
+    other = nodes()
+    address = server.call(lambda: server.engine.listeners[0].getsockname())
+    other_peer = other.engine.connect(*address)
+    other.wait('join')
+    server_other = server.wait('join')
+
+    # Uns 5 s de tráfego acima do limite
+    flooder.call(lambda: [flooder.engine.send(flood_peer, message, stream=stream)
+                          for _ in range(count)])
+    assert server.wait('message') == message
+    start = time.monotonic()
+    other.call(lambda: other.engine.send(other_peer, b'ainda passa', stream=1))
+    received = 1
+    while server.wait('message') != b'ainda passa':
+        received += 1
+    assert time.monotonic() - start < 1
+    # O flood continua sendo segurado enquanto o outro peer passa
+    assert received < count // 2
+    assert server_other.throttled == 0 and not server_flooder.closed
+
+
+def test_connection_flood_throttled_established_peer_unaffected(nodes):
+    server, client, peer, _ = connected(nodes, {'accept_rate': ACCEPT_RATE})
+    address = server.call(lambda: server.engine.listeners[0].getsockname())
+    flood = [socket.create_connection(address, timeout=TIMEOUT)
+             for _ in range(2 * ACCEPT_RATE)]
+    try:
+        client.call(lambda: client.engine.send(peer, b'conectado antes', stream=1))
+        assert server.wait('message') == b'conectado antes'
+        assert server.call(lambda: server.engine.stats['throttled_accepts']) > 0
+        # Só o burst (um segundo de fichas) foi aceito de imediato
+        assert server.call(lambda: server.engine.inbound) < 2 * ACCEPT_RATE
+    finally:
+        for sock in flood:
+            sock.close()
@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+from network.framing import (
+    Frame, FrameReader, FrameError, HEADER, FLAG_MORE, KIND_DATA, KIND_HELLO, KIND_PING,
+    MAX_FRAME_SIZE, encode_frame, fragment
+)
+from network.streams import StreamReceiver
+
+
+def feed(reader, data, step):
+    """Entrega data ao reader em pedaços de até step bytes, como recv_into"""
+    view = memoryview(data)
+    frames = []
+    while view:
+        buffer = reader.get_buffer()
+        size = min(len(buffer), len(view), step)
+        buffer[:size] = view[:size]
+        view = view[size:]
+        frames += reader.buffer_updated(size)
+    return frames
+
+
+@pytest.mark.parametrize('step', [1, 7, 4096, 1 << 20])
+def test_round_trip(step):
+    sent = [
+        Frame(b'{"codecs": ["json"]}', KIND_HELLO),
+        Frame(b'', KIND_PING),
+        Frame(os.urandom(1000), KIND_DATA, FLAG_MORE, 3),
+        Frame(os.urandom(100 * 1024), KIND_DATA, 0, 65535),
+    ]
+    reader = FrameReader(buffer_size=1024)
+    received = feed(reader, b''.join(frame.to_bytes() for frame in sent), step)
+    assert [(f.kind, f.flags, f.stream, bytes(f.payload)) for f in received] == \
+        [(f.kind, f.flags, f.stream, bytes(f.payload)) for f in sent]
+
+
+def test_fragments_reassemble():
+    payload = os.urandom(100 * 1024 + 5)
+    frames = fragment(Frame(payload, stream=1))
+    assert len(frames) > 1
+    assert all(f.flags & FLAG_MORE for f in frames[:-1]) and not frames[-1].flags & FLAG_MORE
+
+    receiver = StreamReceiver()
+    results = [receiver.receive(f)[0] for f in feed(FrameReader(), b''.join(
+        f.to_bytes() for f in frames), 5000)]
+    assert results[:-1] == [None] * (len(frames) - 1)
+    assert results[-1] == payload
+
+
+def test_oversize_frame_rejected_before_allocating():
+    reader = FrameReader()
+    header = HEADER.pack(KIND_DATA, 0, 0, MAX_FRAME_SIZE + 1)
+    with pytest.raises(FrameError):
+        feed(reader, header, len(header))
+    assert reader._large is None
+
+
+def test_small_limit_until_hello():
+    big = encode_frame(os.urandom(2048))
+    reader = FrameReader(buffer_size=1024, hello_frame_size=1024)
+    with pytest.raises(FrameError):
+        feed(reader, big, len(big))
+
+    # O hello libera frames maiores, mesmo chegando no mesmo recv
+    reader = FrameReader(buffer_size=1024, hello_frame_size=1024)
+    frames = feed(reader, encode_frame(b'{}', KIND_HELLO) + big, 1 << 20)
+    assert [f.kind for f in frames] == [KIND_HELLO, KIND_DATA]
+    assert len(frames[1].payload) == 2048
@@ -0,0 +1,100 @@
+import json
+
+from network.mesh import Mesh, GOSSIP_HEADER, OP_GOSSIP, OP_HELLO, OP_PEERS, MAX_LEARNED
+
+
+class FakePeer:
+    def __init__(self, address, outbound):
+        self.address = address
+        self.outbound = outbound
+        self.closed = False
+
+
+class FakeEngine:
+    """Registra as discagens em vez de abrir sockets"""
+
+    def __init__(self):
+        self.dialed = []
+        self.sent = []
+
+    def connect(self, host, port, room):
+        self.dialed.append((host, port))
+        return FakePeer((host, port), True)
+
+    def send(self, peer, data, policy=None, key=None, stream=None):
+        self.sent.append((peer, bytes(data)))
+
+    def close_peer(self, peer):
+        peer.closed = True
+
+
+def message(op, body):
+    return bytes((op,)) + json.dumps(body).encode('utf-8')
+
+
+def members(count, start=0):
+    return {'members': [{'node': f'z{i:04}', 'host': '10.0.0.1', 'port': 1000 + i}
+                        for i in range(start, start + count)]}
+
+
+def joined_mesh():
+    engine = FakeEngine()
+    mesh = Mesh(engine, 'mesh-sala', node='a')
+    mesh.join('10.0.0.9', 9000)
+    entry = next(iter(mesh._dialing))
+    mesh.handle(entry, message(OP_HELLO, {'node': 'b', 'port': 9000}), 0)
+    engine.dialed.clear()
+    return engine, mesh, entry
+
+
+def test_peers_only_from_identified_entry():
+    engine, mesh, entry = joined_mesh()
+    stranger = FakePeer(('10.0.0.5', 5000), False)
+    mesh.handle(stranger, message(OP_PEERS, members(3)), 0)
+    assert engine.dialed == []
+
+    mesh.handle(entry, message(OP_PEERS, members(3)), 0)
+    assert len(engine.dialed) == 3
+
+
+def test_peers_list_is_capped():
+    engine, mesh, entry = joined_mesh()
+    mesh.handle(entry, message(OP_PEERS, members(MAX_LEARNED + 20)), 0)
+    assert len(engine.dialed) == MAX_LEARNED
+
+
+def test_invalid_addresses_ignored():
+    engine, mesh, entry = joined_mesh()
+    body = {'members': [{'node': 'z1', 'host': 5, 'port': 1}, {'node': 'z2', 'host': 'h', 'port': 0},
+                        {'node': 'z3', 'host': 'h', 'port': '80'}, 'x']}
+    mesh.handle(entry, message(OP_PEERS, body), 0)
+    assert engine.dialed == []
+
+
+def test_failed_address_not_redialed():
+    engine, mesh, entry = joined_mesh()
+    mesh.handle(entry, message(OP_PEERS, members(1)), 0)
+    dialing = next(iter(mesh._dialing))
+    mesh.peer_lost(dialing)
+    mesh.members.clear()
+    mesh.handle(entry, message(OP_PEERS, members(1)), 0)
+    assert engine.dialed == [('10.0.0.1', 1000)]
+
+
+def test_gossip_only_from_identified_members():
+    engine, mesh, entry = joined_mesh()
+    other = FakePeer(('10.0.0.3', 3000), False)
+    mesh.handle(other, message(OP_HELLO, {'node': 'c', 'port': 3000}), 0)
+    delivered = []
+    mesh.on_message = lambda body, stream: delivered.append(bytes(body))
+    engine.sent.clear()
+
+    gossip = GOSSIP_HEADER.pack(OP_GOSSIP, b'1' * 16, 4) + b'oi'
+    stranger = FakePeer(('10.0.0.5', 5000), False)
+    mesh.handle(stranger, gossip, 0)
+    assert delivered == [] and engine.sent == []
+
+    # O mesmo id ainda vale quando vem de um membro
+    mesh.handle(entry, gossip, 0)
+    assert delivered == [b'oi']
+    assert [peer for peer, _ in engine.sent] == [other]
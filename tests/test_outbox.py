@@ -0,0 +1,95 @@
+import pytest
+
+from network.framing import Frame, HEADER_SIZE
+from network.outbox import Outbox, OutboxFull, POLICY_DROP, POLICY_COALESCE
+from network.streams import STREAM_CHAT, STREAM_BULK
+
+
+def drain(outbox):
+    """Escreve tudo o que pode ser enviado agora; retorna os payloads"""
+    sent = []
+    while True:
+        bufs = outbox.gather()
+        if not bufs:
+            return sent
+        sent += [bytes(frame.payload) for frame in outbox.consume(sum(len(b) for b in bufs))]
+
+
+def frame(size, stream=STREAM_CHAT):
+    return Frame(b'x' * (size - HEADER_SIZE), stream=stream)
+
+
+def test_watermark_transitions():
+    outbox = Outbox(high_watermark=300, low_watermark=100)
+    for _ in range(3):
+        outbox.push(frame(100))
+    assert outbox.update_pressure() is None
+    outbox.push(frame(100))
+    assert outbox.update_pressure() is True
+    assert outbox.update_pressure() is None
+
+    # Entre as marcas continua congestionado
+    outbox.gather()
+    outbox.consume(200)
+    assert outbox.size == 200
+    assert outbox.update_pressure() is None and outbox.backpressured
+
+    outbox.gather()
+    outbox.consume(100)
+    assert outbox.update_pressure() is False
+    assert not outbox.backpressured
+
+
+def test_coalesce_replaces_pending_frame():
+    outbox = Outbox()
+    outbox.push(Frame(b'digitando', stream=STREAM_CHAT), POLICY_COALESCE, 'typing')
+    outbox.push(Frame(b'oi', stream=STREAM_CHAT))
+    outbox.push(Frame(b'parou', stream=STREAM_CHAT), POLICY_COALESCE, 'typing')
+    assert outbox.coalesced == 1
+    # O substituto fica no lugar do original
+    assert drain(outbox) == [b'parou', b'oi']
+    assert outbox.size == 0
+
+
+def test_coalesce_keeps_frame_already_started():
+    outbox = Outbox()
+    outbox.push(Frame(b'primeiro', stream=STREAM_CHAT), POLICY_COALESCE, 'typing')
+    outbox.gather()
+    outbox.consume(3)
+    outbox.push(Frame(b'segundo', stream=STREAM_CHAT), POLICY_COALESCE, 'typing')
+    assert outbox.coalesced == 0
+    assert drain(outbox) == [b'primeiro', b'segundo']
+
+
+def test_drop_when_backpressured_or_over_limit():
+    outbox = Outbox(high_watermark=150, low_watermark=50, limit=400)
+    outbox.push(frame(100))
+    assert outbox.push(frame(100), POLICY_DROP)
+    outbox.update_pressure()
+    assert not outbox.push(frame(100), POLICY_DROP)
+    assert outbox.push(frame(100))
+    assert outbox.push(frame(100))
+    # Acima do limite: descartável some, o resto derruba o peer
+    assert not outbox.push(frame(100), POLICY_COALESCE, 'chave')
+    assert outbox.dropped == 2
+    with pytest.raises(OutboxFull):
+        outbox.push(frame(100))
+    assert outbox.size == 400
+
+
+def test_stream_window_blocks_and_unblocks():
+    outbox = Outbox(initial_window=250)
+    for _ in range(3):
+        outbox.push(frame(100 + HEADER_SIZE, STREAM_BULK))
+    outbox.push(Frame(b'chat', stream=STREAM_CHAT))
+    # O chat não consome janela; o terceiro bloco passaria dos 250 bytes
+    assert drain(outbox) == [b'chat', b'x' * 100, b'x' * 100]
+    assert outbox.pending(STREAM_BULK) == 1
+    assert not outbox.writable()
+
+    outbox.window_update(STREAM_BULK, 40)
+    assert not outbox.writable()
+    outbox.window_update(STREAM_BULK, 60)
+    assert outbox.writable()
+    assert drain(outbox) == [b'x' * 100]
+    assert outbox.windows[STREAM_BULK] == 50
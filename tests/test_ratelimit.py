@@ -0,0 +1,32 @@
+import pytest
+
+from network.ratelimit import TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('network.ratelimit.time.monotonic', lambda: now[0])
+    return now
+
+
+def test_burst_then_refill(clock):
+    bucket = TokenBucket(10, burst=5)
+    assert all(bucket.consume() for _ in range(5))
+    assert not bucket.consume()
+    assert bucket.delay() == pytest.approx(0.1)
+    clock[0] += 0.25
+    assert bucket.available() == pytest.approx(2.5)
+    # Nunca passa do burst, por mais tempo que fique parado
+    clock[0] += 60
+    assert bucket.available() == 5
+
+
+def test_consume_amount_all_or_nothing(clock):
+    bucket = TokenBucket(1000)
+    assert bucket.consume(800)
+    assert not bucket.consume(300)
+    assert bucket.available() == pytest.approx(200)
+    assert bucket.delay(300) == pytest.approx(0.1)
+    # Pedido maior que o burst: espera só até encher
+    assert bucket.delay(5000) == pytest.approx(0.8)
@@ -0,0 +1,49 @@
+import pytest
+
+from network.rendezvous import RendezvousServer, CONNECT_BURST
+
+HOST = ('10.0.0.1', 4000)
+VISITOR = ('10.0.0.2', 5000)
+
+
+@pytest.fixture
+def server():
+    server = RendezvousServer('127.0.0.1', 0)
+    server.replies = []
+    server._reply = lambda message, address: server.replies.append((message, address))
+    yield server
+    server.sock.close()
+
+
+def register(server, address, secret=None):
+    message = {'op': 'register', 'room': 'sala'}
+    if secret is not None:
+        message['secret'] = secret
+    server.handle(message, address)
+    return server.replies[-1][0]
+
+
+def test_registration_bound_to_first_host(server):
+    secret = register(server, HOST)['secret']
+    assert register(server, ('10.6.6.6', 1))['op'] == 'taken'
+    assert register(server, ('10.6.6.6', 1), 'errado')['op'] == 'taken'
+    assert server.registrations['sala'][0] == HOST
+
+    # O host renova com o segredo, de outro socket
+    assert register(server, (HOST[0], 4001), secret)['op'] == 'registered'
+    assert server.registrations['sala'][0] == (HOST[0], 4001)
+
+
+def test_connect_rate_limited_per_source(server):
+    secret = register(server, HOST)['secret']
+    for port in range(CONNECT_BURST):
+        server.handle({'op': 'connect', 'room': 'sala'}, (VISITOR[0], 6000 + port))
+        register(server, HOST, secret)
+    server.replies.clear()
+    server.handle({'op': 'connect', 'room': 'sala'}, (VISITOR[0], 7000))
+    assert server.replies == []
+    assert 'sala' in server.registrations
+
+    # Repetições do mesmo pedido recebem a mesma sessão, sem gastar o limite
+    server.handle({'op': 'connect', 'room': 'sala'}, (VISITOR[0], 6000))
+    assert {m['op'] for m, _ in server.replies} == {'punch'}
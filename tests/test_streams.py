@@ -0,0 +1,27 @@
+import pytest
+
+from network.framing import Frame, FrameError, FLAG_MORE
+from network.streams import StreamReceiver
+
+
+def test_reassembly_releases_buffered_bytes():
+    receiver = StreamReceiver()
+    assert receiver.receive(Frame(b'ab', flags=FLAG_MORE, stream=1)) == (None, 0)
+    assert receiver.buffered == 2
+    assert receiver.receive(Frame(b'cd', stream=1))[0] == b'abcd'
+    assert receiver.buffered == 0
+
+
+def test_too_many_partial_streams():
+    receiver = StreamReceiver(max_streams=4)
+    for stream in range(4):
+        receiver.receive(Frame(b'x', flags=FLAG_MORE, stream=stream))
+    with pytest.raises(FrameError):
+        receiver.receive(Frame(b'x', flags=FLAG_MORE, stream=4))
+
+
+def test_total_buffered_bytes_capped():
+    receiver = StreamReceiver(max_message=1000, max_buffered=1500)
+    receiver.receive(Frame(b'x' * 800, flags=FLAG_MORE, stream=3))
+    with pytest.raises(FrameError):
+        receiver.receive(Frame(b'x' * 800, flags=FLAG_MORE, stream=4))
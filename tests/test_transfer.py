@@ -0,0 +1,313 @@
+import os
+import json
+import glob
+import queue
+import random
+import hashlib
+import threading
+import time
+
+import pytest
+
+from network import transfer as transfer_module
+from network.chunkstore import ChunkStore
+from network.engine import Engine
+from network.rooms import DEFAULT_ROOM
+from network.streams import STREAM_BULK
+from network.striping import StripeController
+from network.transfer import (
+    FileTransfers, TransferError, HEADER, OFFSET, OP_OFFER, OP_ACCEPT, OP_CANCEL, CHUNK_SIZE,
+    MAX_CHUNK_SIZE, Manifest, safe_name, received_path
+)
+
+TIMEOUT = 10
+
+
+class FakeEngine:
+    """Guarda o que seria enviado, sem sockets"""
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, peer, payload, stream=0):
+        self.sent.append(HEADER.unpack_from(payload)[0])
+
+
+class FakePeer:
+    channels = ()
+
+
+def offer(transfers, peer, size=1000, chunk_size=CHUNK_SIZE, tid=b'\x01' * 16, name='a.txt'):
+    body = json.dumps({'name': name, 'size': size, 'chunk_size': chunk_size}).encode()
+    transfers.handle(peer, HEADER.pack(OP_OFFER, tid) + body, 3)
+
+
+@pytest.mark.parametrize('name', [
+    'C:evil.dll', 'x:y', '..\\..\\a.exe', '../a', 'CON', 'con.txt', 'LPT1.log', 'a.txt. ',
+    'a\x00b', '', '.bashrc',
+])
+def test_safe_name_stays_inside_directory(tmp_path, name):
+    cleaned = safe_name(name)
+    assert ':' not in cleaned and '/' not in cleaned and '\\' not in cleaned
+    assert cleaned.split('.')[0].upper() not in ('CON', 'LPT1')
+    assert not cleaned.startswith('.') and not cleaned.endswith(('.', ' '))
+    assert os.path.dirname(received_path(str(tmp_path), cleaned)) == str(tmp_path)
+
+
+def test_received_path_rejects_escape(tmp_path):
+    with pytest.raises(TransferError):
+        received_path(str(tmp_path), '../fora')
+
+
+def test_offer_needs_consent(tmp_path):
+    engine = FakeEngine()
+    peer = FakePeer()
+    offers = []
+    transfers = FileTransfers(engine, directory=str(tmp_path), on_offer=offers.append)
+    offer(transfers, peer)
+    assert len(offers) == 1 and engine.sent == []
+    assert not os.listdir(tmp_path)
+
+    transfers.answer_offer(offers[0].offer_id, True)
+    assert engine.sent == [OP_ACCEPT]
+    assert transfers.incoming
+
+
+def test_offer_declined_or_without_handler(tmp_path):
+    engine = FakeEngine()
+    offers = []
+    transfers = FileTransfers(engine, directory=str(tmp_path), on_offer=offers.append)
+    offer(transfers, FakePeer())
+    transfers.answer_offer(offers[0].offer_id, False)
+    assert engine.sent == [OP_CANCEL] and not transfers.incoming and not transfers.offers
+
+    transfers = FileTransfers(engine, directory=str(tmp_path))
+    offer(transfers, FakePeer())
+    assert engine.sent == [OP_CANCEL, OP_CANCEL] and not transfers.incoming
+    assert not os.listdir(tmp_path)
+
+
+@pytest.mark.parametrize('size, chunk_size', [
+    (1000, 1), (1000, MAX_CHUNK_SIZE + 1), (-1, CHUNK_SIZE), (1 << 60, CHUNK_SIZE),
+])
+def test_bad_offer_rejected(tmp_path, size, chunk_size):
+    offers = []
+    transfers = FileTransfers(FakeEngine(), directory=str(tmp_path), on_offer=offers.append)
+    offer(transfers, FakePeer(), size, chunk_size)
+    assert offers == [] and not transfers.incoming
+    assert not os.listdir(tmp_path)
+
+
+def test_offer_over_max_size_rejected(tmp_path):
+    offers = []
+    transfers = FileTransfers(FakeEngine(), directory=str(tmp_path), on_offer=offers.append,
+                              max_size=100)
+    offer(transfers, FakePeer(), size=101)
+    assert offers == []
+
+
+class Side:
+    """Engine numa thread com FileTransfers ligado como no Server e no Client"""
+
+    def __init__(self, directory, store=None, **kwargs):
+        self.events = queue.Queue()
+        kwargs.setdefault('heartbeat_interval', 0)
+        kwargs.setdefault('resume_timeout', 0)
+        self.engine = Engine(
+            on_join=self._on_join,
+            on_message=self._on_message,
+            on_disconnect=self._on_disconnect,
+            on_channel_open=self._on_channel_open,
+            on_channel_close=lambda peer, channel: self.transfers.channel_closed(peer, channel),
+            **kwargs
+        )
+        self.transfers = FileTransfers(
+            self.engine, directory=str(directory), store=store,
+            on_offer=lambda transfer: self.transfers.answer_offer(transfer.offer_id, True),
+            on_complete=lambda transfer, outgoing: self.events.put(('complete', transfer)),
+            on_failed=lambda transfer, error: self.events.put(('failed', error))
+        )
+        self.thread = threading.Thread(target=self.engine.run, daemon=True)
+        self.thread.start()
+
+    def _on_join(self, peer):
+        self.transfers.peer_joined(peer)
+        self.events.put(('join', peer))
+
+    def _on_channel_open(self, peer, channel):
+        self.transfers.channel_opened(peer, channel)
+        self.events.put(('channel', channel))
+
+    def _on_message(self, peer, data, stream):
+        if stream >= STREAM_BULK:
+            self.transfers.handle(peer, data, stream)
+
+    def _on_disconnect(self, peer):
+        self.transfers.peer_lost(peer)
+        self.events.put(('disconnect', peer))
+
+    def call(self, function, *args):
+        done = queue.Queue()
+        self.engine.call_soon(lambda: done.put(function(*args)))
+        return done.get(timeout=TIMEOUT)
+
+    def wait(self, kind):
+        while True:
+            event = self.events.get(timeout=TIMEOUT)
+            assert event[0] != 'failed', event[1]
+            if event[0] == kind:
+                return event[1]
+
+    def listen(self):
+        self.call(self.engine.open_room, DEFAULT_ROOM)
+        return self.call(self.engine.listen, '127.0.0.1', 0)
+
+    def connect(self, address, other):
+        """Conecta em other (que escuta em address); retorna o peer deste lado"""
+        peer = self.engine.connect(*address)
+        self.wait('join')
+        other.wait('join')
+        return peer
+
+    def stop(self):
+        self.engine.stop()
+        self.thread.join(TIMEOUT)
+        self.transfers.shutdown()
+
+
+@pytest.fixture
+def sides():
+    created = []
+
+    def make(directory, **kwargs):
+        side = Side(directory, **kwargs)
+        created.append(side)
+        return side
+    yield make
+    for side in created:
+        side.stop()
+
+
+def source_file(tmp_path, size, seed=1):
+    data = random.Random(seed).randbytes(size)
+    path = tmp_path / 'origem.bin'
+    path.write_bytes(data)
+    return path, hashlib.sha256(data).digest()
+
+
+def digest_of(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).digest()
+
+
+def test_transfer_interrupted_and_resumed(sides, tmp_path):
+    path, digest = source_file(tmp_path, 4 * CHUNK_SIZE + 1234)
+    received = tmp_path / 'recebidos'
+    receiver = sides(received)
+    sender = sides(tmp_path / 'enviados')
+    address = receiver.listen()
+    peer = sender.connect(address, receiver)
+
+    def interrupt(transfer, outgoing):
+        # Cai logo depois do primeiro chunk confirmado
+        receiver.transfers.on_progress = None
+        receiver.engine._finalize(transfer.peer)
+    receiver.transfers.on_progress = interrupt
+    sender.call(sender.transfers.send_file, peer, str(path))
+    sender.wait('disconnect')
+    receiver.wait('disconnect')
+
+    (state_path,) = glob.glob(str(received / '.*.json'))
+    with open(state_path) as f:
+        verified = json.load(f)['verified']
+    assert 0 < verified < 5
+    assert glob.glob(str(received / '.*.part'))
+
+    # Nova conexão: o envio é oferecido de novo e continua do .part
+    sender.connect(address, receiver)
+    transfer = receiver.wait('complete')
+    assert sender.wait('complete').finished
+    assert digest_of(transfer.path) == digest
+    assert os.listdir(received) == ['origem.bin']
+
+
+class ThreeStripes(StripeController):
+    """Três conexões desde o início, sem depender da vazão medida"""
+
+    def __init__(self):
+        super().__init__()
+        self.stripes = 3
+
+    def update(self, rate):
+        return self.stripes
+
+
+def test_striped_transfer_over_auxiliary_channels(sides, tmp_path, monkeypatch):
+    monkeypatch.setattr(transfer_module, 'STRIPE_MIN_SIZE', CHUNK_SIZE)
+    monkeypatch.setattr(transfer_module, 'StripeController', ThreeStripes)
+    path, digest = source_file(tmp_path, 6 * CHUNK_SIZE + 1234)
+    receiver = sides(tmp_path / 'recebidos', resume_timeout=30)
+    sender = sides(tmp_path / 'enviados', resume_timeout=30)
+    lanes = set()
+    on_data = receiver.engine._on_data
+    receiver.engine._on_data = lambda peer, frame: (lanes.add(peer), on_data(peer, frame))
+    peer = sender.connect(receiver.listen(), receiver)
+    sender.call(lambda: [sender.engine.open_channel(peer) for _ in range(2)])
+    sender.wait('channel')
+    sender.wait('channel')
+
+    sender.call(sender.transfers.send_file, peer, str(path))
+    transfer = receiver.wait('complete')
+    assert digest_of(transfer.path) == digest
+    # A principal e as duas auxiliares levaram chunks
+    assert len(lanes) == 3
+
+
+def test_stripe_controller_probes_and_settles():
+    stripes = StripeController(maximum=4)
+    assert [stripes.update(rate) for rate in (100, 200, 300, 310)] == [2, 3, 4, 3]
+    assert stripes.settled
+    assert stripes.update(305) == 3
+    # Queda da vazão: volta a sondar
+    stripes.update(100)
+    assert not stripes.settled and stripes.update(200) == 4
+
+
+def test_resend_deduplicated_from_chunk_store(sides, tmp_path):
+    data = random.Random(3).randbytes(3 * CHUNK_SIZE)
+    first = tmp_path / 'a.bin'
+    first.write_bytes(data)
+    # Mesmo conteúdo com um trecho inserido no meio, sob outro nome
+    edited = tmp_path / 'b.bin'
+    edited.write_bytes(data[:CHUNK_SIZE] + b'trecho novo' * 100 + data[CHUNK_SIZE:])
+    store = ChunkStore(str(tmp_path / 'cache'))
+    receiver = sides(tmp_path / 'recebidos', store=store)
+    sender = sides(tmp_path / 'enviados')
+    received = []
+    on_data = receiver.transfers._on_data
+    receiver.transfers._on_data = lambda peer, tid, body: (
+        received.append(len(body) - OFFSET.size), on_data(peer, tid, body))
+    peer = sender.connect(receiver.listen(), receiver)
+
+    sender.call(sender.transfers.send_file, peer, str(first))
+    receiver.wait('complete')
+    assert sum(received) == len(data)
+    entries = Manifest.build(str(first), CHUNK_SIZE).entries
+    deadline = time.monotonic() + TIMEOUT
+    while not all(digest in store for digest, _ in entries):
+        assert time.monotonic() < deadline, 'chunks não entraram no cache'
+        time.sleep(0.01)
+
+    # Reenvio: o HAVE cobre tudo e nenhum dado atravessa a rede
+    received.clear()
+    sender.call(sender.transfers.send_file, peer, str(first))
+    transfer = receiver.wait('complete')
+    assert sum(received) == 0
+    assert digest_of(transfer.path) == hashlib.sha256(data).digest()
+
+    # Arquivo editado: só os chunks em volta da inserção são enviados
+    received.clear()
+    sender.call(sender.transfers.send_file, peer, str(edited))
+    transfer = receiver.wait('complete')
+    assert 0 < sum(received) < len(data) // 4
+    assert digest_of(transfer.path) == digest_of(edited)
@@ -0,0 +1,61 @@
+import os
+import random
+import socket
+import threading
+
+from network.udpstream import UdpStream, PKT_DATA, PKT_ACK
+
+
+class LossyStream(UdpStream):
+    """Descarta uma fração dos pacotes enviados, como uma rede ruim"""
+
+    def __init__(self, *args, loss=0.0, seed=0):
+        super().__init__(*args)
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.dropped = 0
+
+    def _send(self, kind, seq=0, payload=b''):
+        if kind in (PKT_DATA, PKT_ACK) and self.random.random() < self.loss:
+            self.dropped += 1
+            return
+        super()._send(kind, seq, payload)
+
+
+def stream_pair(loss):
+    a, b = (socket.socket(socket.AF_INET, socket.SOCK_DGRAM) for _ in range(2))
+    for sock in (a, b):
+        sock.bind(('127.0.0.1', 0))
+    left = LossyStream(a, b.getsockname(), 7, loss=loss, seed=1)
+    right = LossyStream(b, a.getsockname(), 7, loss=loss, seed=2)
+    return left, right
+
+
+def receive_all(sock, into):
+    sock.settimeout(20)
+    while True:
+        data = sock.recv(65536)
+        if not data:
+            return
+        into += data
+
+
+def test_delivers_in_order_despite_loss():
+    left, right = stream_pair(loss=0.1)
+    sender, receiver = left.start(), right.start()
+    data = os.urandom(400 * 1024)
+    received = bytearray()
+    reader = threading.Thread(target=receive_all, args=(receiver, received))
+    reader.start()
+    try:
+        sender.sendall(data)
+        sender.shutdown(socket.SHUT_WR)
+        reader.join(30)
+        assert not reader.is_alive()
+        assert bytes(received) == data
+        assert left.dropped and right.dropped
+    finally:
+        left.close()
+        right.close()
+        sender.close()
+        receiver.close()
@@ -56,8 +56,31 @@ class ConfigWindow(QMainWindow):
         self.timeout.setValue(config.get('timeout', 30))
         self.timeout.setSuffix(" segundos")
         
+        self.cache_size = QSpinBox()
+        self.cache_size.setRange(0, 102400)
+        self.cache_size.setSingleStep(256)
+        self.cache_size.setValue(config.get('cache_size', 1024))
+        self.cache_size.setSuffix(" MB")
+        
+        self.compression = QCheckBox()
+        self.compression.setChecked(config.get('compression', True))
+        
+        self.mesh = QCheckBox()
+        self.mesh.setChecked(config.get('mesh', False))
+        
+        self.discovery = QCheckBox()
+        self.discovery.setChecked(config.get('discovery', False))
+        
+        self.rendezvous = QLineEdit(config.get('rendezvous', ''))
+        self.rendezvous.setPlaceholderText('host:porta (vazio: desativado)')
+        
         network_layout.addRow('Porta:', self.port)
         network_layout.addRow('Timeout de Conexão:', self.timeout)
+        network_layout.addRow('Cache de Arquivos:', self.cache_size)
+        network_layout.addRow('Compressão:', self.compression)
+        network_layout.addRow('Salas em Malha:', self.mesh)
+        network_layout.addRow('Descoberta na LAN:', self.discovery)
+        network_layout.addRow('Rendezvous (UDP):', self.rendezvous)
         
         ui_group = QGroupBox("Interface")
         ui_layout = QFormLayout(ui_group)
@@ -150,6 +173,11 @@ class ConfigWindow(QMainWindow):
             'sound_effects': True,
             'encryption': True,
             'timeout': 30,
+            'cache_size': 1024,
+            'compression': True,
+            'mesh': False,
+            'discovery': False,
+            'rendezvous': '',
             'avatar_color': '#1E88E5',
             'room_password': '',
             'check_updates_at_startup': True
@@ -163,6 +191,11 @@ class ConfigWindow(QMainWindow):
         self.sound_effects.setChecked(default_config['sound_effects'])
         self.encryption.setChecked(default_config['encryption'])
         self.timeout.setValue(default_config['timeout'])
+        self.cache_size.setValue(default_config['cache_size'])
+        self.compression.setChecked(default_config['compression'])
+        self.mesh.setChecked(default_config['mesh'])
+        self.discovery.setChecked(default_config['discovery'])
+        self.rendezvous.setText(default_config['rendezvous'])
         self.current_color = default_config['avatar_color']
         self.avatar_color.setStyleSheet(f"background-color: {self.current_color}")
         self.room_password.setText(default_config['room_password'])
@@ -180,6 +213,11 @@ class ConfigWindow(QMainWindow):
         self.config['sound_effects'] = self.sound_effects.isChecked()
         self.config['encryption'] = self.encryption.isChecked()
         self.config['timeout'] = self.timeout.value()
+        self.config['cache_size'] = self.cache_size.value()
+        self.config['compression'] = self.compression.isChecked()
+        self.config['mesh'] = self.mesh.isChecked()
+        self.config['discovery'] = self.discovery.isChecked()
+        self.config['rendezvous'] = self.rendezvous.text().strip()
         self.config['avatar_color'] = self.current_color
         self.config['room_password'] = self.room_password.text()
         self.config['check_updates_at_startup'] = self.check_updates.isChecked()
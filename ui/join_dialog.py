@@ -0,0 +1,78 @@
+from PyQt5.QtWidgets import (
+    QDialog, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QPushButton,
+    QListWidget, QListWidgetItem
+)
+from PyQt5.QtCore import Qt, QTimer
+from utils.code_generator import generate_room_code
+from ui.themes import THEMES
+
+
+class JoinDialog(QDialog):
+    """Entrada em sala: código digitado ou sala anunciada na rede local"""
+
+    def __init__(self, config, discovery=None, parent=None):
+        super().__init__(parent)
+        self.discovery = discovery
+        self.setWindowTitle('Entrar na Sala')
+        self.resize(420, 360)
+        self.setStyleSheet(THEMES.get(config.get('theme', 'XP'), ''))
+
+        layout = QVBoxLayout(self)
+
+        if discovery is not None:
+            layout.addWidget(QLabel("Salas na rede local:"))
+            self.rooms_list = QListWidget()
+            self.rooms_list.itemClicked.connect(self.select_room)
+            self.rooms_list.itemDoubleClicked.connect(self.join_selected)
+            layout.addWidget(self.rooms_list)
+
+            # O diretório é atualizado pela thread de descoberta
+            self.refresh_timer = QTimer(self)
+            self.refresh_timer.timeout.connect(self.refresh_rooms)
+            self.refresh_timer.start(1000)
+            self.refresh_rooms()
+
+        layout.addWidget(QLabel("Código da Sala:"))
+        self.code_input = QLineEdit()
+        layout.addWidget(self.code_input)
+
+        buttons = QHBoxLayout()
+        buttons.addStretch()
+        cancel_button = QPushButton("Cancelar")
+        cancel_button.clicked.connect(self.reject)
+        join_button = QPushButton("Entrar")
+        join_button.setDefault(True)
+        join_button.clicked.connect(self.accept)
+        buttons.addWidget(cancel_button)
+        buttons.addWidget(join_button)
+        layout.addLayout(buttons)
+
+    def refresh_rooms(self):
+        """Lista as salas do diretório, mantendo a seleção"""
+        selected = self.rooms_list.currentItem()
+        selected_code = selected.data(Qt.UserRole) if selected else None
+        self.rooms_list.clear()
+        for entry in self.discovery.rooms():
+            code = generate_room_code(entry.host, entry.port, entry.room)
+            members = f"{entry.members}/{entry.max_members}" if entry.max_members else entry.members
+            text = f"{entry.name or entry.host} - {members} usuários"
+            if entry.mesh:
+                text += " (malha)"
+            if not entry.is_live():
+                text += " (não confirmada)"
+            item = QListWidgetItem(text)
+            item.setData(Qt.UserRole, code)
+            item.setToolTip(f"{entry.host}:{entry.port}")
+            self.rooms_list.addItem(item)
+            if code.split('-', 1)[1] == (selected_code or '-').split('-', 1)[1]:
+                self.rooms_list.setCurrentItem(item)
+
+    def select_room(self, item):
+        self.code_input.setText(item.data(Qt.UserRole))
+
+    def join_selected(self, item):
+        self.select_room(item)
+        self.accept()
+
+    def code(self):
+        return self.code_input.text().strip()
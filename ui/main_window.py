@@ -1,18 +1,27 @@
 from PyQt5.QtWidgets import (
     QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QSplitter,
     QTextEdit, QLineEdit, QPushButton, QLabel, QFrame, QScrollArea,
-    QInputDialog, QMessageBox, QApplication, QListWidget, QListWidgetItem
+    QMessageBox, QApplication, QListWidget, QListWidgetItem,
+    QFileDialog, QProgressBar, QDialog
 )
 from PyQt5.QtCore import Qt, QTimer, pyqtSignal
 from PyQt5.QtGui import QColor, QIcon, QPixmap, QFont
 from network.server import Server
 from network.client import Client
-from utils.code_generator import generate_room_code, decode_room_code
-from utils.crypto import encrypt_message, decrypt_message
+from utils.code_generator import generate_room_code, decode_room_code, generate_room_id
+from network import chat
+from network.chat import ChatSession
+from network.outbox import POLICY_KEEP
+from network.streams import STREAM_CONTROL
+from network.chunkstore import ChunkStore
+from network.mesh import MESH_PREFIX, MAX_MEMBERS, is_mesh_room
+from network.discovery import Discovery, local_address
+from network.rendezvous import RENDEZVOUS_PORT
+from network.ratelimit import BYTE_RATE
+from ui.join_dialog import JoinDialog
 from ui.themes import THEMES
-import socket
+import os
 import time
-import json
 
 class ChatBubble(QFrame):
     """Widget personalizado para bolhas de chat"""
@@ -112,14 +121,20 @@ class MainWindow(QMainWindow):
         self.resize(800, 600)
         self.setStyleSheet(THEMES.get(config.get('theme', 'XP'), ''))
         
+        self.discovery = None
         self.is_typing = False
         self.typing_timer = QTimer()
         self.typing_timer.timeout.connect(self.stop_typing)
         self.typing_signal.connect(self.send_typing_status)
         
-        self.users = {config['username']: "online"}
-        self.max_users = 2  
-        self.encrypted = True
+        # Mudanças de presença são juntadas numa janela curta (ver network.presence)
+        self.session = ChatSession(
+            config['username'], self.dispatch, max_users=2,
+            schedule=lambda delay, callback: QTimer.singleShot(int(delay * 1000), callback)
+        )
+        self.users = self.session.users
+        self.max_users = self.session.max_users
+        self.encrypted = self.session.encrypted
         
         central = QWidget()
         self.setCentralWidget(central)
@@ -131,6 +146,7 @@ class MainWindow(QMainWindow):
         
         users_header = QLabel("<h3>Usuários</h3>")
         self.users_list = QListWidget()
+        self.user_items = {}
         self.update_users_list()
         
         room_info = QLabel()
@@ -144,7 +160,7 @@ class MainWindow(QMainWindow):
         users_layout.addWidget(room_info)
         
         self.conn_status = QLabel("Conectado: Não")
-        self.encryption_status = QLabel("Criptografia: Ativada")
+        self.encryption_status = QLabel()
         
         users_layout.addWidget(self.conn_status)
         users_layout.addWidget(self.encryption_status)
@@ -171,12 +187,19 @@ class MainWindow(QMainWindow):
         self.send_btn = QPushButton("Enviar")
         self.send_btn.clicked.connect(self.send_message)
         self.msg_input.returnPressed.connect(self.send_message)
+        self.file_btn = QPushButton("Enviar arquivo")
+        self.file_btn.clicked.connect(self.send_file)
         
         input_layout.addWidget(self.msg_input)
         input_layout.addWidget(self.send_btn)
+        input_layout.addWidget(self.file_btn)
+        
+        self.transfer_bar = QProgressBar()
+        self.transfer_bar.setVisible(False)
         
         chat_layout.addWidget(self.chat_area)
         chat_layout.addWidget(self.typing_label)
+        chat_layout.addWidget(self.transfer_bar)
         chat_layout.addWidget(input_frame)
         
         splitter = QSplitter(Qt.Horizontal)
@@ -187,29 +210,49 @@ class MainWindow(QMainWindow):
         
         self.server = None
         self.client = None
+        self.store = ChunkStore('cache', self.config.get('cache_size', 1024) * 1024 * 1024)
+        # Lista vazia: nenhum método oferecido no hello
+        self.compression_methods = None if self.config.get('compression', True) else []
+        # Rendezvous para caminhos diretos por UDP ('host:porta', opcional)
+        self.rendezvous = None
+        rendezvous = self.config.get('rendezvous', '').strip()
+        if rendezvous:
+            host, _, port = rendezvous.partition(':')
+            self.rendezvous = (host, int(port) if port.isdigit() else RENDEZVOUS_PORT)
+        # Cifra de sessão por conexão; a chave fixa só com peers antigos
+        self.encryption = self.config.get('encryption', True)
+        self.ciphers = None if self.encryption else []
+        self.update_encryption_status(False)
         self.peer_connected = False
+        self.reconnecting = False
+        self.congested = False
+        self.rtt_ms = None
+        
+        # Descoberta de salas na LAN (opcional)
+        if self.config.get('discovery', False):
+            self.discovery = Discovery()
+            if not self.discovery.start():
+                self.discovery = None
         
         if new_room:
             self.start_server()
         else:
             self.join_room()
-            
-        self.conn_timer = QTimer()
-        self.conn_timer.timeout.connect(self.check_connection)
-        self.conn_timer.start(5000) 
     
     def start_server(self):
         """Inicia o servidor e gera código da sala"""
         port = self.config['port']
-        self.server = Server('0.0.0.0', port, max_clients=1)  
-        self.server.message_received.connect(self.process_message)
-        self.server.client_connected.connect(self.on_client_connected)
-        self.server.client_disconnected.connect(self.on_client_disconnected)
-        self.server.start()
+        room_id = generate_room_id()
+        if self.config.get('mesh', False):
+            room_id = MESH_PREFIX + room_id
+        self.create_server(port, room_id)
+        if self.discovery:
+            self.discovery.host(room_id, port, name=self.config['username'],
+                                max_members=self.max_users, mesh=is_mesh_room(room_id))
 
 
-        local_ip = socket.gethostbyname(socket.gethostname())
-        room_code = generate_room_code(local_ip, port)
+        local_ip = local_address()
+        room_code = generate_room_code(local_ip, port, room_id)
 
 
         clipboard = QApplication.clipboard()
@@ -220,72 +263,223 @@ class MainWindow(QMainWindow):
             f'Código da Sala:\n{room_code}\n\n(copiado para a área de transferência)'
         )
     
+    def create_server(self, port, room_id):
+        """Servidor da sala; numa sala em malha todos os membros têm um"""
+        mesh = is_mesh_room(room_id)
+        if mesh:
+            self.session.max_users = self.max_users = MAX_MEMBERS
+        self.server = Server(
+            '0.0.0.0', port,
+            max_clients=MAX_MEMBERS - 1 if mesh else 1,
+            backlog=self.config.get('backlog', 128),
+            room_id=room_id,
+            timeout=self.config.get('timeout', 30),
+            store=self.store,
+            compression_methods=self.compression_methods,
+            mesh=mesh,
+            username=self.config['username'],
+            rendezvous=self.rendezvous,
+            ciphers=self.ciphers,
+            password=self.config.get('room_password', ''),
+            byte_rate=self.config.get('byte_rate', BYTE_RATE)
+        )
+        self.server.peer_backpressure.connect(self.on_peer_backpressure)
+        self.server.peer_rtt.connect(self.on_peer_rtt)
+        self.server.message_received.connect(self.process_message)
+        self.server.client_connected.connect(self.on_client_connected)
+        self.server.client_disconnected.connect(self.on_client_disconnected)
+        self.server.client_detached.connect(self.on_reconnecting)
+        self.server.client_resumed.connect(self.on_resumed)
+        self.server.member_left.connect(self.on_member_left)
+        self.connect_transfers(self.server)
+        self.server.start()
+    
     def join_room(self):
         """Conecta a uma sala existente"""
-        code, ok = QInputDialog.getText(self, 'Entrar na Sala', 'Insira o Código da Sala:')
+        dialog = JoinDialog(self.config, self.discovery, self)
+        ok = dialog.exec_() == QDialog.Accepted
+        code = dialog.code()
         if ok:
             try:
-                ip, port = decode_room_code(code)
-                self.client = Client(ip, port)
+                ip, port, room_id = decode_room_code(code)
+                if is_mesh_room(room_id):
+                    # Sala em malha: entra por quem passou o código, mas
+                    # continua na sala se ele sair
+                    self.create_server(self.config['port'], room_id)
+                    self.server.join_mesh(ip, port)
+                    return
+                self.client = Client(ip, port, room=room_id,
+                                     timeout=self.config.get('timeout', 30),
+                                     store=self.store,
+                                     compression_methods=self.compression_methods,
+                                     rendezvous=self.rendezvous,
+                                     ciphers=self.ciphers,
+                                     password=self.config.get('room_password', ''))
                 self.client.message_received.connect(self.process_message)
                 self.client.connected.connect(self.on_connected)
                 self.client.disconnected.connect(self.on_disconnected)
+                self.client.auth_failed.connect(self.on_auth_failed)
+                self.client.reconnecting.connect(self.on_reconnecting)
+                self.client.resumed.connect(self.on_resumed)
+                self.client.rtt_updated.connect(self.on_rtt)
+                self.connect_transfers(self.client)
                 self.client.start()
                 
-                self.send_system_message("user_join", {"username": self.config['username']})
+                self.session.send_join()
                 
             except Exception as e:
                 QMessageBox.critical(self, 'Erro', f"Falha ao conectar: {str(e)}")
     
-    def check_connection(self):
-        """Verifica periodicamente o status da conexão"""
-        if self.server and self.server.has_clients():
-            self.peer_connected = True
-            self.conn_status.setText("Conectado: Sim")
-        elif self.client and self.client.is_connected():
-            self.peer_connected = True
-            self.conn_status.setText("Conectado: Sim")
-        else:
-            self.peer_connected = False
+    def update_conn_status(self):
+        """Atualiza o indicador de conexão (a rede avisa as mudanças)"""
+        if self.reconnecting:
+            self.conn_status.setText("Conectado: Reconectando...")
+        elif not self.peer_connected:
             self.conn_status.setText("Conectado: Não")
-           
             self.typing_label.setText("")
+        elif self.congested:
+            self.conn_status.setText("Conectado: Sim (lento)")
+        elif self.rtt_ms is not None:
+            self.conn_status.setText(f"Conectado: Sim ({self.rtt_ms:.0f} ms)")
+        else:
+            self.conn_status.setText("Conectado: Sim")
+    
+    def update_encryption_status(self, secure):
+        """Cifra de sessão negociada, ou a chave fixa para peers antigos"""
+        self.session.encrypted = self.encrypted = self.encryption and not secure
+        if secure and self.config.get('room_password'):
+            self.encryption_status.setText("Criptografia: Sessão (senha da sala)")
+        elif secure:
+            self.encryption_status.setText("Criptografia: Sessão (X25519)")
+        elif self.encryption:
+            self.encryption_status.setText("Criptografia: Ativada")
+        else:
+            self.encryption_status.setText("Criptografia: Desativada")
     
     def on_client_connected(self, client_info):
         """Chamado quando um cliente se conecta ao servidor"""
+        first = not self.peer_connected
         self.peer_connected = True
-        self.conn_status.setText("Conectado: Sim")
+        self.session.compression = self.server.compression
+        self.update_encryption_status(self.server.secure)
+        self.update_conn_status()
+        if first and self.server.mesh is not None:
+            # Na malha não há cliente: cada membro se apresenta à sala
+            self.session.send_join()
     
     def on_client_disconnected(self):
         """Chamado quando um cliente se desconecta do servidor"""
         self.peer_connected = False
-        self.conn_status.setText("Conectado: Não")
+        self.reconnecting = False
+        self.rtt_ms = None
+        self.update_conn_status()
         self.add_system_message("O outro usuário desconectou")
         
-
-        for username in list(self.users.keys()):
-            if username != self.config['username']:
-                self.users.pop(username, None)
+        self.session.remove_peers()
         self.update_users_list()
     
+    def on_member_left(self, username):
+        """Um membro da sala em malha saiu (a sala continua)"""
+        if username and username != self.config['username']:
+            self.session.remove_user(username)
+            self.update_users_list()
+            self.add_system_message(f"{username} saiu da sala")
+    
+    def on_peer_backpressure(self, client_info, congested):
+        """Indica quando a fila de envio para um cliente está congestionada"""
+        self.congested = congested
+        self.update_conn_status()
+    
+    def on_peer_rtt(self, client_info, rtt_ms):
+        self.on_rtt(rtt_ms)
+    
+    def on_rtt(self, rtt_ms):
+        """Latência medida pelo heartbeat"""
+        self.rtt_ms = rtt_ms
+        self.update_conn_status()
+    
     def on_connected(self):
         """Chamado quando cliente se conecta com sucesso"""
         self.peer_connected = True
-        self.conn_status.setText("Conectado: Sim")
+        self.session.compression = self.client.compression
+        self.update_encryption_status(self.client.secure)
+        self.update_conn_status()
         
-        self.send_system_message("user_join", {"username": self.config['username']})
+        self.session.send_join()
     
     def on_disconnected(self):
         """Chamado quando cliente é desconectado"""
         self.peer_connected = False
-        self.conn_status.setText("Conectado: Não")
+        self.reconnecting = False
+        self.rtt_ms = None
+        self.update_conn_status()
         self.add_system_message("Desconectado da sala")
         
-        for username in list(self.users.keys()):
-            if username != self.config['username']:
-                self.users.pop(username, None)
+        self.session.remove_peers()
         self.update_users_list()
     
+    def on_reconnecting(self, *args):
+        """Conexão caiu; as mensagens ficam na fila até a sessão ser retomada"""
+        self.reconnecting = True
+        self.update_conn_status()
+    
+    def on_resumed(self, *args):
+        """Sessão retomada sem perda de mensagens"""
+        self.reconnecting = False
+        self.peer_connected = True
+        self.update_conn_status()
+    
+    def connect_transfers(self, adapter):
+        adapter.transfer_progress.connect(self.on_transfer_progress)
+        adapter.transfer_finished.connect(self.on_transfer_finished)
+        adapter.transfer_failed.connect(self.on_transfer_failed)
+        adapter.transfer_offered.connect(
+            lambda offer_id, name, size: self.on_transfer_offered(adapter, offer_id, name, size)
+        )
+    
+    def send_file(self):
+        """Escolhe um arquivo e oferece ao outro lado"""
+        if not self.peer_connected:
+            QMessageBox.warning(self, 'Enviar arquivo', 'Nenhum usuário conectado')
+            return
+        path, _ = QFileDialog.getOpenFileName(self, 'Enviar arquivo')
+        if not path:
+            return
+        if self.server:
+            self.server.send_file(path)
+        elif self.client:
+            self.client.send_file(path)
+        self.add_system_message(f"Enviando {os.path.basename(path)}...")
+    
+    def on_transfer_offered(self, adapter, offer_id, name, size):
+        """Nada é gravado em received_files sem o usuário aceitar"""
+        answer = QMessageBox.question(
+            self, 'Receber arquivo',
+            f"Aceitar o arquivo {name} ({size / (1024 * 1024):.1f} MB)?",
+            QMessageBox.Yes | QMessageBox.No, QMessageBox.No
+        )
+        accept = answer == QMessageBox.Yes
+        adapter.answer_transfer(offer_id, accept)
+        if not accept:
+            self.add_system_message(f"Arquivo recusado: {name}")
+    
+    def on_transfer_progress(self, name, done, total, outgoing):
+        action = "Enviando" if outgoing else "Recebendo"
+        self.transfer_bar.setVisible(True)
+        self.transfer_bar.setFormat(f"{action} {name}: %p%")
+        self.transfer_bar.setValue(int(done * 100 / total) if total else 100)
+    
+    def on_transfer_finished(self, path, outgoing):
+        self.transfer_bar.setVisible(False)
+        if outgoing:
+            self.add_system_message(f"Arquivo enviado: {os.path.basename(path)}")
+        else:
+            self.add_system_message(f"Arquivo recebido: {path}")
+    
+    def on_transfer_failed(self, name, error):
+        self.transfer_bar.setVisible(False)
+        self.add_system_message(f"Falha na transferência de {name}: {error}")
+    
     def on_text_changed(self):
         """Detectar quando o usuário está digitando"""
         if not self.is_typing:
@@ -304,98 +498,66 @@ class MainWindow(QMainWindow):
     def send_typing_status(self, is_typing):
         """Envia status de digitação para o outro usuário"""
         if self.peer_connected:
-            status = "typing" if is_typing else "online"
-            self.send_system_message("typing_status", {
-                "username": self.config['username'],
-                "status": status
-            })
+            self.session.send_typing(is_typing)
     
     def process_message(self, data):
         """Processa mensagens recebidas (chat ou sistema)"""
-        try:
-           
-            msg_obj = json.loads(data)
-            
-            
-            # Processa mensagem de chat
-            if msg_obj.get("type") == "chat":
-                content = msg_obj.get("content", "")
-                username = msg_obj.get("username", "Anônimo")
-                
-                # Descriptografa se necessário
-                if self.encrypted and "encrypted" in msg_obj:
-                    try:
-                        content = decrypt_message(content)
-                    except Exception as e:
-                        print(f"Erro ao descriptografar: {e}")
-                
-                # Exibe a mensagem na interface
-                self.display_message(username, content)
-            elif msg_obj.get("type") == "user_join":
-
-                username = msg_obj.get("data", {}).get("username", "Anônimo")
-                if username not in self.users and len(self.users) < self.max_users:
-                    self.users[username] = "online"
-                    self.update_users_list()
-                    self.add_system_message(f"{username} entrou na sala")
-                    
-                   
-                    self.send_system_message("user_list", {"users": self.users})
-                    
-                elif len(self.users) >= self.max_users:
-                  
-                    self.send_system_message("room_full", {})
-            
-            elif msg_obj.get("type") == "user_list":
-                
-                user_list = msg_obj.get("data", {}).get("users", {})
-                self.users.update(user_list)
-                self.update_users_list()
-            
-            elif msg_obj.get("type") == "room_full":
-               
-                QMessageBox.warning(self, "Sala Cheia", 
-                                    "Esta sala já atingiu o limite de 2 usuários.")
-                if self.client:
-                    self.client.disconnect()
-            
-            elif msg_obj.get("type") == "typing_status":
-               
-                username = msg_obj.get("data", {}).get("username", "")
-                status = msg_obj.get("data", {}).get("status", "online")
-                
-                if username in self.users:
-                    self.users[username] = status
-                    self.update_users_list()
-                    
-                    if status == "typing" and username != self.config['username']:
-                        self.typing_label.setText(f"{username} está digitando...")
-                    else:
-                        self.typing_label.setText("")
-                        
-        except json.JSONDecodeError:
-            parts = data.split(": ", 1)
-            if len(parts) == 2:
-                username, message = parts
-                self.display_message(username, message)
-            else:
-                self.display_message("Anônimo", data)
+        for event in self.session.handle_payload(data):
+            self.apply_event(event)
     
-    def send_system_message(self, msg_type, data=None):
-        """Envia mensagem de sistema com formato JSON"""
-        if data is None:
-            data = {}
-            
-        message = {
-            "type": msg_type,
-            "data": data
-        }
+    def apply_event(self, event):
+        """Reflete na interface um evento produzido pela sessão de chat"""
+        kind = event[0]
+        
+        if kind == chat.EVENT_CHAT:
+            _, username, content = event
+            self.display_message(username, content)
+        
+        elif kind == chat.EVENT_SYSTEM:
+            self.add_system_message(event[1])
         
-        payload = json.dumps(message)
+        elif kind == chat.EVENT_USERS:
+            self.update_users_list()
+        
+        elif kind == chat.EVENT_TYPING:
+            _, username, typing = event
+            if typing:
+                self.typing_label.setText(f"{username} está digitando...")
+            else:
+                self.typing_label.setText("")
+        
+        elif kind == chat.EVENT_ROOM_FULL:
+            QMessageBox.warning(self, "Sala Cheia", 
+                                "Esta sala já atingiu o limite de usuários.")
+            if self.client:
+                self.client.disconnect()
+        
+        elif kind == chat.EVENT_ROOM_NOT_FOUND:
+            QMessageBox.warning(self, "Sala Inexistente", 
+                                "Esta sala não existe ou já foi encerrada.")
+            if self.client:
+                self.client.disconnect()
+        
+        elif kind == chat.EVENT_AUTH_FAILED:
+            self.on_auth_failed()
+    
+    def on_auth_failed(self):
+        """A senha da sala (Configurações) não confere com a do host"""
+        QMessageBox.warning(self, "Senha Incorreta",
+                            "A senha da sala não confere (ou foram muitas tentativas).")
+        if self.client:
+            self.client.disconnect()
+    
+    def send_system_message(self, msg_type, data=None, policy=POLICY_KEEP, key=None):
+        """Envia mensagem de sistema com o codec negociado"""
+        self.session.send_system_message(msg_type, data, policy, key)
+    
+    def dispatch(self, message, policy=POLICY_KEEP, key=None, stream=STREAM_CONTROL):
+        """Entrega a mensagem ao cliente ou servidor ativo"""
         if self.client:
-            self.client.send(payload)
+            self.client.send_message(message, policy, key, stream)
         elif self.server:
-            self.server.broadcast(payload)
+            self.server.broadcast_message(message, policy, key, stream)
     
     def send_message(self):
         """Envia mensagem de chat"""
@@ -405,21 +567,7 @@ class MainWindow(QMainWindow):
             
         self.stop_typing()
         
-        message = {
-            "type": "chat",
-            "username": self.config['username'],
-            "content": text
-        }
-        
-        if self.encrypted:
-            message["content"] = encrypt_message(text)
-            message["encrypted"] = True
-        
-        payload = json.dumps(message)
-        if self.client:
-            self.client.send(payload)
-        elif self.server:
-            self.server.broadcast(payload)
+        self.session.send_chat(text)
             
         self.display_message(self.config['username'], text, is_own=True)
         self.msg_input.clear()
@@ -446,16 +594,26 @@ class MainWindow(QMainWindow):
         self.chat_layout.addWidget(label)
     
     def update_users_list(self):
-        """Atualiza a lista de usuários na interface"""
-        self.users_list.clear()
+        """Atualiza a lista de usuários na interface (só as linhas que mudaram)"""
+        if self.discovery and self.server:
+            self.discovery.set_members(self.server.room_id, len(self.users))
+        
+        for username in list(self.user_items):
+            if username not in self.users:
+                item, _ = self.user_items.pop(username)
+                self.users_list.takeItem(self.users_list.row(item))
         
         for username, status in self.users.items():
+            if username in self.user_items:
+                self.user_items[username][1].set_status(status)
+                continue
             item = QListWidgetItem()
             user_widget = UserListItem(username, status)
             item.setSizeHint(user_widget.sizeHint())
             
             self.users_list.addItem(item)
             self.users_list.setItemWidget(item, user_widget)
+            self.user_items[username] = (item, user_widget)
     
     def closeEvent(self, event):
         """Limpar recursos ao fechar a janela"""
@@ -463,4 +621,6 @@ class MainWindow(QMainWindow):
             self.client.disconnect()
         if self.server:
             self.server.stop()
+        if self.discovery:
+            self.discovery.stop()
         event.accept()
\ No newline at end of file
@@ -1,6 +1,7 @@
 import random
 import string
 import base64
+import secrets
 
 
 WORDS = [
@@ -8,26 +9,38 @@ WORDS = [
     'golf','hotel','india','juliet','kilo','lima'
 ]
 
-def generate_room_code(ip: str, port: int) -> str:
+def generate_room_id() -> str:
     """
-    Gera código no formato: <palavra><4 dígitos>-<base64(ip:port)>.
+    Gera um identificador aleatório de sala.
+    """
+    return secrets.token_hex(4)
+
+def generate_room_code(ip: str, port: int, room_id: str = '') -> str:
+    """
+    Gera código no formato: <palavra><4 dígitos>-<base64(ip:port[/sala])>.
     """
     word = random.choice(WORDS)
     digits = ''.join(random.choices(string.digits, k=4))
-    raw = f"{ip}:{port}".encode()
-    b64 = base64.urlsafe_b64encode(raw).decode()
+    raw = f"{ip}:{port}"
+    if room_id:
+        raw += f"/{room_id}"
+    b64 = base64.urlsafe_b64encode(raw.encode()).decode()
     return f"{word}{digits}-{b64}"
 
+def _split_address(raw: str):
+    address, _, room_id = raw.partition('/')
+    ip, port = address.rsplit(':', 1)
+    return ip, int(port), room_id
+
 def decode_room_code(code: str):
     """
-    Decodifica '<prefix>-<base64>' ou 'ip:port'.
+    Decodifica '<prefix>-<base64>' ou 'ip:port[/sala]'.
+    Retorna (ip, porta, sala); a sala é '' em códigos antigos.
     """
     if '-' in code:
         _, b64 = code.split('-', 1)
         raw = base64.urlsafe_b64decode(b64.encode()).decode()
-        ip, port = raw.split(':')
-        return ip, int(port)
+        return _split_address(raw)
     if ':' in code:
-        ip, port = code.split(':', 1)
-        return ip, int(port)
+        return _split_address(code)
     raise ValueError('Formato de código inválido')
\ No newline at end of file
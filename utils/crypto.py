@@ -1,9 +1,62 @@
 from cryptography.fernet import Fernet
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey, X25519PublicKey
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import base64
+import struct
+import mmap
 import os
+import hmac
+import hashlib
 
+# Chave fixa, igual em toda instalação: só ofusca. Mantida para peers que
+# não negociam chaves de sessão (ver SessionCipher)
 CRYPTO_KEY = b'vwP2g-Sq4qzcZk51wuz94JO7l_zMbHwh8vc9Ly8pSw8='
 
+# Cifras de sessão em ordem de preferência: AES-GCM é mais rápido com
+# AES-NI; ChaCha20-Poly1305 é o mais rápido sem ele
+CIPHERS = {
+    'aes-256-gcm': AESGCM,
+    'chacha20-poly1305': ChaCha20Poly1305,
+}
+DEFAULT_CIPHERS = list(CIPHERS)
+
+# Contador do nonce (vai no início de cada payload cifrado) e tag AEAD
+COUNTER = struct.Struct('!Q')
+TAG_SIZE = 16
+OVERHEAD = COUNTER.size + TAG_SIZE
+
+# Contadores recebidos fora de ordem aceitos (atrás do maior já visto)
+REPLAY_WINDOW = 1024
+
+# Arquivo cifrado: cabeçalho (magic, versão, cifra, tamanho do bloco, sal)
+# e blocos de FILE_CHUNK bytes autenticados um a um, com o cabeçalho como
+# dados adicionais. O nonce é o índice do bloco e uma marca de último
+# bloco: trocar, remover ou acrescentar blocos falha na autenticação.
+FILE_MAGIC = b'WP2F'
+FILE_VERSION = 1
+FILE_HEADER = struct.Struct('!4sBBI16s')
+FILE_CIPHERS = DEFAULT_CIPHERS
+FILE_CHUNK = 64 * 1024
+CHUNK_NONCE = struct.Struct('!3xQ?')
+
+# Threads que cifram blocos em paralelo (as primitivas soltam o GIL). Cada
+# tarefa leva FILE_BATCH blocos, e cada thread tem até FILE_DEPTH tarefas
+# em voo: a memória fica em workers * FILE_DEPTH * FILE_BATCH blocos
+FILE_WORKERS = os.cpu_count() or 1
+FILE_BATCH = 16
+FILE_DEPTH = 2
+
+# Blocos decifrados mantidos por EncryptedFile (LRU)
+FILE_CACHE = 32
+
+_key = CRYPTO_KEY
 _fernet = Fernet(CRYPTO_KEY)
 
 def generate_key():
@@ -12,8 +65,9 @@ def generate_key():
 
 def set_crypto_key(key):
     """Configura a chave de criptografia a ser usada"""
-    global _fernet
+    global _fernet, _key
     _fernet = Fernet(key)
+    _key = key
 
 def encrypt_message(message):
     """Criptografa uma mensagem de texto"""
@@ -27,55 +81,411 @@ def encrypt_message(message):
         print(f"Encryption error: {e}")
         return message.decode('utf-8') if isinstance(message, bytes) else message
 
-def decrypt_message(token):
-    """Descriptografa uma mensagem criptografada"""
+def decrypt_message(token, raw=False):
+    """Descriptografa uma mensagem criptografada (raw=True retorna bytes)"""
     if isinstance(token, str):
         token = token.encode('utf-8')
     
     try:
         message = _fernet.decrypt(token)
-        return message.decode('utf-8')
+        return message if raw else message.decode('utf-8')
     except Exception as e:
         print(f"Decryption error: {e}")
         return token.decode('utf-8') if isinstance(token, bytes) else token
 
-def encrypt_file(file_path, output_path=None):
-    """Criptografa um arquivo"""
+def encrypt_file(file_path, output_path=None, key=None, cipher=FILE_CIPHERS[0],
+                 chunk_size=FILE_CHUNK, workers=None):
+    """
+    Criptografa um arquivo em fluxo (ver FILE_HEADER): memória constante,
+    dois blocos de chunk_size por vez, ou alguns por thread com workers > 1
+    (padrão FILE_WORKERS). key (bytes) substitui a chave configurada em
+    set_crypto_key.
+    """
     if output_path is None:
         output_path = file_path + '.encrypted'
     
     try:
-        with open(file_path, 'rb') as f:
-            data = f.read()
-        
-        encrypted_data = _fernet.encrypt(data)
-        
-        with open(output_path, 'wb') as f:
-            f.write(encrypted_data)
-        
+        with open(file_path, 'rb') as src, open(output_path, 'wb') as dst:
+            header, aead = _new_file_header(cipher, chunk_size, key)
+            dst.write(header)
+            workers = FILE_WORKERS if workers is None else workers
+            if workers > 1:
+                _run_chunks(src, dst, chunk_size, TAG_SIZE, partial(_seal_chunk, aead, header),
+                            workers)
+            else:
+                _seal_stream(src, dst, aead, header, chunk_size)
         return output_path
     except Exception as e:
         print(f"File encryption error: {e}")
         return None
 
-def decrypt_file(encrypted_path, output_path=None):
-    """Descriptografa um arquivo"""
+def decrypt_file(encrypted_path, output_path=None, key=None, workers=None):
+    """
+    Descriptografa um arquivo de encrypt_file. O texto vai para um .part
+    renomeado só depois do último bloco: arquivo truncado, estendido ou
+    adulterado não deixa saída. Arquivos antigos (um token Fernet) também
+    são aceitos.
+    """
     if output_path is None:
         if encrypted_path.endswith('.encrypted'):
             output_path = encrypted_path[:-10]
         else:
             output_path = encrypted_path + '.decrypted'
     
+    part_path = output_path + '.part'
     try:
-        with open(encrypted_path, 'rb') as f:
-            encrypted_data = f.read()
-        
-        decrypted_data = _fernet.decrypt(encrypted_data)
-        
-        with open(output_path, 'wb') as f:
-            f.write(decrypted_data)
-        
+        with open(encrypted_path, 'rb') as src:
+            header = src.read(FILE_HEADER.size)
+            if header[:4] != FILE_MAGIC:
+                src.seek(0)
+                decrypted_data = _fernet.decrypt(src.read())
+                with open(output_path, 'wb') as f:
+                    f.write(decrypted_data)
+                return output_path
+            aead, chunk_size = _open_file_header(header, key)
+            with open(part_path, 'wb') as dst:
+                full = chunk_size + TAG_SIZE
+                workers = FILE_WORKERS if workers is None else workers
+                if workers > 1:
+                    _run_chunks(src, dst, full, -TAG_SIZE, partial(_open_chunk, aead, header),
+                                workers)
+                else:
+                    _open_stream(src, dst, aead, header, full)
+        os.replace(part_path, output_path)
         return output_path
     except Exception as e:
         print(f"File decryption error: {e}")
-        return None
\ No newline at end of file
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        return None
+
+def _fill(f, buf):
+    """Lê até encher buf (menos só no fim do arquivo); retorna os bytes lidos"""
+    view = memoryview(buf)
+    total = 0
+    while total < len(buf):
+        n = f.readinto(view[total:])
+        if not n:
+            break
+        total += n
+    return total
+
+def _chunk_nonce(index, last):
+    return CHUNK_NONCE.pack(index, last)
+
+def _encrypt_into(aead, nonce, data, aad, out):
+    """aead.encrypt_into quando existe (versões novas do cryptography); senão copia para out"""
+    if hasattr(aead, 'encrypt_into'):
+        aead.encrypt_into(nonce, data, aad, out)
+    else:
+        out[:] = aead.encrypt(nonce, bytes(data), aad)
+
+def _decrypt_into(aead, nonce, data, aad, out):
+    if hasattr(aead, 'decrypt_into'):
+        aead.decrypt_into(nonce, data, aad, out)
+    else:
+        out[:] = aead.decrypt(nonce, bytes(data), aad)
+
+def _seal_chunk(aead, aad, index, last, data, out):
+    _encrypt_into(aead, _chunk_nonce(index, last), data, aad, out)
+
+def _open_chunk(aead, aad, index, last, data, out):
+    try:
+        _decrypt_into(aead, _chunk_nonce(index, last), data, aad, out)
+    except InvalidTag:
+        raise CryptoError(f'Bloco {index} adulterado, truncado ou fora de ordem')
+
+def _seal_stream(src, dst, aead, aad, chunk_size):
+    """Cifra src em dst numa thread só, sem alocar por bloco"""
+    current, ahead = bytearray(chunk_size), bytearray(chunk_size)
+    out = memoryview(bytearray(chunk_size + TAG_SIZE))
+    size = _fill(src, current)
+    index = 0
+    while True:
+        # Lê um bloco à frente para saber se o atual é o último
+        ahead_size = _fill(src, ahead) if size == chunk_size else 0
+        last = ahead_size == 0
+        sealed = out[:size + TAG_SIZE]
+        _encrypt_into(aead, _chunk_nonce(index, last), memoryview(current)[:size], aad, sealed)
+        dst.write(sealed)
+        if last:
+            return
+        current, ahead, size = ahead, current, ahead_size
+        index += 1
+
+def _open_stream(src, dst, aead, aad, full):
+    """Decifra src (blocos de full bytes com a tag) em dst numa thread só"""
+    current, ahead = bytearray(full), bytearray(full)
+    out = memoryview(bytearray(full - TAG_SIZE))
+    size = _fill(src, current)
+    index = 0
+    while True:
+        if size < TAG_SIZE:
+            raise CryptoError('Arquivo truncado')
+        ahead_size = _fill(src, ahead) if size == full else 0
+        last = ahead_size == 0
+        plain = out[:size - TAG_SIZE]
+        try:
+            _decrypt_into(aead, _chunk_nonce(index, last), memoryview(current)[:size], aad, plain)
+        except InvalidTag:
+            raise CryptoError(f'Bloco {index} adulterado, truncado ou fora de ordem')
+        dst.write(plain)
+        if last:
+            return
+        current, ahead, size = ahead, current, ahead_size
+        index += 1
+
+def _run_batch(job, size, grow, first, last, data):
+    """Aplica job aos blocos de um lote; só o último bloco do último lote é final"""
+    count = max(1, -(-len(data) // size))
+    if len(data) - (count - 1) * size + grow < 0:
+        raise CryptoError('Arquivo truncado')
+    out = bytearray(len(data) + count * grow)
+    view, target = memoryview(data), memoryview(out)
+    for i in range(count):
+        chunk = view[i * size:(i + 1) * size]
+        start = i * (size + grow)
+        job(first + i, last and i == count - 1, chunk, target[start:start + len(chunk) + grow])
+    return out
+
+def _run_chunks(src, dst, size, grow, job, workers):
+    """
+    Passa os blocos de size bytes de src por job(índice, último, bloco,
+    saída) em workers threads, em lotes de FILE_BATCH, e escreve as saídas
+    (grow bytes maiores que cada bloco) em dst, na ordem.
+    """
+    batch = size * FILE_BATCH
+    pending = deque()
+    with ThreadPoolExecutor(workers) as pool:
+        try:
+            data = src.read(batch)
+            index = 0
+            while True:
+                ahead = src.read(batch) if len(data) == batch else b''
+                last = not ahead
+                pending.append(pool.submit(_run_batch, job, size, grow, index, last, data))
+                if len(pending) >= workers * FILE_DEPTH:
+                    dst.write(pending.popleft().result())
+                if last:
+                    break
+                data = ahead
+                index += FILE_BATCH
+            while pending:
+                dst.write(pending.popleft().result())
+        finally:
+            for future in pending:
+                future.cancel()
+
+def _file_aead(cipher, salt, key):
+    """AEAD do arquivo: chave derivada do segredo com o sal do cabeçalho"""
+    secret = key if key is not None else base64.urlsafe_b64decode(_key)
+    file_key = HKDF(
+        algorithm=hashes.SHA256(), length=32,
+        salt=salt, info=b'winp2p file ' + cipher.encode('ascii')
+    ).derive(secret)
+    return CIPHERS[cipher](file_key)
+
+def _new_file_header(cipher, chunk_size, key):
+    header = FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, FILE_CIPHERS.index(cipher),
+                              chunk_size, os.urandom(16))
+    return header, _file_aead(cipher, header[-16:], key)
+
+def _open_file_header(header, key):
+    """(AEAD, tamanho do bloco) de um cabeçalho lido do arquivo"""
+    if len(header) < FILE_HEADER.size:
+        raise CryptoError('Cabeçalho truncado')
+    _, version, cipher_id, chunk_size, salt = FILE_HEADER.unpack(header)
+    if version != FILE_VERSION or cipher_id >= len(FILE_CIPHERS) or not chunk_size:
+        raise CryptoError(f'Formato não suportado: versão {version}, cifra {cipher_id}')
+    return _file_aead(FILE_CIPHERS[cipher_id], salt, key), chunk_size
+
+
+class CryptoError(Exception):
+    """Chave pública inválida, payload adulterado ou repetido"""
+
+
+def negotiate_cipher(offered, supported=None):
+    """Primeira cifra da nossa preferência oferecida pelo outro lado (ou None)"""
+    for name in DEFAULT_CIPHERS if supported is None else supported:
+        if name in offered and name in CIPHERS:
+            return name
+    return None
+
+
+class KeyExchange:
+    """
+    Par de chaves X25519 efêmero, um por conexão.
+
+    Os dois lados trocam as chaves públicas no hello e derivam, com HKDF
+    sobre o segredo compartilhado, uma chave para cada sentido. Não há
+    autenticação: protege contra quem só escuta, não contra quem se põe
+    no meio da conexão (salas com senha usam utils.pake).
+    """
+
+    def __init__(self):
+        self._private = X25519PrivateKey.generate()
+        self.public = self._private.public_key().public_bytes(Encoding.Raw, PublicFormat.Raw)
+
+    def public_b64(self):
+        return base64.b64encode(self.public).decode('ascii')
+
+    def derive(self, peer_public, cipher, initiator):
+        """SessionCipher para a chave pública (base64) do outro lado"""
+        try:
+            raw = base64.b64decode(peer_public, validate=True)
+            shared = self._private.exchange(X25519PublicKey.from_public_bytes(raw))
+        except (ValueError, TypeError) as e:
+            raise CryptoError(f'Chave pública inválida: {e}')
+        ours, theirs = (self.public, raw) if initiator else (raw, self.public)
+        return session_cipher(shared, ours + theirs, cipher, initiator)
+
+
+def session_cipher(secret, salt, cipher, initiator):
+    """SessionCipher com as chaves dos dois sentidos derivadas (HKDF) do segredo"""
+    keys = HKDF(
+        algorithm=hashes.SHA256(), length=96,
+        salt=salt, info=b'winp2p session ' + cipher.encode('ascii')
+    ).derive(secret)
+    # Primeiro terço: quem abriu a conexão -> quem aceitou; o último é o
+    # da retomada, igual nos dois lados
+    if initiator:
+        return SessionCipher(cipher, keys[:32], keys[32:64], keys[64:])
+    return SessionCipher(cipher, keys[32:64], keys[:32], keys[64:])
+
+
+class SessionCipher:
+    """
+    Cifra AEAD de uma conexão, com uma chave por sentido.
+
+    O nonce é um contador de 64 bits enviado à frente do texto cifrado,
+    sem base64: são OVERHEAD bytes por payload. Quem recebe aceita cada
+    contador uma vez só, dentro de uma janela de REPLAY_WINDOW (a fila de
+    saída pode trocar a ordem de alguns frames).
+
+    A chave de retomada identifica a sessão (session_id, que por isso não
+    precisa ir no hello em claro) e assina as provas de que uma conexão
+    nova é do mesmo par (proof/verify), ao retomar ou abrir um canal.
+    """
+
+    def __init__(self, name, send_key, recv_key, resume_key=None):
+        self.name = name
+        self._send = CIPHERS[name](send_key)
+        self._recv = CIPHERS[name](recv_key)
+        self._resume = resume_key or os.urandom(32)
+        self.session_id = hmac.new(self._resume, b'session id', hashlib.sha256).hexdigest()[:32]
+        self.sent = 0
+        self.highest = -1
+        self.window = 0
+
+    def proof(self, data):
+        """HMAC (base64) de data com a chave de retomada"""
+        digest = hmac.new(self._resume, bytes(data), hashlib.sha256).digest()
+        return base64.b64encode(digest).decode('ascii')
+
+    def verify(self, data, proof):
+        return isinstance(proof, str) and hmac.compare_digest(self.proof(data), proof)
+
+    def seal(self, data, aad=b''):
+        prefix = COUNTER.pack(self.sent)
+        self.sent += 1
+        return prefix + self._send.encrypt(b'\0\0\0\0' + prefix, bytes(data), aad)
+
+    def open(self, data, aad=b''):
+        if len(data) < OVERHEAD:
+            raise CryptoError('Payload cifrado truncado')
+        counter = COUNTER.unpack_from(data)[0]
+        offset = self.highest - counter
+        if offset >= REPLAY_WINDOW or (offset >= 0 and self.window >> offset & 1):
+            raise CryptoError(f'Contador repetido ou antigo: {counter}')
+        try:
+            plain = self._recv.decrypt(b'\0\0\0\0' + bytes(data[:COUNTER.size]),
+                                       bytes(data[COUNTER.size:]), aad)
+        except InvalidTag:
+            raise CryptoError('Falha na autenticação do payload')
+        if offset < 0:
+            self.window = ((self.window << -offset) | 1) & ((1 << REPLAY_WINDOW) - 1)
+            self.highest = counter
+        else:
+            self.window |= 1 << offset
+        return plain
+
+
+class EncryptedFile:
+    """
+    Leitura aleatória de um arquivo de encrypt_file, sem decifrá-lo todo.
+
+    O arquivo é mapeado em memória e, como os blocos têm tamanho fixo, a
+    posição de cada um vem do índice: read(offset, size) decifra só os
+    blocos que cobrem o trecho. Os últimos cache blocos decifrados ficam
+    num LRU. O último bloco é verificado ao abrir, então size é
+    autenticado (arquivo truncado ou estendido não abre).
+    """
+
+    def __init__(self, path, key=None, cache=FILE_CACHE):
+        self._file = open(path, 'rb')
+        self._map = None
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._aad = self._map[:FILE_HEADER.size]
+            if self._aad[:4] != FILE_MAGIC:
+                raise CryptoError('Formato sem acesso aleatório (token Fernet)')
+            self._aead, self.chunk_size = _open_file_header(self._aad, key)
+            self._full = self.chunk_size + TAG_SIZE
+            body = len(self._map) - FILE_HEADER.size
+            self.chunks = max(1, -(-body // self._full))
+            tail = body - (self.chunks - 1) * self._full
+            if tail < TAG_SIZE:
+                raise CryptoError('Arquivo truncado')
+            self.size = (self.chunks - 1) * self.chunk_size + tail - TAG_SIZE
+            self.cache_size = max(1, cache)
+            self._cache = OrderedDict()  # índice -> bloco, do menos ao mais usado
+            self._chunk(self.chunks - 1)
+        except (ValueError, CryptoError):
+            # ValueError: arquivo vazio não pode ser mapeado
+            self.close()
+            raise CryptoError(f'Arquivo cifrado inválido: {path}') from None
+
+    def __len__(self):
+        return self.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def _chunk(self, index):
+        data = self._cache.get(index)
+        if data is not None:
+            self._cache.move_to_end(index)
+            return data
+        start = FILE_HEADER.size + index * self._full
+        try:
+            data = self._aead.decrypt(_chunk_nonce(index, index == self.chunks - 1),
+                                      self._map[start:start + self._full], self._aad)
+        except InvalidTag:
+            raise CryptoError(f'Bloco {index} adulterado')
+        self._cache[index] = data
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return data
+
+    def read(self, offset=0, size=-1):
+        """Até size bytes do texto a partir de offset (size < 0: até o fim)"""
+        offset = min(max(0, offset), self.size)
+        end = self.size if size < 0 else min(self.size, offset + size)
+        if end <= offset:
+            return b''
+        first, last = offset // self.chunk_size, (end - 1) // self.chunk_size
+        parts = []
+        for index in range(first, last + 1):
+            base = index * self.chunk_size
+            data = self._chunk(index)
+            parts.append(data[max(0, offset - base):end - base])
+        return parts[0] if len(parts) == 1 else b''.join(parts)
@@ -0,0 +1,144 @@
+"""
+Handshake autenticado pela senha da sala (CPace sobre X25519).
+
+A senha passa uma vez por scrypt (memory-hard) e vira a chave da sala,
+guardada só em memória enquanto o processo roda. Dessa chave sai um
+gerador da curva (hash + Elligator2) e cada lado manda sua parte
+efêmera, como no X25519 comum. Só quem usou a mesma senha chega ao mesmo
+segredo; quem está no meio da conexão pode testar uma senha por
+tentativa, mas não leva nada para testar senhas offline.
+"""
+import hmac
+import base64
+import hashlib
+import threading
+
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey, X25519PublicKey
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+
+from utils.crypto import CryptoError, session_cipher
+
+# Custo do scrypt: ~32 MiB de memória por derivação
+SCRYPT_N = 2 ** 15
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+# Curve25519 (forma de Montgomery) e parâmetros do Elligator2 (RFC 9380)
+P = 2 ** 255 - 19
+A = 486662
+Z = 2
+
+# Separação de domínio e identificador do canal do CPace
+DSI = b'CPace255'
+CI = b'winp2p'
+
+_keys = {}  # (sala, sha256 da senha) -> chave da sala
+_lock = threading.Lock()
+
+
+def room_key(room_id, password):
+    """
+    Chave da sala derivada da senha; o scrypt roda uma vez por par
+    (sala, senha) e o resultado fica em cache para reconexões e outros
+    peers. A senha em si não fica guardada.
+    """
+    if isinstance(password, str):
+        password = password.encode('utf-8')
+    room = room_id.encode('utf-8')
+    cache_key = (room_id, hashlib.sha256(password).digest())
+    with _lock:
+        key = _keys.get(cache_key)
+        if key is None:
+            key = Scrypt(
+                salt=b'winp2p room ' + room, length=32,
+                n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P
+            ).derive(password)
+            _keys[cache_key] = key
+    return key
+
+
+def clear_room_keys():
+    """Esquece as chaves de sala derivadas (ex.: ao trocar a senha)"""
+    with _lock:
+        _keys.clear()
+
+
+def _lv(data):
+    """Campo com prefixo de tamanho (LEB128), como no CPace"""
+    size = len(data)
+    prefix = bytearray()
+    while True:
+        byte = size & 0x7f
+        size >>= 7
+        prefix.append(byte | (0x80 if size else 0))
+        if not size:
+            return bytes(prefix) + data
+
+
+def _elligator2(r):
+    """Coordenada u do ponto da curva para o elemento r (RFC 9380, 6.7.1)"""
+    x1 = -A * pow(1 + Z * r * r, P - 2, P) % P
+    if x1 == 0:
+        x1 = -A % P
+    x2 = (-x1 - A) % P
+    gx1 = (x1 * x1 * x1 + A * x1 * x1 + x1) % P
+    # Critério de Euler: gx1 é quadrado (ou zero) se gx1^((p-1)/2) != -1
+    x = x1 if pow(gx1, (P - 1) // 2, P) != P - 1 else x2
+    return x.to_bytes(32, 'little')
+
+
+def _generator(key):
+    """Gerador da curva derivado da chave da sala (a sala já está no sal)"""
+    prefix = _lv(DSI) + _lv(key)
+    zpad = bytes(max(0, 128 - 1 - len(prefix)))
+    digest = hashlib.sha512(prefix + _lv(zpad) + _lv(CI)).digest()
+    r = int.from_bytes(digest[:32], 'little') & ((1 << 255) - 1)
+    return X25519PublicKey.from_public_bytes(_elligator2(r % P))
+
+
+class PasswordExchange:
+    """
+    Um lado do CPace, com a mesma interface de utils.crypto.KeyExchange.
+
+    Depois de derive, proof() é a confirmação a mandar ao outro lado e
+    verify() confere a dele: com senhas diferentes as duas falham.
+    """
+
+    def __init__(self, key):
+        self._private = X25519PrivateKey.generate()
+        try:
+            self.public = self._private.exchange(_generator(key))
+        except ValueError as e:
+            raise CryptoError(f'Gerador inválido: {e}')
+        self._ours = self._theirs = None
+
+    def public_b64(self):
+        return base64.b64encode(self.public).decode('ascii')
+
+    def derive(self, peer_public, cipher, initiator):
+        """SessionCipher para a parte (base64) do outro lado"""
+        try:
+            raw = base64.b64decode(peer_public, validate=True)
+            shared = self._private.exchange(X25519PublicKey.from_public_bytes(raw))
+        except (ValueError, TypeError) as e:
+            raise CryptoError(f'Parte inválida no handshake: {e}')
+        first, second = (self.public, raw) if initiator else (raw, self.public)
+        transcript = _lv(first) + _lv(second)
+        isk = hashlib.sha512(_lv(DSI + b'_ISK') + _lv(shared) + transcript).digest()
+        confirm = {
+            role: hmac.new(isk, role + transcript, hashlib.sha256).digest()
+            for role in (b'initiator', b'responder')
+        }
+        self._ours = confirm[b'initiator' if initiator else b'responder']
+        self._theirs = confirm[b'responder' if initiator else b'initiator']
+        return session_cipher(isk, first + second, cipher, initiator)
+
+    def proof(self):
+        return base64.b64encode(self._ours).decode('ascii')
+
+    def verify(self, proof):
+        try:
+            raw = base64.b64decode(proof or '', validate=True)
+        except (ValueError, TypeError):
+            return False
+        return self._theirs is not None and hmac.compare_digest(raw, self._theirs)